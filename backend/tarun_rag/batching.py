@@ -0,0 +1,88 @@
+# batching.py
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, List
+
+import metrics
+
+
+class MicroBatcher:
+    """Coalesce concurrent single-item requests into one batched call.
+
+    Items submitted within `max_wait_ms` of the first pending item (or until
+    `max_batch_size` items are waiting) are handed to `handler` as one list;
+    each caller gets back the result at its own position. An exception
+    returned at a position is raised for that caller only. Stage timings
+    recorded while a batch runs are added to every caller's request timings.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[List[Any]], Awaitable[List[Any]]],
+        max_batch_size: int = 32,
+        max_wait_ms: float = 5.0,
+        name: str = "batch",
+    ):
+        self.handler = handler
+        self.name = name
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait_ms = max(0.0, max_wait_ms)
+        self._pending = []  # (item, future, submitted at, caller's request timings)
+        self._timer = None
+        self._running = set()  # keep flush tasks referenced until they finish
+
+    async def submit(self, item: Any) -> Any:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future, time.perf_counter(), metrics.current_timings()))
+
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait_ms / 1000.0, self._flush)
+
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        batch, self._pending = self._pending[:self.max_batch_size], self._pending[self.max_batch_size:]
+        if self._pending:
+            # leftovers start a fresh window instead of waiting for the next submit
+            self._timer = asyncio.get_running_loop().call_later(self.max_wait_ms / 1000.0, self._flush)
+        if not batch:
+            return
+
+        task = asyncio.ensure_future(self._run(batch))
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+
+    async def _run(self, batch):
+        started = time.perf_counter()
+        metrics.BATCH_SIZE.observe(len(batch), batcher=self.name)
+        for _, _, submitted, caller_timings in batch:
+            metrics.BATCH_WAIT_SECONDS.observe(started - submitted, batcher=self.name)
+            metrics.merge_timings(caller_timings, {f"{self.name}_batch_wait": started - submitted})
+
+        try:
+            with metrics.collect_timings() as batch_timings:
+                results = await self.handler([item for item, *_ in batch])
+        except Exception as e:
+            for _, future, *_ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            for *_, caller_timings in batch:
+                metrics.merge_timings(caller_timings, batch_timings)
+
+        for (_, future, *_), result in zip(batch, results):
+            # the caller may have gone away (client disconnect cancels its future)
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
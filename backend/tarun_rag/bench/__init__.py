@@ -0,0 +1,2 @@
+"""Benchmarks for the RAG stack. Run modules from backend/tarun_rag, e.g.
+`python -m bench.vector_backends --index vector_db`."""
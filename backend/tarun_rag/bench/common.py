@@ -0,0 +1,79 @@
+"""Shared helpers for the benchmark suite: latency summaries, memory peaks and JSON reports."""
+import json
+import platform
+import resource
+import sys
+import time
+from pathlib import Path
+from typing import Iterable, Optional
+
+import numpy as np
+
+
+def latency_summary(latencies_ms: Iterable[float]) -> dict:
+    """p50/p95/p99/mean/max of per-request latencies, in milliseconds"""
+    values = np.asarray(list(latencies_ms), dtype=np.float64)
+    if not len(values):
+        return {"count": 0}
+    return {
+        "count": int(len(values)),
+        "p50_ms": round(float(np.percentile(values, 50)), 3),
+        "p95_ms": round(float(np.percentile(values, 95)), 3),
+        "p99_ms": round(float(np.percentile(values, 99)), 3),
+        "mean_ms": round(float(values.mean()), 3),
+        "max_ms": round(float(values.max()), 3),
+    }
+
+
+def timed(fn, *args, **kwargs):
+    """(result, elapsed milliseconds) of one call"""
+    t0 = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, (time.perf_counter() - t0) * 1000
+
+
+def peak_rss_mb(pid: Optional[int] = None) -> Optional[float]:
+    """Peak resident set of this process (or of `pid`, from /proc on Linux)"""
+    if pid is None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kilobytes on Linux, bytes on macOS
+        return round(peak / (1024 ** 2 if sys.platform == "darwin" else 1024), 1)
+    try:
+        with open(f"/proc/{pid}/status", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+def peak_vram_mb() -> Optional[float]:
+    """Peak CUDA memory allocated by torch in this process, or None without torch/CUDA"""
+    try:
+        import torch
+    except ImportError:
+        return None
+    if not torch.cuda.is_available():
+        return None
+    return round(torch.cuda.max_memory_allocated() / 1024 ** 2, 1)
+
+
+def memory_peaks() -> dict:
+    return {"peak_rss_mb": peak_rss_mb(), "peak_vram_mb": peak_vram_mb()}
+
+
+def run_info(args) -> dict:
+    return {
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "host": platform.node(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "args": {k: v for k, v in vars(args).items() if k != "json"},
+    }
+
+
+def write_report(report: dict, path: Optional[str]):
+    print(json.dumps(report, indent=2))
+    if path:
+        Path(path).write_text(json.dumps(report, indent=2), encoding="utf-8")
@@ -0,0 +1,107 @@
+"""Compare two benchmark reports (bench.suite or any bench.* --json output) and flag regressions.
+
+    python -m bench.compare baseline.json candidate.json --tolerance 0.10
+
+Numeric leaves are matched by their path in the JSON. Direction is taken from
+the name: `*_ms`, `*_s`, `*_mb` and `failed` are better lower; `*qps`,
+`*_per_s`, `*_rps` and `recall*` are better higher; anything else (counts,
+settings, single-outlier `max_*`) is shown only with --all. A metric regresses when it is worse by more than
+`--tolerance` (relative) or, for recall, by more than `--recall-tolerance`
+(absolute). The exit status is 1 if anything regressed, so this can gate CI.
+"""
+import argparse
+import json
+import sys
+from typing import Dict, Optional
+
+LOWER_IS_BETTER = ("_ms", "_s", "_mb")
+HIGHER_IS_BETTER = ("qps", "_per_s", "_rps")
+
+
+def flatten(report, prefix: str = "") -> Dict[str, float]:
+    """{"http.search.vector.c=4.p95_ms": 12.3, ...}; lists are indexed by position"""
+    if isinstance(report, dict):
+        items = report.items()
+    elif isinstance(report, list):
+        items = ((str(i), v) for i, v in enumerate(report))
+    else:
+        if isinstance(report, (int, float)) and not isinstance(report, bool):
+            return {prefix: float(report)}
+        return {}
+    out = {}
+    for key, value in items:
+        if prefix == "" and key == "run":
+            continue
+        out.update(flatten(value, f"{prefix}.{key}" if prefix else str(key)))
+    return out
+
+
+def direction(path: str) -> Optional[int]:
+    """+1 if higher is better, -1 if lower is better, None if the metric isn't a performance number"""
+    name = path.rsplit(".", 1)[-1]
+    if name.startswith("recall"):
+        return 1
+    if name.startswith("max_"):
+        return None  # one outlier; the percentiles carry the signal
+    if name == "failed":
+        return -1
+    if name.endswith(HIGHER_IS_BETTER):
+        return 1
+    if name.endswith(LOWER_IS_BETTER):
+        return -1
+    return None
+
+
+def compare(baseline: dict, candidate: dict, tolerance: float, recall_tolerance: float) -> list:
+    before, after = flatten(baseline), flatten(candidate)
+    rows = []
+    for path in sorted(set(before) & set(after)):
+        old, new = before[path], after[path]
+        sign = direction(path)
+        change = (new - old) / abs(old) if old else (0.0 if new == old else float("inf"))
+        if sign is None:
+            status = "info"
+        elif path.rsplit(".", 1)[-1].startswith("recall"):
+            status = "REGRESSED" if old - new > recall_tolerance else ("improved" if new > old else "ok")
+        elif sign * change < -tolerance:
+            status = "REGRESSED"
+        elif sign * change > tolerance:
+            status = "improved"
+        else:
+            status = "ok"
+        rows.append({"metric": path, "baseline": old, "candidate": new, "change": change, "status": status})
+    return rows
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("baseline")
+    p.add_argument("candidate")
+    p.add_argument("--tolerance", type=float, default=0.10, help="allowed relative slowdown (0.10 = 10%%)")
+    p.add_argument("--recall-tolerance", type=float, default=0.01, help="allowed absolute recall drop")
+    p.add_argument("--all", action="store_true", help="also list unchanged and non-performance numbers")
+    p.add_argument("--json", help="also write the comparison to this path")
+    args = p.parse_args()
+
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    with open(args.candidate, encoding="utf-8") as f:
+        candidate = json.load(f)
+    rows = compare(baseline, candidate, args.tolerance, args.recall_tolerance)
+
+    for row in rows:
+        if args.all or row["status"] in ("REGRESSED", "improved"):
+            print(f"{row['status']:>9}  {row['metric']}: {row['baseline']:g} -> {row['candidate']:g} "
+                  f"({row['change']:+.1%})")
+    regressed = [row for row in rows if row["status"] == "REGRESSED"]
+    print(f"{len(rows)} metrics compared, {len(regressed)} regressed, "
+          f"{sum(row['status'] == 'improved' for row in rows)} improved")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(rows, f, indent=2)
+    sys.exit(1 if regressed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""Per-phase img2img timings for each diffusion offload mode.
+
+    python -m bench.diffusion_offload --image diffusion_sample/image.png --modes gpu model sequential
+
+Each mode gets a fresh engine (so `load` is measured), one warm-up run and
+`--runs` timed runs. Modes that don't fit in VRAM report the error instead.
+"""
+import argparse
+
+from bench.common import run_info, write_report
+from diffusion_engine import DiffusionEngine, PHASES, default_model_id
+
+
+def run_mode(mode: str, raw: bytes, args) -> dict:
+    engine = DiffusionEngine(max_resident=1, offload=mode)
+    params = dict(
+        prompt=args.prompt, height=args.height, width=args.width, guidance_scale=args.guidance_scale,
+        num_inference_steps=args.steps, seed=0, model_id=args.model_id,
+    )
+    try:
+        _, first = engine.img2img(raw, **params)
+        runs = [engine.img2img(raw, **params)[1] for _ in range(args.runs)]
+    except Exception as e:
+        return {"error": f"{type(e).__name__}: {getattr(e, 'detail', e)}"}
+    finally:
+        resident = engine.stats()["resident"]
+        engine.clear()
+
+    report = {"resolved_mode": resident[0]["offload"] if resident else None, "load_s": round(first.get("load", 0.0), 2)}
+    for phase in PHASES:
+        if phase != "load" and any(phase in r for r in runs):
+            report[f"{phase}_ms"] = round(1000 * sum(r.get(phase, 0.0) for r in runs) / len(runs), 1)
+    return report
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--image", required=True)
+    p.add_argument("--prompt", default="a watercolor painting of the Golden Gate Bridge")
+    p.add_argument("--model-id", default=default_model_id())
+    p.add_argument("--modes", nargs="+", default=["gpu", "model", "sequential"])
+    p.add_argument("--height", type=int, default=1024)
+    p.add_argument("--width", type=int, default=576)
+    p.add_argument("--steps", type=int, default=4)
+    p.add_argument("--guidance-scale", type=float, default=10.0)
+    p.add_argument("--runs", type=int, default=3)
+    p.add_argument("--json", help="also write the report to this path")
+    args = p.parse_args()
+
+    with open(args.image, "rb") as f:
+        raw = f.read()
+    report = {mode: run_mode(mode, raw, args) for mode in args.modes}
+    write_report({"run": run_info(args), **report}, args.json)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""Document embedding throughput: fixed 32-text batches in corpus order vs length-bucketed token-budget batches.
+
+    python -m bench.embed_batching --index vector_db --limit 4096 --budgets 8192 16384 32768
+
+Texts come from `documents.jsonl` of a built index (first `--limit` rows, so
+the mix of short and long categories is the real one). For each path it
+reports real tokens/sec, the share of padded tokens per forward pass and peak
+CUDA memory. The embeddings of each bucketed run are checked against the
+fixed-batch ones (max abs difference), since reordering must not change them.
+"""
+import argparse
+import json
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+
+from bench.common import run_info, write_report
+from embedding_service import NemotronEmbeddingService
+
+
+def load_texts(index_dir: str, limit: int):
+    texts = []
+    with open(Path(index_dir) / "documents.jsonl", encoding="utf-8") as f:
+        for line in f:
+            texts.append(json.loads(line)["text"])
+            if len(texts) >= limit:
+                break
+    return texts
+
+
+def padding_share(lengths: np.ndarray, batches) -> float:
+    padded = sum(int(lengths[rows].max()) * len(rows) for rows in batches)
+    return round(1 - int(lengths.sum()) / padded, 4)
+
+
+def measure(fn):
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+        torch.cuda.empty_cache()
+        torch.cuda.reset_peak_memory_stats()
+    start = time.perf_counter()
+    result = fn()
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    elapsed = time.perf_counter() - start
+    peak = torch.cuda.max_memory_allocated() / 1024 ** 2 if torch.cuda.is_available() else None
+    return result, elapsed, peak
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--index", default="vector_db")
+    p.add_argument("--limit", type=int, default=4096)
+    p.add_argument("--fixed-batch-size", type=int, default=32)
+    p.add_argument("--budgets", type=int, nargs="+", default=[8192, 16384, 32768])
+    p.add_argument("--json", help="also write the report to this path")
+    args = p.parse_args()
+
+    texts = load_texts(args.index, args.limit)
+    embedder = NemotronEmbeddingService()
+    lengths = np.minimum(embedder._token_lengths(texts), embedder.doc_max_length)
+    tokens = int(lengths.sum())
+    # one short warm-up so the first measured path doesn't pay for kernel setup
+    embedder.embed_documents(texts[:8])
+
+    def fixed():
+        out = []
+        with torch.inference_mode():
+            for start in range(0, len(texts), args.fixed_batch_size):
+                batch = texts[start:start + args.fixed_batch_size]
+                out.append(embedder.model.encode_documents(texts=batch).float().cpu().numpy())
+        return np.concatenate(out)
+
+    reference, elapsed, peak = measure(fixed)
+    fixed_batches = [np.arange(s, min(s + args.fixed_batch_size, len(texts))) for s in range(0, len(texts), args.fixed_batch_size)]
+    report = {
+        "texts": len(texts),
+        "tokens": tokens,
+        "fixed": {
+            "batch_size": args.fixed_batch_size,
+            "forward_passes": len(fixed_batches),
+            "tokens_per_s": round(tokens / elapsed, 1),
+            "padding_share": padding_share(lengths, fixed_batches),
+            "peak_cuda_mb": peak and round(peak, 1),
+        },
+        "bucketed": {},
+    }
+
+    for budget in args.budgets:
+        embedder.token_budget = budget
+        batches = embedder._length_batches(lengths, embedder.doc_max_length)
+        embeddings, elapsed, peak = measure(lambda: embedder.embed_documents(texts))
+        report["bucketed"][str(budget)] = {
+            "forward_passes": len(batches),
+            "tokens_per_s": round(tokens / elapsed, 1),
+            "speedup": round(report["fixed"]["tokens_per_s"] and tokens / elapsed / report["fixed"]["tokens_per_s"], 2),
+            "padding_share": padding_share(lengths, batches),
+            "peak_cuda_mb": peak and round(peak, 1),
+            "max_abs_diff_vs_fixed": float(np.abs(embeddings - reference).max()),
+        }
+
+    write_report({"run": run_info(args), **report}, args.json)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""Embedding drift and speed of each attention/precision/device mode vs the eager bf16 baseline.
+
+    python -m bench.embed_parity --index vector_db --limit 512 --modes cuda:sdpa:bf16 cuda:flash:bf16 cuda:sdpa:fp16 cpu:sdpa:int8
+
+A mode is device:attention:precision. The baseline is cuda:eager:bf16 (the
+service's old fixed setup), or cpu:eager:fp32 without a GPU. Each model is
+loaded on its own and freed before the next. For documents and queries it
+reports the cosine similarity to the baseline (mean, min), top-10 neighbour
+overlap of the queries against the documents, and texts/sec. A mode whose
+attention was rejected reports the backend it fell back to.
+"""
+import argparse
+import gc
+import time
+
+import numpy as np
+import torch
+
+from bench.common import run_info, write_report
+from bench.embed_batching import load_texts
+from embedding_service import NemotronEmbeddingService
+
+
+def embed_mode(mode: str, docs, queries) -> dict:
+    device, attention, precision = mode.split(":")
+    embedder = NemotronEmbeddingService(device=device, attention=attention, precision=precision)
+    try:
+        start = time.perf_counter()
+        doc_vectors = embedder.embed_documents(docs)
+        elapsed = time.perf_counter() - start
+        query_vectors = embedder.embed_queries(queries)
+        return {
+            "attention": embedder.attention,
+            "docs": doc_vectors,
+            "queries": query_vectors,
+            "docs_per_s": round(len(docs) / elapsed, 1),
+        }
+    finally:
+        del embedder
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+
+def cosine(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    a = a / np.linalg.norm(a, axis=1, keepdims=True)
+    b = b / np.linalg.norm(b, axis=1, keepdims=True)
+    return (a * b).sum(axis=1)
+
+
+def top_k(queries: np.ndarray, docs: np.ndarray, k: int) -> np.ndarray:
+    return np.argsort(-(queries @ docs.T), axis=1)[:, :k]
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--index", default="vector_db")
+    p.add_argument("--limit", type=int, default=512)
+    p.add_argument("--queries", nargs="+", default=[
+        "golden gate bridge", "mission district murals", "coffee near dolores park",
+        "public restrooms open late", "farmers market on saturday", "parking garage downtown",
+    ])
+    p.add_argument("--modes", nargs="+", default=["cuda:sdpa:bf16", "cuda:flash:bf16", "cuda:sdpa:fp16", "cpu:sdpa:int8"])
+    p.add_argument("--baseline", default=None, help="default: cuda:eager:bf16, or cpu:eager:fp32 without a GPU")
+    p.add_argument("--k", type=int, default=10)
+    p.add_argument("--json", help="also write the report to this path")
+    args = p.parse_args()
+
+    docs = load_texts(args.index, args.limit)
+    baseline_mode = args.baseline or ("cuda:eager:bf16" if torch.cuda.is_available() else "cpu:eager:fp32")
+    baseline = embed_mode(baseline_mode, docs, args.queries)
+    baseline_top = top_k(baseline["queries"], baseline["docs"], args.k)
+
+    report = {"baseline": {"mode": baseline_mode, "docs_per_s": baseline["docs_per_s"]}, "modes": {}}
+    for mode in args.modes:
+        if mode.startswith("cuda:") and not torch.cuda.is_available():
+            report["modes"][mode] = {"error": "no CUDA device"}
+            continue
+        try:
+            result = embed_mode(mode, docs, args.queries)
+        except Exception as e:
+            report["modes"][mode] = {"error": f"{type(e).__name__}: {e}"}
+            continue
+        doc_cos = cosine(result["docs"], baseline["docs"])
+        query_cos = cosine(result["queries"], baseline["queries"])
+        mode_top = top_k(result["queries"], result["docs"], args.k)
+        overlap = np.mean([len(set(a) & set(b)) / args.k for a, b in zip(mode_top, baseline_top)])
+        report["modes"][mode] = {
+            "attention_used": result["attention"],
+            "docs_per_s": result["docs_per_s"],
+            "speedup": round(result["docs_per_s"] / baseline["docs_per_s"], 2),
+            "doc_cosine": {"mean": round(float(doc_cos.mean()), 6), "min": round(float(doc_cos.min()), 6)},
+            "query_cosine": {"mean": round(float(query_cos.mean()), 6), "min": round(float(query_cos.min()), 6)},
+            f"top{args.k}_overlap": round(float(overlap), 4),
+        }
+
+    write_report({"run": run_info(args), **report}, args.json)
+
+
+if __name__ == "__main__":
+    main()
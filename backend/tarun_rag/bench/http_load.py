@@ -0,0 +1,188 @@
+"""Closed-loop HTTP load generator for /search, /flux2klein/img2img and /tts.
+
+    python -m bench.http_load search --url http://localhost:9005 --concurrency 1 4 16 --requests 200
+    python -m bench.http_load img2img --url http://localhost:9006 --concurrency 1 4 --requests 16
+    python -m bench.http_load tts --url http://localhost:19000 --concurrency 1 4 --requests 32
+
+`concurrency` workers each keep one keep-alive connection and send their next
+request as soon as the previous one returns. Every request is distinct (query
+text, seed or sentence), so neither the result caches nor the diffusion result
+store can answer it. Reports latency percentiles of successful requests,
+throughput and error/status counts per concurrency level.
+"""
+import argparse
+import http.client
+import io
+import itertools
+import json
+import threading
+import time
+import urllib.parse
+import uuid
+from typing import Callable, List, Tuple
+
+from bench.common import latency_summary, run_info, write_report
+from bench.vector_backends import SAMPLE_QUERIES
+
+# (method, path with query string, body, headers)
+Request = Tuple[str, str, bytes, dict]
+
+TTS_SENTENCES = [
+    "Welcome to Balmy Alley in the Mission District.",
+    "Since the nineteen seventies, artists have covered its garage doors and fences with murals.",
+    "Walk slowly and look up, because some of the best work is high on the walls.",
+    "The cable car turnaround at Powell and Market is a short walk from here.",
+]
+
+
+def _connect(url: str, timeout: float) -> http.client.HTTPConnection:
+    parts = urllib.parse.urlsplit(url)
+    cls = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+    return cls(parts.hostname, parts.port, timeout=timeout)
+
+
+def run_load(url: str, make_request: Callable[[int], Request], total: int, concurrency: int,
+             timeout: float = 300.0) -> dict:
+    """Send `total` requests from `concurrency` workers; latencies are per request, in ms"""
+    base_path = urllib.parse.urlsplit(url).path.rstrip("/")
+    counter = itertools.count()
+    lock = threading.Lock()
+    latencies: List[float] = []
+    statuses = {}
+    errors = []
+
+    def worker():
+        conn = _connect(url, timeout)
+        while True:
+            with lock:
+                i = next(counter)
+            if i >= total:
+                break
+            method, path, body, headers = make_request(i)
+            t0 = time.perf_counter()
+            try:
+                conn.request(method, base_path + path, body=body, headers=headers)
+                response = conn.getresponse()
+                response.read()
+                status = response.status
+            except (OSError, http.client.HTTPException) as e:
+                with lock:
+                    errors.append(f"{type(e).__name__}: {e}")
+                conn.close()
+                conn = _connect(url, timeout)
+                continue
+            elapsed = (time.perf_counter() - t0) * 1000
+            with lock:
+                statuses[status] = statuses.get(status, 0) + 1
+                if 200 <= status < 300:
+                    latencies.append(elapsed)
+        conn.close()
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(max(1, concurrency))]
+    t0 = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall_s = time.perf_counter() - t0
+
+    return {
+        "concurrency": concurrency,
+        **latency_summary(latencies),
+        "wall_s": round(wall_s, 3),
+        "throughput_rps": round(len(latencies) / wall_s, 2) if wall_s else 0.0,
+        "failed": total - len(latencies),
+        "status_counts": {str(code): n for code, n in sorted(statuses.items())},
+        "sample_errors": errors[:3],
+    }
+
+
+def search_request(top_k: int = 10, mode: str = "vector", fast: bool = False) -> Callable[[int], Request]:
+    def make(i: int) -> Request:
+        body = {"query": f"{SAMPLE_QUERIES[i % len(SAMPLE_QUERIES)]} {i}", "top_k": top_k, "mode": mode}
+        if fast:
+            body["fast"] = True
+        return "POST", "/search", json.dumps(body).encode("utf-8"), {"Content-Type": "application/json"}
+    return make
+
+
+def default_image(size: int = 512) -> bytes:
+    """A smooth RGB gradient as PNG, standing in for an uploaded photo"""
+    from PIL import Image
+
+    image = Image.linear_gradient("L").resize((size, size)).convert("RGB")
+    buf = io.BytesIO()
+    image.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def img2img_request(image: bytes, height: int = 256, width: int = 256, steps: int = 4,
+                    output_format: str = "png", path: str = "/flux2klein/img2img") -> Callable[[int], Request]:
+    boundary = uuid.uuid4().hex
+    body = (
+        f"--{boundary}\r\n"
+        'Content-Disposition: form-data; name="init_image"; filename="init.png"\r\n'
+        "Content-Type: image/png\r\n\r\n"
+    ).encode("utf-8") + image + f"\r\n--{boundary}--\r\n".encode("utf-8")
+    headers = {"Content-Type": f"multipart/form-data; boundary={boundary}"}
+
+    def make(i: int) -> Request:
+        query = urllib.parse.urlencode({
+            "prompt": "a mural on a garage door", "seed": i, "height": height, "width": width,
+            "num_inference_steps": steps, "output_format": output_format,
+        })
+        return "POST", f"{path}?{query}", body, headers
+    return make
+
+
+def tts_request(voice_url: str = "alba") -> Callable[[int], Request]:
+    def make(i: int) -> Request:
+        text = f"{TTS_SENTENCES[i % len(TTS_SENTENCES)]} Stop number {i}."
+        body = urllib.parse.urlencode({"text": text, "voice_url": voice_url}).encode("utf-8")
+        return "POST", "/tts", body, {"Content-Type": "application/x-www-form-urlencoded"}
+    return make
+
+
+def sweep(url: str, make_request, concurrency: List[int], requests_per_level: int, warmup: int = 2) -> dict:
+    """run_load at each concurrency level, after a few unmeasured warm-up requests.
+
+    Each level gets its own request numbers, so it can't hit what an earlier level cached.
+    """
+    if warmup:
+        run_load(url, lambda i: make_request(10 ** 9 + i), warmup, 1)
+    return {
+        f"c={c}": run_load(url, lambda i, offset=level * requests_per_level: make_request(offset + i),
+                           requests_per_level, c)
+        for level, c in enumerate(concurrency)
+    }
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("endpoint", choices=["search", "img2img", "tts"])
+    p.add_argument("--url", required=True, help="service base URL")
+    p.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    p.add_argument("--requests", type=int, default=100, help="requests per concurrency level")
+    p.add_argument("--top-k", type=int, default=10)
+    p.add_argument("--mode", default="vector", help="search mode: lexical, vector or hybrid")
+    p.add_argument("--image", help="img2img init image (default: a generated gradient)")
+    p.add_argument("--size", type=int, default=256, help="img2img output height and width")
+    p.add_argument("--steps", type=int, default=4)
+    p.add_argument("--voice-url", default="alba")
+    p.add_argument("--json", help="also write the report to this path")
+    args = p.parse_args()
+
+    if args.endpoint == "search":
+        make_request = search_request(args.top_k, args.mode)
+    elif args.endpoint == "img2img":
+        image = open(args.image, "rb").read() if args.image else default_image()
+        make_request = img2img_request(image, args.size, args.size, args.steps)
+    else:
+        make_request = tts_request(args.voice_url)
+
+    write_report({"run": run_info(args), args.endpoint: sweep(args.url, make_request, args.concurrency, args.requests)},
+                 args.json)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""Per-request image I/O cost for img2img: full decode + PNG vs draft decode + selectable output.
+
+    python -m bench.image_io --image photo.jpg --height 1024 --width 576
+
+Without --image a synthetic 4032x3024 phone-camera-sized JPEG is used. For
+each path it reports CPU milliseconds (process time) for decoding the upload
+(plus the resize the pipeline would do) and for encoding a target-sized
+result, and the encoded size in bytes.
+"""
+import argparse
+import io
+import time
+
+import numpy as np
+from PIL import Image
+
+from bench.common import run_info, write_report
+from image_io import OUTPUT_FORMATS, decode_image, encode_image
+
+
+def synthetic_photo(width: int = 4032, height: int = 3024) -> bytes:
+    """Smooth gradients plus sensor-like noise, saved the way a phone would (JPEG q90)"""
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    base = np.stack([x / width, y / height, (x + y) / (width + height)], axis=-1) * 200
+    noise = rng.normal(0, 12, size=(height, width, 3)).astype(np.float32)
+    pixels = np.clip(base + noise, 0, 255).astype(np.uint8)
+    buf = io.BytesIO()
+    Image.fromarray(pixels).save(buf, format="JPEG", quality=90)
+    return buf.getvalue()
+
+
+def cpu_ms(fn, runs: int):
+    result = fn()
+    start = time.process_time()
+    for _ in range(runs):
+        result = fn()
+    return result, round(1000 * (time.process_time() - start) / runs, 2)
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--image", help="upload to test with (default: synthetic 4032x3024 JPEG)")
+    p.add_argument("--height", type=int, default=1024)
+    p.add_argument("--width", type=int, default=576)
+    p.add_argument("--quality", type=int, default=85)
+    p.add_argument("--runs", type=int, default=5)
+    p.add_argument("--json", help="also write the report to this path")
+    args = p.parse_args()
+
+    if args.image:
+        with open(args.image, "rb") as f:
+            raw = f.read()
+    else:
+        raw = synthetic_photo()
+    size = (args.width, args.height)
+
+    def baseline_decode():
+        return Image.open(io.BytesIO(raw)).convert("RGB").resize(size, Image.BICUBIC)
+
+    def fast_decode():
+        return decode_image(raw, size).resize(size, Image.BICUBIC)
+
+    result, baseline_decode_ms = cpu_ms(baseline_decode, args.runs)
+    _, fast_decode_ms = cpu_ms(fast_decode, args.runs)
+
+    def baseline_encode():
+        buf = io.BytesIO()
+        result.save(buf, format="PNG")
+        return buf.getvalue()
+
+    baseline_bytes, baseline_encode_ms = cpu_ms(baseline_encode, args.runs)
+    report = {
+        "upload_bytes": len(raw),
+        "decode": {"baseline_ms": baseline_decode_ms, "draft_ms": fast_decode_ms},
+        "encode": {"baseline_png": {"ms": baseline_encode_ms, "bytes": len(baseline_bytes)}},
+    }
+    for output_format in OUTPUT_FORMATS:
+        data, ms = cpu_ms(lambda: encode_image(result, output_format, args.quality), args.runs)
+        report["encode"][output_format] = {"ms": ms, "bytes": len(data)}
+
+    report["saved_per_request"] = {
+        output_format: {
+            "cpu_ms": round(
+                baseline_decode_ms + baseline_encode_ms - fast_decode_ms - report["encode"][output_format]["ms"], 2
+            ),
+            "bytes": len(baseline_bytes) - report["encode"][output_format]["bytes"],
+        }
+        for output_format in OUTPUT_FORMATS
+    }
+    write_report({"run": run_info(args), **report}, args.json)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""CSV ingestion throughput: the old per-row iterrows loop vs SimpleCSVProcessor.load_all.
+
+    python -m bench.ingest --data sf_data
+
+Timing and peak Python heap (tracemalloc) are measured in separate passes so
+tracing overhead does not skew the throughput numbers. The streaming pass
+drops each chunk once it is consumed, the way build_index.py does.
+"""
+import argparse
+import time
+import tracemalloc
+
+import pandas as pd
+
+from bench.common import run_info, write_report
+from csv_processor import SimpleCSVProcessor
+
+
+def iterrows_baseline(processor: SimpleCSVProcessor) -> int:
+    """The pre-vectorization ingestion: iterrows + row_to_text, everything collected in one list"""
+    all_documents = []
+    for filename, category in processor.CSV_FILES.items():
+        filepath = processor.data_dir / filename
+        if not filepath.exists():
+            continue
+        df = pd.read_csv(filepath)
+        for idx, row in df.iterrows():
+            all_documents.append({
+                'id': f"{category}_{idx}",
+                'category': category,
+                'text': processor.row_to_text(row),
+                'metadata': row.to_dict(),
+                'location': {'lat': row.get('lat') or row.get('Latitude'), 'lon': row.get('lon') or row.get('Longitude')},
+            })
+    return len(all_documents)
+
+
+def streaming(processor: SimpleCSVProcessor) -> int:
+    rows = 0
+    for documents in processor.load_all():
+        rows += len(documents)
+    return rows
+
+
+def measure(fn, processor) -> dict:
+    t0 = time.perf_counter()
+    rows = fn(processor)
+    seconds = time.perf_counter() - t0
+
+    tracemalloc.start()
+    fn(processor)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "rows": rows,
+        "seconds": round(seconds, 3),
+        "rows_per_s": round(rows / seconds, 1),
+        "peak_heap_mb": round(peak / 2**20, 1),
+    }
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--data", default="sf_data")
+    p.add_argument("--chunksize", type=int, default=2048)
+    p.add_argument("--json", help="also write the report to this path")
+    args = p.parse_args()
+
+    processor = SimpleCSVProcessor(args.data, chunksize=args.chunksize)
+    report = {
+        "iterrows_baseline": measure(iterrows_baseline, processor),
+        "vectorized_streaming": measure(streaming, processor),
+    }
+    write_report({"run": run_info(args), **report}, args.json)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+"""Stand-ins for the models and servers, so the benchmark suite runs on a CPU-only box with no network.
+
+    python -m bench.stubs rag --index /tmp/stub_index --port 9105
+    python -m bench.stubs diffusion --port 9106 --base-ms 40 --ms-per-step 20
+    python -m bench.stubs tts --port 9107 --ms-per-char 2
+
+`rag` and `diffusion` serve the real rag_api / diffusion_api apps, with only the
+model swapped out: StubEmbedder for the embedding model and StubDiffusionEngine
+for the FLUX pipeline. Batching, executors, caches and the vector store are the
+real ones. `tts` is a minimal pocket-tts lookalike (POST /tts -> silent WAV).
+The suite starts these as subprocesses so the load generator doesn't share a GIL
+with the server.
+"""
+import argparse
+import hashlib
+import os
+import struct
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from lexical_index import LexicalIndexBuilder, tokenize
+
+TTS_SAMPLE_RATE = 24000
+
+
+class StubEmbedder:
+    """Bag-of-words embedder: each token gets a fixed pseudo-random vector (seeded by its hash).
+
+    Texts that share words land near each other, so recall and lexical/vector
+    overlap behave roughly like a real model's. `ms_per_text` adds a sleep per
+    text to stand in for the model's cost.
+    """
+
+    model_name = "stub"
+    device = "cpu"
+    precision = "fp32"
+    attention = "none"
+
+    def __init__(self, embedding_dim: int = 256, ms_per_text: float = 0.0):
+        self.embedding_dim = embedding_dim
+        self.ms_per_text = ms_per_text
+        self._token_vectors = {}
+
+    def _token_vector(self, token: str) -> np.ndarray:
+        vector = self._token_vectors.get(token)
+        if vector is None:
+            seed = int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "little")
+            vector = np.random.default_rng(seed).standard_normal(self.embedding_dim).astype(np.float32)
+            self._token_vectors[token] = vector
+        return vector
+
+    def _embed(self, texts: List[str]) -> np.ndarray:
+        if self.ms_per_text:
+            time.sleep(self.ms_per_text * len(texts) / 1000)
+        out = np.zeros((len(texts), self.embedding_dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            for token in tokenize(text):
+                out[i] += self._token_vector(token)
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        return out / np.maximum(norms, 1e-6)
+
+    def embed_documents(self, texts: List[str]) -> np.ndarray:
+        return self._embed(texts)
+
+    def embed_queries(self, queries: List[str]) -> np.ndarray:
+        return self._embed(queries)
+
+    def embed_query(self, query: str) -> np.ndarray:
+        return self._embed([query])[0]
+
+
+def build_stub_index(data_dir: str, output_dir: str, embedder, backend: str = "numpy",
+                     limit: Optional[int] = None) -> int:
+    """build_index.py in miniature: CSVs -> embeddings -> vector store + BM25 index in `output_dir`"""
+    from csv_processor import SimpleCSVProcessor
+    from vector_store import create_vector_store
+
+    documents = []
+    lexical = LexicalIndexBuilder()
+    for chunk in SimpleCSVProcessor(data_dir).load_all():
+        for doc in chunk:
+            documents.append(doc)
+            lexical.add(doc['text'])
+            if limit and len(documents) >= limit:
+                break
+        if limit and len(documents) >= limit:
+            break
+
+    embeddings = np.vstack([
+        embedder.embed_documents([doc['text'] for doc in documents[i:i + 1024]])
+        for i in range(0, len(documents), 1024)
+    ])
+    store = create_vector_store(backend, embedding_dim=embedder.embedding_dim, compression="none", reduced_dim=0)
+    store.build_index(embeddings, documents)
+    store.save(output_dir)
+    lexical.build().save(output_dir)
+    return len(documents)
+
+
+class StubDiffusionEngine:
+    """DiffusionEngine.img2img without a pipeline.
+
+    Each call sleeps `base_ms` + `ms_per_step` x steps, then returns the
+    decoded init image, re-encoded in the requested format, so image
+    decode/encode costs are real.
+    """
+
+    def __init__(self, base_ms: float = 40.0, ms_per_step: float = 20.0):
+        self.base_ms = base_ms
+        self.ms_per_step = ms_per_step
+        self.images = 0
+
+    def img2img(self, raw: bytes, prompt: str, height: int, width: int, guidance_scale: float,
+                num_inference_steps: int, seed: int, model_id: str, output_format: str = "png",
+                quality: int = 85):
+        from image_io import decode_image, encode_image
+
+        t0 = time.perf_counter()
+        time.sleep((self.base_ms + self.ms_per_step * num_inference_steps) / 1000)
+        denoise = time.perf_counter() - t0
+        self.images += 1
+
+        t1 = time.perf_counter()
+        image = decode_image(raw, (width, height)).resize((width, height))
+        data = encode_image(image, output_format, quality)
+        timings = {"denoise": denoise, "image_encode": time.perf_counter() - t1}
+        timings["total"] = denoise + timings["image_encode"]
+        return data, timings
+
+    def warm_up(self, model_id: str, height: int = 256, width: int = 256):
+        pass
+
+    def stats(self) -> Dict:
+        return {"stub": True, "images": self.images}
+
+
+def silent_wav(seconds: float) -> bytes:
+    """16-bit mono PCM WAV of `seconds` of silence at TTS_SAMPLE_RATE"""
+    pcm = bytes(2 * int(TTS_SAMPLE_RATE * seconds))
+    fmt = struct.pack("<HHIIHH", 1, 1, TTS_SAMPLE_RATE, TTS_SAMPLE_RATE * 2, 2, 16)
+    return (b"RIFF" + struct.pack("<I", 4 + 8 + len(fmt) + 8 + len(pcm)) + b"WAVE"
+            + b"fmt " + struct.pack("<I", len(fmt)) + fmt
+            + b"data" + struct.pack("<I", len(pcm)) + pcm)
+
+
+def stub_tts_app(base_ms: float = 80.0, ms_per_char: float = 4.0, audio_ms_per_char: float = 60.0):
+    """FastAPI app with the pocket-tts POST /tts form interface, answering with silence after a delay"""
+    import asyncio
+
+    from fastapi import FastAPI, Form
+    from fastapi.responses import Response
+
+    app = FastAPI(title="Stub TTS")
+
+    @app.get("/health")
+    async def health():
+        return {"status": "ok", "stub": True}
+
+    @app.post("/tts")
+    async def tts(text: str = Form(...), voice_url: Optional[str] = Form(None)):
+        await asyncio.sleep((base_ms + ms_per_char * len(text)) / 1000)
+        return Response(silent_wav(audio_ms_per_char * len(text) / 1000), media_type="audio/wav")
+
+    return app
+
+
+def rag_app(index_dir: str, backend: str, ms_per_text: float):
+    """rag_api.app with its globals filled in directly (the lifespan loader would load the real model)"""
+    import rag_api
+    from lexical_index import LexicalIndex
+    from vector_store import create_vector_store
+
+    store = create_vector_store(backend)
+    store.add_swap_listener(rag_api.result_cache.clear)
+    store.load(index_dir)
+    rag_api.vector_store = store
+    rag_api.lexical_index = LexicalIndex.load(index_dir)
+    rag_api.embedder = StubEmbedder(store.embedding_dim, ms_per_text=ms_per_text)
+    return rag_api.app
+
+
+def diffusion_app(base_ms: float, ms_per_step: float):
+    # before the import: diffusion_api opens its result store at module load
+    os.environ.setdefault("DIFFUSION_RESULT_DIR", tempfile.mkdtemp(prefix="bench_diffusion_"))
+    import diffusion_api
+
+    diffusion_api.engine = StubDiffusionEngine(base_ms, ms_per_step)
+    return diffusion_api.app
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("service", choices=["rag", "diffusion", "tts"])
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, required=True)
+    p.add_argument("--index", help="rag: index directory (see build_stub_index)")
+    p.add_argument("--backend", default="numpy", help="rag: vector backend")
+    p.add_argument("--ms-per-text", type=float, default=0.0, help="rag: stub embedding cost per query")
+    p.add_argument("--base-ms", type=float, default=None, help="diffusion/tts: fixed cost per call")
+    p.add_argument("--ms-per-step", type=float, default=20.0, help="diffusion: cost per denoising step")
+    p.add_argument("--ms-per-char", type=float, default=4.0, help="tts: synthesis cost per character")
+    args = p.parse_args()
+
+    import uvicorn
+
+    if args.service == "rag":
+        app = rag_app(args.index, args.backend, args.ms_per_text)
+    elif args.service == "diffusion":
+        app = diffusion_app(40.0 if args.base_ms is None else args.base_ms, args.ms_per_step)
+    else:
+        app = stub_tts_app(80.0 if args.base_ms is None else args.base_ms, args.ms_per_char)
+    # lifespan off: the rag startup hook would replace the stubs with the real model
+    uvicorn.run(app, host=args.host, port=args.port, lifespan="off", log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+"""End-to-end benchmark: ingest, embedding, vector search and the HTTP endpoints, in one JSON report.
+
+Run from backend/tarun_rag. On a CPU-only box with no network (stub models and servers):
+
+    python -m bench.suite --stub --json bench_stub.json
+
+Against the real models and a built vector_db/, with the services already running:
+
+    python -m bench.suite --index vector_db --rag-url http://localhost:9005 \\
+        --diffusion-url http://localhost:9006 --tts-url http://localhost:19000 --json bench.json
+
+Then compare two reports (exit status 1 on a regression):
+
+    python -m bench.compare bench_before.json bench.json
+
+Stages (`--stages`, default all):
+- ingest: SimpleCSVProcessor.load_all over `--data` (rows/s, peak Python heap).
+- embed: document throughput and single-query latency of the embedder
+  (StubEmbedder with --stub, else NemotronEmbeddingService).
+- vector: every backend in `--backends` loaded from `--index`, single-query
+  latency, batch throughput and recall@k against exact float32 search.
+- http: /search, /flux2klein/img2img and /tts at each `--concurrency` level.
+  With --stub, the real rag_api and diffusion_api apps are started as
+  subprocesses with their models stubbed (see bench.stubs), plus a stub /tts
+  server; without it, only the services given by --*-url are measured.
+
+With --stub and no --index, an index is built from `--data` with the stub
+embedder into a temp directory. Peak RSS is the benchmark process's high-water
+mark so far, so later stages include earlier ones; the stub servers' peaks are
+reported per service.
+"""
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from pathlib import Path
+
+from bench.common import latency_summary, memory_peaks, peak_rss_mb, run_info, timed, write_report
+from bench.vector_backends import SAMPLE_QUERIES, _ids, make_queries, recall_at_k
+
+STAGES = ("ingest", "embed", "vector", "http")
+
+
+def available_backends() -> list:
+    from vector_store import detect_backend
+
+    backends = ["numpy"]
+    try:
+        import hnswlib  # noqa: F401
+        backends.append("hnsw")
+    except ImportError:
+        pass
+    if detect_backend() == "cuvs":
+        backends.append("cuvs")
+    return backends
+
+
+def bench_ingest(data_dir: str) -> dict:
+    from bench.ingest import measure, streaming
+    from csv_processor import SimpleCSVProcessor
+
+    return measure(streaming, SimpleCSVProcessor(data_dir))
+
+
+def load_texts(index_dir: str, limit: int) -> list:
+    from doc_store import DocumentStore
+
+    documents = DocumentStore(index_dir)
+    try:
+        return [documents[i]['text'] for i in range(min(limit, len(documents)))]
+    finally:
+        documents.close()
+
+
+def bench_embed(embedder, texts: list, n_queries: int) -> dict:
+    embedder.embed_documents(texts[:8])  # warm-up
+    _, docs_ms = timed(embedder.embed_documents, texts)
+    queries = [f"{SAMPLE_QUERIES[i % len(SAMPLE_QUERIES)]} {i}" for i in range(n_queries)]
+    latencies = [timed(embedder.embed_queries, [query])[1] for query in queries]
+    _, batch_ms = timed(embedder.embed_queries, queries)
+    return {
+        "documents": len(texts),
+        "docs_per_s": round(len(texts) / (docs_ms / 1000), 1),
+        "query": latency_summary(latencies),
+        "query_batch_per_s": round(len(queries) / (batch_ms / 1000), 1),
+        **memory_peaks(),
+    }
+
+
+def bench_vector(index_dir: str, backends: list, n_queries: int, top_k: int) -> dict:
+    from vector_store import BACKENDS
+
+    exact = BACKENDS["numpy"](compression="none", reduced_dim=0)
+    exact.load(index_dir)
+    queries = make_queries(exact, min(n_queries, len(exact.embeddings)), "docs")
+    truth = _ids(exact.search_batch(queries, top_k=top_k))
+
+    report = {"documents": len(exact.embeddings), "embedding_dim": int(exact.embeddings.shape[1])}
+    for name in backends:
+        store, load_ms = timed(lambda: _loaded(BACKENDS[name](), index_dir))
+        store.search_batch(queries[:2], top_k=top_k)  # warm-up (kernels, page cache, norms)
+        latencies = [timed(store.search, query, top_k=top_k)[1] for query in queries]
+        found, batch_ms = timed(lambda: _ids(store.search_batch(queries, top_k=top_k)))
+        report[name] = {
+            "load_s": round(load_ms / 1000, 3),
+            **latency_summary(latencies),
+            "batch_qps": round(len(queries) / (batch_ms / 1000), 1),
+            f"recall@{top_k}": round(recall_at_k(found, truth), 4),
+            **memory_peaks(),
+        }
+        print(f"vector {name}: p50 {report[name]['p50_ms']} ms, recall@{top_k} {report[name][f'recall@{top_k}']}")
+    return report
+
+
+def _loaded(store, index_dir: str):
+    store.load(index_dir)
+    return store
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class StubServer:
+    """`python -m bench.stubs <service>` as a subprocess, ready once /health answers"""
+
+    def __init__(self, service: str, log_dir: str, *args: str, env: dict = None):
+        self.service = service
+        self.port = _free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.log_path = Path(log_dir) / f"{service}.log"
+        self._log = self.log_path.open("wb")
+        self.proc = subprocess.Popen(
+            [sys.executable, "-m", "bench.stubs", service, "--port", str(self.port), *args],
+            cwd=str(Path(__file__).resolve().parent.parent),
+            stdout=self._log, stderr=subprocess.STDOUT, env={**os.environ, **(env or {})},
+        )
+
+    def wait_ready(self, timeout_s: float = 120.0):
+        deadline = time.monotonic() + timeout_s
+        while time.monotonic() < deadline:
+            if self.proc.poll() is not None:
+                break
+            try:
+                with urllib.request.urlopen(self.url + "/health", timeout=2) as r:
+                    if r.status == 200:
+                        return self
+            except OSError:
+                time.sleep(0.2)
+        self.stop()
+        raise RuntimeError(f"stub {self.service} server did not start:\n{self.log_path.read_text()[-2000:]}")
+
+    def peak_rss_mb(self):
+        return peak_rss_mb(self.proc.pid)
+
+    def stop(self):
+        if self.proc.poll() is None:
+            self.proc.terminate()
+            try:
+                self.proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+        self._log.close()
+
+
+def bench_http(args, index_dir: str, work_dir: str) -> dict:
+    from bench.http_load import default_image, img2img_request, search_request, sweep, tts_request
+
+    targets = {}
+    servers = []
+    try:
+        if args.stub:
+            rag = StubServer("rag", work_dir, "--index", str(Path(index_dir).resolve()), "--ms-per-text", str(args.stub_embed_ms))
+            diffusion = StubServer(
+                "diffusion", work_dir, "--base-ms", str(args.stub_diffusion_base_ms),
+                env={"DIFFUSION_RESULT_DIR": str(Path(work_dir) / "diffusion_results")},
+            )
+            tts = StubServer("tts", work_dir, "--ms-per-char", str(args.stub_tts_ms_per_char))
+            servers = [rag, diffusion, tts]
+            for server in servers:
+                server.wait_ready()
+            targets = {"rag": rag.url, "diffusion": diffusion.url, "tts": tts.url}
+        else:
+            targets = {name: url for name, url in
+                       (("rag", args.rag_url), ("diffusion", args.diffusion_url), ("tts", args.tts_url)) if url}
+
+        report = {}
+        if "rag" in targets:
+            report["search"] = {
+                mode: sweep(targets["rag"], search_request(args.top_k, mode), args.concurrency, args.requests)
+                for mode in args.search_modes
+            }
+        if "diffusion" in targets:
+            image = Path(args.image).read_bytes() if args.image else default_image()
+            make_request = img2img_request(image, args.image_size, args.image_size, args.steps)
+            report["img2img"] = sweep(targets["diffusion"], make_request, args.concurrency, args.img2img_requests)
+        if "tts" in targets:
+            report["tts"] = sweep(targets["tts"], tts_request(args.voice_url), args.concurrency, args.tts_requests)
+        if servers:
+            report["server_peak_rss_mb"] = {server.service: server.peak_rss_mb() for server in servers}
+        return report
+    finally:
+        for server in servers:
+            server.stop()
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--stub", action="store_true", help="stub embedder, diffusion engine and TTS server")
+    p.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES))
+    p.add_argument("--data", default="sf_data")
+    p.add_argument("--index", help="built index directory (default: vector_db, or a stub index with --stub)")
+    p.add_argument("--limit", type=int, default=0, help="documents in the stub index (0: all)")
+    p.add_argument("--embed-dim", type=int, default=256, help="stub embedding dimension")
+    p.add_argument("--embed-texts", type=int, default=1024, help="documents embedded in the embed stage")
+    p.add_argument("--backends", nargs="+", help="vector backends (default: every one available here)")
+    p.add_argument("--n-queries", type=int, default=200)
+    p.add_argument("--top-k", type=int, default=10)
+    p.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    p.add_argument("--requests", type=int, default=200, help="/search requests per concurrency level")
+    p.add_argument("--search-modes", nargs="+", choices=["lexical", "vector", "hybrid"], default=["vector"])
+    p.add_argument("--img2img-requests", type=int, default=16)
+    p.add_argument("--image", help="img2img init image (default: a generated gradient)")
+    p.add_argument("--image-size", type=int, default=256)
+    p.add_argument("--steps", type=int, default=4)
+    p.add_argument("--tts-requests", type=int, default=32)
+    p.add_argument("--voice-url", default="alba")
+    p.add_argument("--rag-url")
+    p.add_argument("--diffusion-url")
+    p.add_argument("--tts-url")
+    p.add_argument("--stub-embed-ms", type=float, default=2.0, help="stub embedding cost per query")
+    p.add_argument("--stub-diffusion-base-ms", type=float, default=40.0)
+    p.add_argument("--stub-tts-ms-per-char", type=float, default=1.0)
+    p.add_argument("--json", help="also write the report to this path")
+    args = p.parse_args()
+
+    report = {"run": run_info(args)}
+    with tempfile.TemporaryDirectory(prefix="bench_suite_") as work_dir:
+        if "ingest" in args.stages:
+            print("ingest...")
+            report["ingest"] = bench_ingest(args.data)
+
+        embedder = None
+        if args.stub:
+            from bench.stubs import StubEmbedder, build_stub_index
+            embedder = StubEmbedder(args.embed_dim)
+
+        index_dir = args.index
+        if index_dir is None and args.stub:
+            index_dir = str(Path(work_dir) / "index")
+            print(f"building a stub index from {args.data}...")
+            _, build_ms = timed(build_stub_index, args.data, index_dir, embedder, limit=args.limit or None)
+            report["stub_index_build_s"] = round(build_ms / 1000, 3)
+        index_dir = index_dir or "vector_db"
+
+        if "embed" in args.stages:
+            print("embed...")
+            if embedder is None:
+                from embedding_service import NemotronEmbeddingService
+                embedder = NemotronEmbeddingService()
+            report["embed"] = bench_embed(embedder, load_texts(index_dir, args.embed_texts), min(args.n_queries, 100))
+
+        if "vector" in args.stages:
+            print("vector...")
+            report["vector"] = bench_vector(index_dir, args.backends or available_backends(),
+                                            args.n_queries, args.top_k)
+
+        if "http" in args.stages:
+            print("http...")
+            report["http"] = bench_http(args, index_dir, work_dir)
+
+    report["peak_rss_mb"] = peak_rss_mb()
+    write_report(report, args.json)
+
+
+if __name__ == "__main__":
+    main()
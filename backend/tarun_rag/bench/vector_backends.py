@@ -0,0 +1,99 @@
+"""Recall@k and latency of each vector backend against exact search.
+
+Run from backend/tarun_rag once build_index.py has written vector_db/ from sf_data:
+
+    python -m bench.vector_backends --index vector_db --backends cuvs hnsw numpy
+
+Queries are document vectors with a little Gaussian noise (so they are never an
+exact stored row), or real embedded queries with --queries model.
+"""
+import argparse
+
+import numpy as np
+
+from bench.common import latency_summary, run_info, timed, write_report
+from vector_store import BACKENDS
+
+SAMPLE_QUERIES = [
+    "historic landmarks in San Francisco with cultural significance",
+    "murals in the Mission district",
+    "movies filmed near the Golden Gate Bridge",
+    "quiet park with a playground",
+    "coffee shop with outdoor seating in Hayes Valley",
+    "Muni stop near Union Square",
+    "vintage clothing store",
+    "Victorian houses",
+]
+
+
+def make_queries(store, n: int, source: str, seed: int = 0) -> np.ndarray:
+    if source == "model":
+        from embedding_service import NemotronEmbeddingService
+        texts = (SAMPLE_QUERIES * (n // len(SAMPLE_QUERIES) + 1))[:n]
+        return NemotronEmbeddingService().embed_queries(texts)
+
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(len(store.embeddings), size=n, replace=False)
+    base = np.asarray(store.embeddings[np.sort(rows)], dtype=np.float32)
+    scale = 0.05 * np.linalg.norm(base, axis=1, keepdims=True) / np.sqrt(base.shape[1])
+    return (base + rng.normal(size=base.shape).astype(np.float32) * scale).astype(np.float32)
+
+
+def _ids(batch_results):
+    return [[doc['id'] for doc, _ in results] for results in batch_results]
+
+
+def recall_at_k(found, truth) -> float:
+    hits = [len(set(f) & set(t)) / max(len(t), 1) for f, t in zip(found, truth)]
+    return float(np.mean(hits)) if hits else 0.0
+
+
+def bench_backend(name: str, index_dir: str, queries: np.ndarray, truth: dict, top_k: int) -> dict:
+    store = BACKENDS[name]()
+    _, load_ms = timed(store.load, index_dir)
+
+    store.search_batch(queries[:2], top_k=top_k)  # warm-up (kernels, page cache)
+    latencies = [timed(store.search, query, top_k=top_k)[1] for query in queries]
+    found, batch_ms = timed(lambda: _ids(store.search_batch(queries, top_k=top_k)))
+
+    report = {
+        "load_s": round(load_ms / 1000, 3),
+        **latency_summary(latencies),
+        "batch_qps": round(len(queries) / (batch_ms / 1000), 1),
+        f"recall@{top_k}": round(recall_at_k(found, truth[None]), 4),
+    }
+    for category in sorted(c for c in truth if c is not None):
+        found = _ids(store.search_batch(queries, top_k=top_k, category=category))
+        report[f"recall@{top_k}[{category}]"] = round(recall_at_k(found, truth[category]), 4)
+    return report
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--index", default="vector_db")
+    p.add_argument("--backends", nargs="+", default=list(BACKENDS))
+    p.add_argument("--queries", choices=["docs", "model"], default="docs")
+    p.add_argument("--n-queries", type=int, default=200)
+    p.add_argument("--top-k", type=int, default=10)
+    p.add_argument("--json", help="also write the report to this path")
+    args = p.parse_args()
+
+    exact = BACKENDS["numpy"]()
+    exact.load(args.index)
+    queries = make_queries(exact, args.n_queries, args.queries)
+
+    truth = {None: _ids(exact.search_batch(queries, top_k=args.top_k))}
+    for category in exact.categories:
+        truth[category] = _ids(exact.search_batch(queries, top_k=args.top_k, category=category))
+
+    report = {"run": run_info(args), "backends": {}}
+    for name in args.backends:
+        try:
+            report["backends"][name] = bench_backend(name, args.index, queries, truth, args.top_k)
+        except Exception as e:
+            print(f"Skipping {name}: {type(e).__name__}: {e}")
+    write_report(report, args.json)
+
+
+if __name__ == "__main__":
+    main()
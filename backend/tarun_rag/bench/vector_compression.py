@@ -0,0 +1,83 @@
+"""Recall@k vs memory and latency for each vector compression setting, with exact re-ranking.
+
+Run from backend/tarun_rag once build_index.py has written vector_db/ from sf_data:
+
+    python -m bench.vector_compression --index vector_db --backend numpy --compressions none fp16 int8 pq --rerank-factors 1 4 10
+
+Ground truth is exact float32 search. Missing codes_<kind>.npy files are built
+from embeddings.npy and cached in the index directory on first use (PQ
+training takes a while). `searchable_mb` is what the first pass scans (the
+compressed codes, or the float32 matrix for `none`); the float32 file is only
+read for the re-ranked shortlist.
+"""
+import argparse
+from pathlib import Path
+
+import numpy as np
+
+from bench.common import latency_summary, run_info, timed, write_report
+from bench.vector_backends import _ids, make_queries, recall_at_k
+from vector_store import BACKENDS
+
+
+def bench_setting(args, compression: str, rerank_factor: int, queries: np.ndarray, truth) -> dict:
+    store = BACKENDS[args.backend](compression=compression, rerank_factor=rerank_factor, pq_dim=args.pq_dim)
+    _, load_ms = timed(store.load, args.index)
+
+    store.search_batch(queries[:2], top_k=args.top_k)  # warm-up (page cache, norms)
+    latencies = [timed(store.search, query, top_k=args.top_k)[1] for query in queries]
+    found, batch_ms = timed(lambda: _ids(store.search_batch(queries, top_k=args.top_k)))
+
+    searchable = store.embeddings if store.codes is None else store.codes
+    index_files = [Path(args.index) / f"codes_{compression}.npy"]
+    if args.backend == "cuvs":
+        index_files.append(Path(args.index) / store._index_name())
+    return {
+        "backend": args.backend,
+        "compression": store.compression,
+        "rerank_factor": rerank_factor,
+        "load_s": round(load_ms / 1000, 3),
+        "searchable_mb": round(searchable.nbytes / 1024 ** 2, 2),
+        "bytes_per_doc": searchable.nbytes // max(len(searchable), 1),
+        "index_files_mb": round(sum(p.stat().st_size for p in index_files if p.exists()) / 1024 ** 2, 2),
+        **latency_summary(latencies),
+        "batch_qps": round(len(queries) / (batch_ms / 1000), 1),
+        f"recall@{args.top_k}": round(recall_at_k(found, truth), 4),
+    }
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--index", default="vector_db")
+    p.add_argument("--backend", choices=["numpy", "cuvs"], default="numpy")
+    p.add_argument("--compressions", nargs="+", default=["none", "fp16", "int8", "pq"])
+    p.add_argument("--rerank-factors", type=int, nargs="+", default=[1, 4, 10])
+    p.add_argument("--pq-dim", type=int, default=64)
+    p.add_argument("--queries", choices=["docs", "model"], default="docs")
+    p.add_argument("--n-queries", type=int, default=200)
+    p.add_argument("--top-k", type=int, default=10)
+    p.add_argument("--json", help="also write the report to this path")
+    args = p.parse_args()
+
+    exact = BACKENDS["numpy"](compression="none")
+    exact.load(args.index)
+    queries = make_queries(exact, args.n_queries, args.queries)
+    truth = _ids(exact.search_batch(queries, top_k=args.top_k))
+
+    report = {"run": run_info(args), "settings": {}}
+    for compression in args.compressions:
+        # re-ranking doesn't apply without compression
+        for rerank_factor in ([1] if compression == "none" else args.rerank_factors):
+            name = f"{compression} x{rerank_factor}"
+            try:
+                row = bench_setting(args, compression, rerank_factor, queries, truth)
+            except Exception as e:
+                print(f"Skipping {name}: {type(e).__name__}: {e}")
+                continue
+            report["settings"][name] = row
+            print(f"{name}: p50 {row['p50_ms']} ms, recall@{args.top_k} {row[f'recall@{args.top_k}']}")
+    write_report(report, args.json)
+
+
+if __name__ == "__main__":
+    main()
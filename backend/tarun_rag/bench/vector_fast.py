@@ -0,0 +1,71 @@
+"""Reduced-dimension fast path vs full 2048-d search: recall@k and latency.
+
+Run from backend/tarun_rag once build_index.py has written vector_db/ from sf_data:
+
+    python -m bench.vector_fast --index vector_db --reductions pca prefix --dims 128 256 512 --rerank-factors 5 10 20
+
+Ground truth is exact float32 search. The baseline row is the full-dimension
+search of `--backend` (fast=False). Each fast row scans the PCA or prefix
+projection for rerank_factor x top_k candidates and re-scores them at full
+dimension. Missing reduced_<kind><dim>.npy files are built from
+embeddings.npy and cached in the index directory on first use.
+"""
+import argparse
+
+import numpy as np
+
+from bench.common import latency_summary, run_info, timed, write_report
+from bench.vector_backends import _ids, make_queries, recall_at_k
+from vector_store import BACKENDS
+
+
+def timed_search(store, queries: np.ndarray, top_k: int, fast: bool):
+    store.search_batch(queries[:2], top_k=top_k, fast=fast)  # warm-up (page cache, norms)
+    latencies = [timed(store.search, query, top_k=top_k, fast=fast)[1] for query in queries]
+    found, batch_ms = timed(lambda: _ids(store.search_batch(queries, top_k=top_k, fast=fast)))
+    return found, {**latency_summary(latencies), "batch_qps": round(len(queries) / (batch_ms / 1000), 1)}
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--index", default="vector_db")
+    p.add_argument("--backend", choices=list(BACKENDS), default="numpy")
+    p.add_argument("--reductions", nargs="+", default=["pca", "prefix"])
+    p.add_argument("--dims", type=int, nargs="+", default=[128, 256, 512])
+    p.add_argument("--rerank-factors", type=int, nargs="+", default=[5, 10, 20])
+    p.add_argument("--queries", choices=["docs", "model"], default="docs")
+    p.add_argument("--n-queries", type=int, default=200)
+    p.add_argument("--top-k", type=int, default=10)
+    p.add_argument("--json", help="also write the report to this path")
+    args = p.parse_args()
+
+    exact = BACKENDS["numpy"](compression="none", reduced_dim=0)
+    exact.load(args.index)
+    queries = make_queries(exact, args.n_queries, args.queries)
+    truth = _ids(exact.search_batch(queries, top_k=args.top_k))
+
+    baseline = BACKENDS[args.backend](reduced_dim=0)
+    baseline.load(args.index)
+    found, timing = timed_search(baseline, queries, args.top_k, fast=False)
+    report = {"run": run_info(args), "modes": {
+        "full": {"dim": exact.embedding_dim, **timing, f"recall@{args.top_k}": round(recall_at_k(found, truth), 4)},
+    }}
+
+    for reduction in args.reductions:
+        for dim in args.dims:
+            for rerank_factor in args.rerank_factors:
+                store = BACKENDS[args.backend](reduced_dim=dim, reduction=reduction, fast_rerank_factor=rerank_factor)
+                store.load(args.index)
+                found, timing = timed_search(store, queries, args.top_k, fast=True)
+                name = f"{store.reducer.name} x{rerank_factor}"
+                row = report["modes"][name] = {
+                    "dim": dim, "rerank_factor": rerank_factor,
+                    "reduced_mb": round(store.reduced.nbytes / 1024 ** 2, 2), **timing,
+                    f"recall@{args.top_k}": round(recall_at_k(found, truth), 4),
+                }
+                print(f"{name}: p50 {row['p50_ms']} ms, recall@{args.top_k} {row[f'recall@{args.top_k}']}")
+    write_report(report, args.json)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,58 +1,166 @@
 # build_index.py
+import queue
 import sys
+import threading
 from pathlib import Path
 from tqdm import tqdm
 
 from csv_processor import SimpleCSVProcessor
-from embedding_service import NemotronEmbeddingService
-from vector_store import CuVSVectorStore
+from doc_store import DocumentStore, DocumentStoreWriter
+from embedding_service import NemotronEmbeddingService, document_settings
+from embedding_store import EmbeddingSidecar
+from lexical_index import LexicalIndexBuilder
+from vector_store import create_vector_store
+
+def _prefetch(iterator, depth: int = 2):
+    """Run `iterator` on a background thread, keeping up to `depth` items ready"""
+    items = queue.Queue(maxsize=depth)
+    done = object()
+
+    def produce():
+        try:
+            for item in iterator:
+                items.put(item)
+        except BaseException as e:
+            items.put(e)
+        finally:
+            items.put(done)
+
+    threading.Thread(target=produce, daemon=True).start()
+    while True:
+        item = items.get()
+        if item is done:
+            return
+        if isinstance(item, BaseException):
+            raise item
+        yield item
+
+_NO_COORDINATES = (float("nan"),) * 6
+
+def _coordinates(doc: dict) -> tuple:
+    location = doc.get('location') or {}
+    lat, lon = location.get('lat'), location.get('lon')
+    if lat is None or lon is None:
+        return _NO_COORDINATES
+    return (lat, lon, *(doc.get('bounds') or (lat, lon, lat, lon)))
 
 def build_rag_index(
     data_dir: str = "sf_data",
     output_dir: str = "vector_db",
-    batch_size: int = 32
+    batch_size: int = 1024,
+    full_rebuild: bool = False,
 ):
-    """Build the complete RAG index"""
-    
-    print("Step 1: Loading CSV data...")
-    processor = SimpleCSVProcessor(data_dir)
-    documents = processor.load_all()
-    print(f"Loaded {len(documents)} documents")
-    
-    print("\nStep 2: Initializing embedding model...")
-    embedder = NemotronEmbeddingService()
-    
-    print("\nStep 3: Generating embeddings...")
-    all_embeddings = []
-    texts = [doc['text'] for doc in documents]
-    
-    # Process in batches to avoid OOM
-    for i in tqdm(range(0, len(texts), batch_size)):
-        batch = texts[i:i + batch_size]
-        embeddings = embedder.embed_documents(batch)
-        all_embeddings.append(embeddings)
-    
+    """Build the complete RAG index, re-embedding only rows whose text changed"""
     import numpy as np
-    all_embeddings = np.vstack(all_embeddings)
+
+    sidecar = EmbeddingSidecar(
+        str(Path(output_dir) / "embedding_cache"),
+        model_name=NemotronEmbeddingService.model_name,
+        embedding_dim=2048,
+        **document_settings(),
+    )
+    if not full_rebuild:
+        sidecar.load()
+    previous = len(sidecar)
+
+    # CSV chunks are parsed on a background thread while the main thread embeds,
+    # and documents go straight to disk, so memory doesn't grow with the CSVs
+    print("Step 1: Streaming CSV data and embedding new/changed rows...")
+    processor = SimpleCSVProcessor(data_dir)
+    writer = DocumentStoreWriter(output_dir)
+    # the BM25 index is cheap to rebuild, so it always covers every document
+    lexical = LexicalIndexBuilder()
+
+    embedder = None
+    doc_hashes = []  # one per document, corpus order
+    coordinates = []  # (lat, lon, min_lat, min_lon, max_lat, max_lon) per document, NaN if unknown
+    vectors = {}  # content hash -> freshly computed embedding
+    # (hash, text) waiting to be embedded; handed over `batch_size` at a time so the
+    # embedder can sort them by length and cut its own token-budget batches
+    pending = []
+    queued = set()
+
+    def embed_pending(flush: bool = False):
+        nonlocal embedder
+        while len(pending) >= batch_size or (flush and pending):
+            if embedder is None:
+                print("\nStep 2: Initializing embedding model...")
+                embedder = NemotronEmbeddingService()
+            batch = pending[:batch_size]
+            del pending[:batch_size]
+            embeddings = embedder.embed_documents([text for _, text in batch])
+            vectors.update(zip((h for h, _ in batch), embeddings))
+
+    with tqdm(unit="docs") as progress:
+        for documents in _prefetch(processor.load_all()):
+            for doc in documents:
+                writer.add(doc)
+                lexical.add(doc['text'])
+                h = doc['content_hash']
+                doc_hashes.append(h)
+                coordinates.append(_coordinates(doc))
+                # identical texts are embedded once
+                if h not in sidecar and h not in queued:
+                    queued.add(h)
+                    pending.append((h, doc['text']))
+            embed_pending()
+            progress.update(len(documents))
+        embed_pending(flush=True)
+    writer.close()
+    print(f"Loaded {len(doc_hashes)} documents")
+
+    if embedder is None:
+        print("\nStep 2: All embeddings cached, skipped the embedding model")
+
+    print("\nStep 3: Assembling embeddings...")
+    hashes = list(dict.fromkeys(doc_hashes))
+    cached_hashes = [h for h in hashes if h not in vectors]
+    vectors.update(zip(cached_hashes, sidecar.get(cached_hashes)))
+    unique_embeddings = np.vstack([vectors[h] for h in hashes]).astype(np.float32)
+    sidecar.save(hashes, unique_embeddings)
+
+    row_of = {h: i for i, h in enumerate(hashes)}
+    all_embeddings = unique_embeddings[[row_of[h] for h in doc_hashes]]
     print(f"Generated embeddings shape: {all_embeddings.shape}")
-    
+    print(
+        f"Embedding summary: {len(cached_hashes)} reused, {len(vectors) - len(cached_hashes)} recomputed, "
+        f"{max(previous - len(cached_hashes), 0)} dropped (no longer in the corpus)"
+    )
+
     print("\nStep 4: Building vector index...")
-    vector_store = CuVSVectorStore(embedding_dim=2048)
-    vector_store.build_index(all_embeddings, documents)
-    
+    vector_store = create_vector_store(embedding_dim=2048)
+    coordinates = np.asarray(coordinates, dtype=np.float32).reshape(-1, 6)
+    print(f"Documents with coordinates: {int((~np.isnan(coordinates[:, 0])).sum())}/{len(coordinates)}")
+    vector_store.build_index(
+        all_embeddings, DocumentStore(output_dir), locations=coordinates[:, :2], bounds=coordinates[:, 2:]
+    )
+    if vector_store.reducer is not None:
+        # VECTOR_REDUCED_DIM: the fast-path projection is learned here, from the corpus itself
+        kept = vector_store.reducer.explained_variance
+        print(f"Reduced-dimension index: {vector_store.reducer.name}"
+              + (f" ({kept:.1%} of variance kept)" if kept is not None else ""))
+
     print("\nStep 5: Saving index...")
     vector_store.save(output_dir)
+    lexical_index = lexical.build()
+    lexical_index.save(output_dir)
+    print(f"Lexical index: {len(lexical_index.vocab)} terms")
     print(f"Index saved to {output_dir}/")
-    
+
+    if embedder is None:
+        # nothing needed the model; don't load it just for the smoke test
+        return
+
     # Quick test
     print("\nStep 6: Testing search...")
     test_query = "historic landmarks in San Francisco with cultural significance"
     query_emb = embedder.embed_query(test_query)
     results = vector_store.search(query_emb, top_k=3)
-    
+
     print(f"\nTest query: '{test_query}'")
     for doc, score in results:
         print(f"  [{score:.4f}] {doc['category']}: {doc['text'][:100]}...")
 
 if __name__ == "__main__":
-    build_rag_index()
\ No newline at end of file
+    # --full ignores the embedding cache and re-embeds every row
+    build_rag_index(full_rebuild="--full" in sys.argv[1:])
@@ -1,15 +1,41 @@
 # ingestion/csv_processor.py
 import pandas as pd
+import numpy as np
 from pathlib import Path
-from typing import List, Dict
+from typing import Dict, Iterator, List, Tuple
 import hashlib
 
+from wkt import parse_wkt
+
 class SimpleCSVProcessor:
     """Simply concatenate all CSV columns into text - no preprocessing"""
-    
-    def __init__(self, data_dir: str):
+
+    # Map filenames to categories
+    CSV_FILES = {
+        'Landmarks_20260124.csv': 'landmarks',
+        'Film_Locations_in_San_Francisco_20260124.csv': 'film_locations',
+        'StreetSmArts_Murals_20260124.csv': 'murals',
+        'restaurants_and_cafes.csv': 'restaurants',
+        'parks_and_leisure.csv': 'parks',
+        'Recreation_and_Parks_Properties_20260124.csv': 'recreation',
+        'buildings.csv': 'buildings',
+        'shops.csv': 'shops',
+        'transit_stops.csv': 'transit',
+    }
+
+    # How read_csv spells booleans by default
+    BOOL_VALUES = {'True': True, 'TRUE': True, 'true': True, 'False': False, 'FALSE': False, 'false': False}
+
+    # Coordinate columns, in order of preference; WKT geometry fills rows they leave empty
+    LAT_COLUMNS = ['lat', 'Latitude', 'latitude']
+    LON_COLUMNS = ['lon', 'Longitude', 'longitude']
+    GEOMETRY_COLUMNS = ['the_geom', 'Point', 'shape']
+
+    def __init__(self, data_dir: str, chunksize: int = 2048):
         self.data_dir = Path(data_dir)
-    
+        # rows per read_csv chunk; bounds memory regardless of file size
+        self.chunksize = chunksize
+
     def row_to_text(self, row: pd.Series) -> str:
         """Convert a row to a single concatenated string"""
         # Just join all non-null values with separator
@@ -18,58 +44,147 @@ class SimpleCSVProcessor:
             if pd.notna(value) and str(value).strip():
                 parts.append(f"{col}: {value}")
         return " | ".join(parts)
-    
-    def process_csv(self, filepath: Path, category: str) -> List[Dict]:
-        """Process a single CSV file"""
-        df = pd.read_csv(filepath)
+
+    def frame_to_texts(self, df: pd.DataFrame) -> np.ndarray:
+        """Column-wise equivalent of row_to_text for a whole frame"""
+        texts = np.full(len(df), "", dtype=object)
+        for col in df.columns:
+            values = df[col]
+            as_str = values.fillna("").astype(str)
+            present = (values.notna() & (as_str.str.strip() != "")).to_numpy()
+            as_str = as_str.to_numpy(dtype=object)
+            piece = f"{col}: " + as_str
+            joined = np.where(texts == "", piece, texts + " | " + piece)
+            texts = np.where(present, joined, texts)
+        return texts
+
+    def frame_to_documents(self, df: pd.DataFrame, category: str) -> List[Dict]:
+        """Turn one chunk of a CSV into documents"""
+        texts = self.frame_to_texts(df)
+
+        # Extract lat/lon and a bounding box (for map features)
+        locations, bounds = self.frame_to_locations(df)
+
+        # Store entire row as metadata (missing cells as None, which JSON can carry)
+        metadata = df.astype(object).where(df.notna(), None).to_dict('records')
+
         documents = []
-        
-        for idx, row in df.iterrows():
-            # Concatenate all columns as-is
-            text = self.row_to_text(row)
-            
-            # Create unique ID
-            doc_id = f"{category}_{idx}"
-            
-            # Extract lat/lon if present (for map features)
-            lat = row.get('lat') or row.get('Latitude') or None
-            lon = row.get('lon') or row.get('Longitude') or None
-            
+        for idx, text, row, (row_lat, row_lon), row_bounds in zip(
+            df.index, texts, metadata, locations.tolist(), bounds.tolist()
+        ):
+            has_location = not (np.isnan(row_lat) or np.isnan(row_lon))
             documents.append({
-                'id': doc_id,
+                'id': f"{category}_{idx}",
                 'category': category,
                 'text': text,
-                'metadata': row.to_dict(),  # Store entire row as metadata
-                'location': {'lat': lat, 'lon': lon}
+                # embeddings depend only on the text; build_index reuses them by this hash
+                'content_hash': hashlib.sha1(text.encode('utf-8')).hexdigest(),
+                'metadata': row,
+                'location': {'lat': row_lat, 'lon': row_lon} if has_location else {'lat': None, 'lon': None},
+                # [min_lat, min_lon, max_lat, max_lon]; a point for plain lat/lon rows
+                'bounds': row_bounds if has_location else None,
             })
-        
         return documents
-    
-    def load_all(self) -> List[Dict]:
-        """Load all CSV files from data directory"""
-        all_documents = []
-        
-        # Map filenames to categories
-        csv_files = {
-            'Landmarks_20260124.csv': 'landmarks',
-            'Film_Locations_in_San_Francisco_20260124.csv': 'film_locations',
-            'StreetSmArts_Murals_20260124.csv': 'murals',
-            'restaurants_and_cafes.csv': 'restaurants',
-            'parks_and_leisure.csv': 'parks',
-            'Recreation_and_Parks_Properties_20260124.csv': 'recreation',
-            'buildings.csv': 'buildings',
-            'shops.csv': 'shops',
-            'transit_stops.csv': 'transit',
-        }
-        
-        for filename, category in csv_files.items():
+
+    def frame_to_locations(self, df: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray]:
+        """(n, 2) float64 [lat, lon] and (n, 4) bounds per row, NaN where unknown"""
+        lat = self._first_numeric(df, self.LAT_COLUMNS)
+        lon = self._first_numeric(df, self.LON_COLUMNS)
+        locations = np.stack([lat, lon], axis=1)
+        locations[np.isnan(locations).any(axis=1)] = np.nan
+        bounds = np.concatenate([locations, locations], axis=1)
+
+        # the first geometry column with a parsable shape gives the row's extent, even
+        # where explicit lat/lon columns already gave its point
+        has_extent = np.zeros(len(df), dtype=bool)
+        for col in self.GEOMETRY_COLUMNS:
+            if col not in df.columns:
+                continue
+            centroids, geometry_bounds = parse_wkt(df[col])
+            usable = ~np.isnan(geometry_bounds).any(axis=1) & ~has_extent
+            bounds[usable] = geometry_bounds[usable]
+            has_extent |= usable
+            missing = np.isnan(locations).any(axis=1)
+            locations[missing] = centroids[missing]
+        return locations, bounds
+
+    @staticmethod
+    def _first_numeric(df: pd.DataFrame, columns: List[str]) -> np.ndarray:
+        """First of `columns` that parses as a number, per row; NaN where none does (0 is a value)"""
+        values = pd.Series(np.nan, index=df.index)
+        for col in columns:
+            if col in df.columns:
+                values = values.fillna(pd.to_numeric(df[col], errors='coerce'))
+        return values.to_numpy(dtype=np.float64)
+
+    def column_types(self, filepath: Path) -> Dict[str, str]:
+        """'int', 'float' or 'bool' for the columns one read_csv of the whole file would infer as such.
+
+        Chunks are read as strings, so per-chunk inference can't change a row's
+        text; this pass lets them be converted back to the file-wide types, so
+        texts (and content hashes) and metadata values match a whole-file read:
+        an int column with blanks is float ("316.0"), and numbers stay numbers.
+        """
+        flags = {}  # column -> {numeric, integral, boolean, has_missing, has_values}
+        for df in pd.read_csv(filepath, dtype=str, chunksize=self.chunksize):
+            for col in df.columns:
+                f = flags.setdefault(col, dict(numeric=True, integral=True, boolean=True,
+                                               has_missing=False, has_values=False))
+                missing = df[col].isna()
+                f['has_missing'] |= bool(missing.any())
+                f['has_values'] |= not missing.all()
+                # once a column has shown text, later chunks can't change its type; skip the checks
+                if not (f['numeric'] or f['boolean']):
+                    continue
+                values = df[col][~missing]
+                if f['numeric']:
+                    f['numeric'] = bool(pd.to_numeric(values, errors='coerce').notna().all())
+                    f['integral'] = f['numeric'] and f['integral'] and bool(
+                        values.str.fullmatch(r"\s*[+-]?\d+\s*").all())
+                if f['boolean']:
+                    f['boolean'] = bool(values.isin(list(self.BOOL_VALUES)).all())
+
+        types = {}
+        for col, f in flags.items():
+            if not f['has_values']:
+                continue
+            if f['boolean']:
+                types[col] = 'bool'
+            elif f['integral'] and not f['has_missing']:
+                types[col] = 'int'
+            elif f['numeric']:
+                types[col] = 'float'
+        return types
+
+    def iter_csv(self, filepath: Path, category: str) -> Iterator[List[Dict]]:
+        """Yield documents for one CSV, one list per read_csv chunk"""
+        types = self.column_types(filepath)
+        for df in pd.read_csv(filepath, dtype=str, chunksize=self.chunksize):
+            for col, kind in types.items():
+                if kind == 'bool':
+                    df[col] = df[col].map(self.BOOL_VALUES)
+                else:
+                    df[col] = pd.to_numeric(df[col]).astype('int64' if kind == 'int' else 'float64')
+            yield self.frame_to_documents(df, category)
+
+    def process_csv(self, filepath: Path, category: str) -> List[Dict]:
+        """Process a single CSV file"""
+        return [doc for chunk in self.iter_csv(filepath, category) for doc in chunk]
+
+    def load_all(self) -> Iterator[List[Dict]]:
+        """Yield batches of documents across all CSV files in the data directory"""
+        total = 0
+        for filename, category in self.CSV_FILES.items():
             filepath = self.data_dir / filename
-            if filepath.exists():
-                docs = self.process_csv(filepath, category)
-                all_documents.extend(docs)
-                print(f"Loaded {len(docs)} rows from {filename}")
-            else:
+            if not filepath.exists():
                 print(f"Skipping {filename} - not found")
-        
-        print(f"\nTotal documents: {len(all_documents)}")
-        return all_documents
\ No newline at end of file
+                continue
+
+            rows = 0
+            for documents in self.iter_csv(filepath, category):
+                rows += len(documents)
+                yield documents
+            total += rows
+            print(f"Loaded {rows} rows from {filename}")
+
+        print(f"\nTotal documents: {total}")
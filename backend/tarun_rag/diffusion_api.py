@@ -1,56 +1,142 @@
-import io
+import asyncio
 import os
+from contextlib import asynccontextmanager
 from typing import Optional
 
 from fastapi import FastAPI, HTTPException, UploadFile, File
-from fastapi.responses import Response
+from fastapi.responses import StreamingResponse
+
+from diffusion_engine import default_model_id, engine, format_timings
+from diffusion_jobs import JobQueue, ResultStore, result_key
+from executors import BoundedExecutor
+from image_io import check_output_format, iter_chunks, media_type
+import metrics
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """With DIFFUSION_PRELOAD=1, load the default model and run a warm-up generation"""
+    if os.getenv("DIFFUSION_PRELOAD", "0") == "1":
+        # queued like a request, so real requests wait for the warm-up instead of racing it
+        diffusion_executor.run_in_background(engine.warm_up, default_model_id())
+    yield
+
+
+app = FastAPI(title="Diffusion API", lifespan=lifespan)
+# GET /metrics (Prometheus text format), optional Server-Timing / profiling
+metrics.instrument(app)
+
+# Generation runs here, off the event loop, so /health stays responsive during a run
+diffusion_executor = BoundedExecutor(
+    "diffusion",
+    max_workers=int(os.getenv("DIFFUSION_WORKERS", "1")),
+    max_queue=int(os.getenv("DIFFUSION_MAX_QUEUE", "4")),
+)
+
+
+async def _img2img(job: dict):
+    return await diffusion_executor.run(engine.img2img, **job)
+
+
+# png (lossless), webp or jpeg; requests can override it with ?output_format=
+DEFAULT_OUTPUT_FORMAT = os.getenv("DIFFUSION_OUTPUT_FORMAT", "png")
+
+# Finished images, keyed by a hash of (init image, prompt, seed, params): a retry or a
+# repeat of the same request is answered from disk instead of regenerating
+result_store = ResultStore(
+    os.getenv("DIFFUSION_RESULT_DIR", "diffusion_results"),
+    max_bytes=int(float(os.getenv("DIFFUSION_RESULT_MAX_MB", "2048")) * 1024 * 1024),
+)
+metrics.register_cache("diffusion_results", result_store)
+
+# Submit/poll/fetch jobs for clients that shouldn't hold a connection open during a run
+job_queue = JobQueue(
+    _img2img,
+    result_store,
+    workers=diffusion_executor.max_workers,
+    max_queue=int(os.getenv("DIFFUSION_JOB_MAX_QUEUE", "64")),
+    ttl_s=float(os.getenv("DIFFUSION_JOB_TTL_S", "3600")),
+    retry_max_s=float(os.getenv("DIFFUSION_JOB_RETRY_MAX_S", "5")),
+)
+metrics.register_gauge("tarun_diffusion_jobs_queued", "Jobs waiting in the submit/poll queue",
+                       lambda: job_queue.stats()["queued"])
 
-app = FastAPI(title="Diffusion API")
 
-_diffusion_pipe = None
-_diffusion_model_id: Optional[str] = None
-
-
-def _get_diffusion_pipe(model_id: str):
-    global _diffusion_pipe, _diffusion_model_id
-
-    if _diffusion_pipe is not None and _diffusion_model_id == model_id:
-        return _diffusion_pipe
+@app.get("/health")
+async def health():
+    return {
+        "status": "ok",
+        "queues": {diffusion_executor.name: diffusion_executor.stats()},
+        "pipelines": engine.stats(),
+        "jobs": job_queue.stats(),
+        "result_store": result_store.stats(),
+    }
 
-    try:
-        import torch
-        from diffusers import Flux2KleinPipeline
-    except Exception as e:
-        raise HTTPException(
-            status_code=500,
-            detail=(
-                "Diffusion dependencies not available. Install `diffusers` and `torch` "
-                f"inside the container. Import error: {type(e).__name__}: {e}"
-            ),
-        )
 
-    device = "cuda" if torch.cuda.is_available() else "cpu"
-    dtype = torch.float16 if device == "cuda" else torch.float32
+def _img2img_params(
+    prompt: str,
+    height: int,
+    width: int,
+    guidance_scale: float,
+    num_inference_steps: int,
+    seed: int,
+    model_id: Optional[str],
+    output_format: Optional[str],
+    quality: int,
+) -> dict:
+    if not 1 <= quality <= 100:
+        raise HTTPException(status_code=400, detail="quality must be between 1 and 100")
+    return dict(
+        prompt=prompt,
+        height=height,
+        width=width,
+        guidance_scale=guidance_scale,
+        num_inference_steps=num_inference_steps,
+        seed=seed,
+        model_id=model_id or default_model_id(),
+        output_format=check_output_format(output_format or DEFAULT_OUTPUT_FORMAT),
+        quality=quality,
+    )
+
+
+def _image_response(data: bytes, params: dict, headers: dict) -> StreamingResponse:
+    return StreamingResponse(
+        iter_chunks(data),
+        media_type=media_type(params["output_format"]),
+        headers={"Content-Length": str(len(data)), **headers},
+    )
 
-    pipe = Flux2KleinPipeline.from_pretrained(model_id, torch_dtype=dtype)
-    if device == "cuda":
-        pipe.enable_sequential_cpu_offload()
-        pipe.enable_attention_slicing()
-    else:
-        pipe.to(device)
 
-    _diffusion_pipe = pipe
-    _diffusion_model_id = model_id
-    return _diffusion_pipe
+@app.post("/flux2klein/img2img")
+async def flux2klein_img2img(
+    prompt: str,
+    init_image: UploadFile = File(...),
+    height: int = 1024,
+    width: int = 576,
+    guidance_scale: float = 10.0,
+    num_inference_steps: int = 4,
+    seed: int = 0,
+    model_id: Optional[str] = None,
+    output_format: Optional[str] = None,
+    quality: int = 85,
+):
+    params = _img2img_params(
+        prompt, height, width, guidance_scale, num_inference_steps, seed, model_id, output_format, quality
+    )
+    raw = await init_image.read()
 
+    key = result_key(raw, params)
+    # disk reads and writes go to a worker thread, off the event loop
+    cached = await asyncio.to_thread(result_store.get, key)
+    if cached is not None:
+        return _image_response(cached, params, {"X-Cache": "hit"})
 
-@app.get("/health")
-async def health():
-    return {"status": "ok"}
+    data, timings = await _img2img(dict(raw=raw, **params))
+    await asyncio.to_thread(result_store.put, key, data)
+    return _image_response(data, params, {"Server-Timing": format_timings(timings), "X-Cache": "miss"})
 
 
-@app.post("/flux2klein/img2img")
-async def flux2klein_img2img(
+@app.post("/jobs/flux2klein/img2img", status_code=202)
+async def submit_img2img_job(
     prompt: str,
     init_image: UploadFile = File(...),
     height: int = 1024,
@@ -59,42 +145,29 @@ async def flux2klein_img2img(
     num_inference_steps: int = 4,
     seed: int = 0,
     model_id: Optional[str] = None,
+    output_format: Optional[str] = None,
+    quality: int = 85,
 ):
-    effective_model_id = model_id or os.getenv("DIFFUSION_MODEL_ID") or "black-forest-labs/FLUX.2-klein-4B"
+    """Queue an img2img job; poll GET /jobs/{job_id}, then fetch GET /jobs/{job_id}/result"""
+    params = _img2img_params(
+        prompt, height, width, guidance_scale, num_inference_steps, seed, model_id, output_format, quality
+    )
+    job = await job_queue.submit(await init_image.read(), params)
+    return job_queue.describe(job)
 
-    try:
-        import torch
-        from PIL import Image
-    except Exception as e:
-        raise HTTPException(
-            status_code=500,
-            detail=f"Missing runtime deps for diffusion endpoint: {type(e).__name__}: {e}",
-        )
 
-    raw = await init_image.read()
-    try:
-        pil = Image.open(io.BytesIO(raw)).convert("RGB")
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Invalid image upload: {type(e).__name__}: {e}")
-
-    pipe = _get_diffusion_pipe(effective_model_id)
-    device = "cuda" if torch.cuda.is_available() else "cpu"
-    gen = torch.Generator(device=device).manual_seed(seed)
-
-    try:
-        out = pipe(
-            prompt=prompt,
-            image=pil,
-            height=height,
-            width=width,
-            guidance_scale=guidance_scale,
-            num_inference_steps=num_inference_steps,
-            generator=gen,
-        )
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Diffusion generation failed: {type(e).__name__}: {e}")
-
-    buf = io.BytesIO()
-    out.images[0].save(buf, format="PNG")
-    return Response(content=buf.getvalue(), media_type="image/png")
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    return job_queue.describe(job_queue.get(job_id))
+
+
+@app.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: str):
+    data, params = await job_queue.result(job_id)
+    return _image_response(data, params, {})
+
 
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """Cancel a queued job (a running job can't be stopped: 409)"""
+    return job_queue.describe(job_queue.cancel(job_id))
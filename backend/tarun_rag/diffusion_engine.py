@@ -0,0 +1,437 @@
+# diffusion_engine.py
+import functools
+import gc
+import inspect
+import io
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Tuple
+
+from fastapi import HTTPException
+
+import metrics
+from image_io import decode_image, encode_image
+from ttl_cache import TTLCache
+
+DEFAULT_MODEL_ID = "black-forest-labs/FLUX.2-klein-4B"
+
+# gpu: everything resident; model: whole components swapped in per stage
+# (enable_model_cpu_offload); sequential: layer-by-layer (slowest, least VRAM);
+# auto: the fastest of those that fits in free VRAM when the model loads
+OFFLOAD_MODES = ("auto", "gpu", "model", "sequential")
+
+# free VRAM needed per byte of weights, leaving room for activations
+_VRAM_HEADROOM = 1.25
+
+PHASES = ("load", "image_decode", "encode", "denoise", "vae_decode", "image_encode", "total")
+
+PHASE_SECONDS = metrics.Histogram("tarun_diffusion_phase_seconds", "Time per img2img phase (per pipe(...) call)",
+                                  ("phase",))
+
+
+def default_model_id() -> str:
+    return os.getenv("DIFFUSION_MODEL_ID") or DEFAULT_MODEL_ID
+
+
+class DiffusionEngine:
+    """Bounded LRU of diffusion pipelines keyed by (model_id, dtype, device).
+
+    At most `max_resident` pipelines are held; loading another evicts the
+    least recently used one and frees its memory (offload hooks removed,
+    CUDA cache emptied) before the new weights come in. `offload` picks how
+    a pipeline is placed on a CUDA device (see OFFLOAD_MODES).
+    """
+
+    def __init__(
+        self,
+        max_resident: int = 1,
+        offload: str = "auto",
+        prompt_cache_size: int = 32,
+        prompt_cache_ttl_s: float = 86400.0,
+        prompt_cache_on_cpu: bool = False,
+    ):
+        if offload not in OFFLOAD_MODES:
+            raise ValueError(f"Unknown offload mode {offload!r}; expected one of {', '.join(OFFLOAD_MODES)}")
+        self.max_resident = max(1, max_resident)
+        self.offload = offload
+        self._pipes = OrderedDict()
+        self._modes = {}  # key -> offload mode actually used
+        # _lock guards the registry and counters and is only held briefly; _load_lock is held
+        # across evict + from_pretrained, so loads run one at a time without blocking stats()
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._local = threading.local()  # per-thread phase timings of the running request
+        self._timing_totals = {phase: [0, 0.0] for phase in PHASES}  # phase -> [count, seconds]
+        self._last_timings = {}
+        self.loads = 0
+        self.evictions = 0
+        self.images = 0  # pipe(...) calls, one image each
+        # (model_id, prompt) -> (encode_prompt outputs, seconds it took); quests reuse a few
+        # long style prompts, so the text encoder mostly runs once per prompt
+        self.prompt_cache = TTLCache(max_size=prompt_cache_size, ttl_s=prompt_cache_ttl_s)
+        self.prompt_cache_on_cpu = prompt_cache_on_cpu
+        self.prompt_time_saved_s = 0.0
+        self._prompt_cache_off = set()  # model_ids whose encode_prompt takes other arguments
+        self._prompt_cache_warned = set()
+
+    def get_pipe(self, model_id: str):
+        try:
+            import torch
+            from diffusers import Flux2KleinPipeline
+        except Exception as e:
+            raise HTTPException(
+                status_code=500,
+                detail=(
+                    "Diffusion dependencies not available. Install `diffusers` and `torch` "
+                    f"inside the container. Import error: {type(e).__name__}: {e}"
+                ),
+            )
+
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+        dtype = torch.float16 if device == "cuda" else torch.float32
+        key = (model_id, str(dtype), device)
+
+        pipe = self._resident(key)
+        if pipe is not None:
+            return pipe
+
+        # one load at a time, so two threads never load the same weights twice and the
+        # evicted pipeline's memory is freed before the next weights come in
+        with self._load_lock:
+            pipe = self._resident(key)
+            if pipe is not None:
+                return pipe
+
+            with self._lock:
+                evicted = []
+                while len(self._pipes) >= self.max_resident:
+                    evicted_key, evicted_pipe = self._pipes.popitem(last=False)
+                    self._modes.pop(evicted_key, None)
+                    evicted.append((evicted_key, evicted_pipe))
+                    self.evictions += 1
+            for evicted_key, evicted_pipe in evicted:
+                print(f"Evicting diffusion pipeline {evicted_key}")
+                self.prompt_cache.clear()
+                self._release(evicted_pipe)
+            evicted = evicted_pipe = None  # last references, so empty_cache can free them
+            self._empty_cache()
+
+            start = time.perf_counter()
+            pipe = Flux2KleinPipeline.from_pretrained(model_id, torch_dtype=dtype)
+            mode = self._place(pipe, device, torch)
+            self._instrument(pipe)
+            elapsed = time.perf_counter() - start
+            self._record("load", elapsed)
+            print(f"Loaded diffusion pipeline {key} ({mode}) in {elapsed:.1f}s")
+
+            with self._lock:
+                self._pipes[key] = pipe
+                self._modes[key] = mode
+                self.loads += 1
+            return pipe
+
+    def _resident(self, key):
+        with self._lock:
+            pipe = self._pipes.get(key)
+            if pipe is not None:
+                self._pipes.move_to_end(key)
+            return pipe
+
+    def _place(self, pipe, device: str, torch) -> str:
+        """Move `pipe` onto `device` per the offload policy; returns the mode used"""
+        if device != "cuda":
+            pipe.to(device)
+            return "cpu"
+
+        mode = self.offload if self.offload != "auto" else self._auto_offload(pipe, torch)
+        if mode == "gpu":
+            pipe.to(device)
+        elif mode == "model":
+            pipe.enable_model_cpu_offload()
+        else:
+            pipe.enable_sequential_cpu_offload()
+            pipe.enable_attention_slicing()
+        return mode
+
+    @staticmethod
+    def _auto_offload(pipe, torch) -> str:
+        """gpu if all weights fit in free VRAM, model if the largest component does, else sequential"""
+        sizes = [
+            sum(p.numel() * p.element_size() for p in component.parameters())
+            for component in pipe.components.values()
+            if isinstance(component, torch.nn.Module)
+        ]
+        free, _ = torch.cuda.mem_get_info()
+        gib = 1024 ** 3
+        if free >= sum(sizes) * _VRAM_HEADROOM:
+            mode = "gpu"
+        elif free >= max(sizes, default=0) * _VRAM_HEADROOM:
+            mode = "model"
+        else:
+            mode = "sequential"
+        print(
+            f"Diffusion offload auto -> {mode} (free {free / gib:.1f} GiB, "
+            f"weights {sum(sizes) / gib:.1f} GiB, largest component {max(sizes, default=0) / gib:.1f} GiB)"
+        )
+        return mode
+
+    def _instrument(self, pipe):
+        """Time prompt encoding and VAE decoding inside pipe(...) calls"""
+        if hasattr(pipe, "encode_prompt"):
+            pipe.encode_prompt = self._timed("encode", pipe.encode_prompt)
+        vae = getattr(pipe, "vae", None)
+        if vae is not None and hasattr(vae, "decode"):
+            vae.decode = self._timed("vae_decode", vae.decode)
+
+    def _timed(self, phase: str, fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            timings = getattr(self._local, "timings", None)
+            if timings is None:
+                return fn(*args, **kwargs)
+            # GPU work is asynchronous; sync on both sides so the phase owns its kernels
+            _synchronize()
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                _synchronize()
+                timings[phase] = timings.get(phase, 0.0) + time.perf_counter() - start
+        return wrapper
+
+    def _record(self, phase: str, seconds: float):
+        timings = getattr(self._local, "timings", None)
+        if timings is not None:
+            timings[phase] = timings.get(phase, 0.0) + seconds
+
+    def clear(self):
+        """Release every resident pipeline"""
+        with self._load_lock:
+            with self._lock:
+                pipes = list(self._pipes.values())
+                self._pipes.clear()
+                self._modes.clear()
+            for pipe in pipes:
+                self._release(pipe)
+            del pipes
+            self.prompt_cache.clear()
+            self._empty_cache()
+
+    @staticmethod
+    def _release(pipe):
+        # offload hooks keep references to the modules; drop them before the pipeline
+        if hasattr(pipe, "remove_all_hooks"):
+            pipe.remove_all_hooks()
+
+    @staticmethod
+    def _empty_cache():
+        gc.collect()
+        try:
+            import torch
+        except Exception:
+            return
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    def img2img(
+        self,
+        raw: bytes,
+        prompt: str,
+        height: int,
+        width: int,
+        guidance_scale: float,
+        num_inference_steps: int,
+        seed: int,
+        model_id: str,
+        output_format: str = "png",
+        quality: int = 85,
+    ) -> Tuple[bytes, Dict[str, float]]:
+        """Decode, generate and encode (blocking; run it on a worker thread).
+
+        Returns the encoded image and per-phase timings in seconds (`load`
+        only when this call had to load the pipeline). Every request gets its
+        own pipe(...) call: Flux2KleinPipeline reads a list `image` as
+        reference images for every prompt, not as one init image per prompt.
+        """
+        try:
+            import torch
+        except Exception as e:
+            raise HTTPException(
+                status_code=500,
+                detail=f"Missing runtime deps for diffusion endpoint: {type(e).__name__}: {e}",
+            )
+
+        self._local.timings = timings = {}
+        start_total = time.perf_counter()
+        try:
+            start = time.perf_counter()
+            image = decode_image(raw, (width, height))
+            timings["image_decode"] = time.perf_counter() - start
+
+            pipe = self.get_pipe(model_id)
+            device = "cuda" if torch.cuda.is_available() else "cpu"
+            generator = torch.Generator(device=device).manual_seed(seed)
+            prompt_kwargs = self._prompt_kwargs(pipe, torch, model_id, prompt)
+
+            encode_before = timings.get("encode", 0.0)
+            start = time.perf_counter()
+            try:
+                out = pipe(
+                    **prompt_kwargs,
+                    image=image,
+                    height=height,
+                    width=width,
+                    guidance_scale=guidance_scale,
+                    num_inference_steps=num_inference_steps,
+                    generator=generator,
+                )
+            except Exception as e:
+                raise HTTPException(status_code=500, detail=f"Diffusion generation failed: {type(e).__name__}: {e}")
+            _synchronize()
+            # whatever pipe(...) spent outside prompt encoding and VAE decoding
+            encode_inside = timings.get("encode", 0.0) - encode_before
+            timings["denoise"] = max(
+                time.perf_counter() - start - encode_inside - timings.get("vae_decode", 0.0), 0.0
+            )
+
+            start = time.perf_counter()
+            data = encode_image(out.images[0], output_format, quality)
+            timings["image_encode"] = time.perf_counter() - start
+        finally:
+            self._local.timings = None
+        timings["total"] = time.perf_counter() - start_total
+        self._add_timings(timings)
+        return data, timings
+
+    def _prompt_kwargs(self, pipe, torch, model_id: str, prompt: str) -> dict:
+        """pipe(...) prompt arguments: cached prompt_embeds where the pipeline takes them, else the text"""
+        plain = {"prompt": prompt}
+        if (self.prompt_cache.max_size == 0 or model_id in self._prompt_cache_off
+                or not hasattr(pipe, "encode_prompt") or not _accepts(pipe, "prompt_embeds")):
+            return plain
+
+        device = getattr(pipe, "_execution_device", None) or ("cuda" if torch.cuda.is_available() else "cpu")
+        entry = self.prompt_cache.get((model_id, prompt))
+        if entry is None:
+            start = time.perf_counter()
+            try:
+                with torch.inference_mode():
+                    outputs = pipe.encode_prompt(prompt=prompt, device=device, num_images_per_prompt=1)
+            except Exception as e:
+                # the pipeline can still encode the text itself; only the cache is skipped
+                self._prompt_cache_failed(model_id, e)
+                return plain
+            _synchronize()
+            outputs = outputs if isinstance(outputs, tuple) else (outputs,)
+            if self.prompt_cache_on_cpu:
+                outputs = tuple(o.to("cpu") if torch.is_tensor(o) else o for o in outputs)
+            entry = (outputs, time.perf_counter() - start)
+            self.prompt_cache.put((model_id, prompt), entry)
+        else:
+            with self._lock:
+                self.prompt_time_saved_s += entry[1]
+
+        outputs = entry[0]
+        kwargs = {"prompt_embeds": outputs[0].to(device)}
+        # Flux.1-style pipelines return (prompt_embeds, pooled_prompt_embeds, text_ids)
+        if len(outputs) >= 3 and _accepts(pipe, "pooled_prompt_embeds"):
+            kwargs["pooled_prompt_embeds"] = outputs[1].to(device)
+        return kwargs
+
+    def _prompt_cache_failed(self, model_id: str, error: Exception):
+        if isinstance(error, TypeError):
+            # a diffusers version whose encode_prompt has another signature; it won't work next time either
+            self._prompt_cache_off.add(model_id)
+        key = (model_id, type(error).__name__)
+        if key not in self._prompt_cache_warned:
+            self._prompt_cache_warned.add(key)
+            print(f"Prompt embedding cache skipped for {model_id}: encode_prompt failed "
+                  f"({type(error).__name__}: {error}); passing prompt= to the pipeline instead")
+
+    def warm_up(self, model_id: str, height: int = 256, width: int = 256):
+        """Load `model_id` and run one tiny generation so the first real request starts hot"""
+        from PIL import Image
+
+        buf = io.BytesIO()
+        Image.new("RGB", (width, height), (128, 128, 128)).save(buf, format="PNG")
+        _, timings = self.img2img(
+            buf.getvalue(), prompt="warm-up", height=height, width=width,
+            guidance_scale=1.0, num_inference_steps=1, seed=0, model_id=model_id,
+        )
+        print(f"Diffusion warm-up for {model_id}: {format_timings(timings)}")
+
+    def _add_timings(self, timings: Dict[str, float]):
+        for phase, seconds in timings.items():
+            PHASE_SECONDS.observe(seconds, phase=phase)
+        with self._lock:
+            self.images += 1
+            self._last_timings = dict(timings)
+            for phase, seconds in timings.items():
+                total = self._timing_totals.setdefault(phase, [0, 0.0])
+                total[0] += 1
+                total[1] += seconds
+
+    def stats(self) -> dict:
+        with self._lock:
+            resident = [
+                {"model_id": key[0], "dtype": key[1], "device": key[2], "offload": self._modes.get(key)}
+                for key in self._pipes
+            ]
+            timings = {
+                phase: {"count": count, "mean_ms": round(1000 * seconds / count, 1)}
+                for phase, (count, seconds) in self._timing_totals.items()
+                if count
+            }
+            last = {phase: round(1000 * seconds, 1) for phase, seconds in self._last_timings.items()}
+        return {
+            "resident": resident,
+            "max_resident": self.max_resident,
+            "offload": self.offload,
+            "loads": self.loads,
+            "evictions": self.evictions,
+            "images": self.images,
+            "timings": timings,
+            "last_timings_ms": last,
+            "prompt_cache": {
+                **self.prompt_cache.stats(),
+                "time_saved_s": round(self.prompt_time_saved_s, 3),
+                "saved_ms_per_image": round(1000 * self.prompt_time_saved_s / self.images, 1) if self.images else 0.0,
+            },
+        }
+
+
+def format_timings(timings: Dict[str, float]) -> str:
+    """Server-Timing header value, durations in milliseconds"""
+    return ", ".join(f"{phase};dur={1000 * timings[phase]:.1f}" for phase in PHASES if phase in timings)
+
+
+def _accepts(pipe, argument: str) -> bool:
+    try:
+        return argument in inspect.signature(pipe.__call__).parameters
+    except (TypeError, ValueError):
+        return False
+
+
+def _synchronize():
+    try:
+        import torch
+    except Exception:
+        return
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+
+
+# One engine per process; rag_api forwards to diffusion_api instead of loading its own
+# copy when DIFFUSION_API_URL is set (see start.sh)
+engine = DiffusionEngine(
+    max_resident=int(os.getenv("DIFFUSION_MAX_RESIDENT", "1")),
+    offload=os.getenv("DIFFUSION_OFFLOAD", "auto"),
+    prompt_cache_size=int(os.getenv("DIFFUSION_PROMPT_CACHE_SIZE", "32")),
+    prompt_cache_ttl_s=float(os.getenv("DIFFUSION_PROMPT_CACHE_TTL_S", "86400")),
+    prompt_cache_on_cpu=os.getenv("DIFFUSION_PROMPT_CACHE_ON_CPU", "0") == "1",
+)
+metrics.register_cache("diffusion_prompts", engine.prompt_cache)
+metrics.register_gauge("tarun_diffusion_resident_pipelines", "Diffusion pipelines currently loaded",
+                       lambda: len(engine._pipes))
@@ -0,0 +1,291 @@
+# diffusion_jobs.py
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from pathlib import Path
+from typing import Awaitable, Callable, Optional, Tuple
+
+from fastapi import HTTPException
+
+
+def result_key(raw: bytes, params: dict) -> str:
+    """Content hash of one img2img request: init image bytes + prompt, seed and every other param"""
+    h = hashlib.sha256()
+    h.update(hashlib.sha256(raw).digest())
+    h.update(json.dumps(params, sort_keys=True).encode("utf-8"))
+    return h.hexdigest()
+
+
+class ResultStore:
+    """Finished images on disk, keyed by result_key.
+
+    Files are written to a temp name and renamed, so a reader never sees a
+    partial image. Once the store grows past `max_bytes`, the least recently
+    written files are deleted.
+    """
+
+    def __init__(self, root: str, max_bytes: int = 2 * 1024 ** 3):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # key -> size, oldest first, so pruning never has to walk the directory
+        self._sizes = OrderedDict(
+            (path.name, path.stat().st_size)
+            for path in sorted(self.root.glob("*/*"), key=lambda p: p.stat().st_mtime)
+            if not path.name.endswith(".tmp")
+        )
+        self._total = sum(self._sizes.values())
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key: str) -> Path:
+        # the key covers the output format, so one file per (request, format)
+        return self.root / key[:2] / key
+
+    def read(self, key: str) -> Optional[bytes]:
+        try:
+            return self._path(key).read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def get(self, key: str) -> Optional[bytes]:
+        """read(), counted as a request-level cache lookup in stats()"""
+        data = self.read(key)
+        with self._lock:
+            if data is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return data
+
+    def put(self, key: str, data: bytes):
+        path = self._path(key)
+        path.parent.mkdir(exist_ok=True)
+        tmp_path = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._total += len(data) - self._sizes.pop(key, 0)
+            self._sizes[key] = len(data)
+            while self._total > self.max_bytes and len(self._sizes) > 1:
+                old_key, size = self._sizes.popitem(last=False)
+                self._path(old_key).unlink(missing_ok=True)
+                self._total -= size
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "files": len(self._sizes),
+                "bytes": self._total,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+class Job:
+    __slots__ = ("id", "key", "params", "raw", "status", "cached", "error", "timings", "created", "started", "finished")
+
+    def __init__(self, key: str, params: dict, raw: bytes):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.params = params
+        self.raw = raw
+        self.status = "queued"  # queued -> running -> done | failed; queued -> cancelled
+        self.cached = False  # answered from the result store without generating
+        self.error = None
+        self.timings = {}
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+
+
+class JobQueue:
+    """Bounded in-process queue of img2img jobs with ids, polling and cancellation.
+
+    `runner(params)` does the work and returns (image bytes, timings);
+    `workers` is how many jobs are handed to it at once. Identical requests (same result_key) share one job while it
+    is pending, and are answered straight from `store` once it is done.
+
+    Only a full queue rejects, at submit time. When the runner has no
+    capacity (503, e.g. the diffusion executor is full of synchronous
+    requests), the job goes back to the head of the line and its worker
+    retries after a backoff of `retry_initial_s`, doubling up to `retry_max_s`.
+    Store reads and writes run on worker threads, off the event loop.
+    """
+
+    def __init__(
+        self,
+        runner: Callable[[dict], Awaitable],
+        store: ResultStore,
+        workers: int = 4,
+        max_queue: int = 64,
+        ttl_s: float = 3600.0,
+        retry_initial_s: float = 0.25,
+        retry_max_s: float = 5.0,
+    ):
+        self.runner = runner
+        self.store = store
+        self.workers = max(1, workers)
+        self.max_queue = max(1, max_queue)
+        self.ttl_s = ttl_s
+        self.retry_initial_s = retry_initial_s
+        self.retry_max_s = retry_max_s
+        self.retries = 0  # runner calls turned away for lack of capacity
+        self._jobs = {}  # id -> Job
+        self._pending = deque()  # queued jobs, oldest first
+        self._active = {}  # result_key -> queued/running Job
+        self._wakeup = None
+        self._tasks = []
+
+    async def submit(self, raw: bytes, params: dict) -> Job:
+        self._prune()
+        key = result_key(raw, params)
+
+        active = self._active.get(key)
+        if active is not None:
+            return active
+        cached = await asyncio.to_thread(self.store.get, key) is not None
+        # an identical submit may have queued while the store was read
+        active = self._active.get(key)
+        if active is not None:
+            return active
+
+        job = Job(key, params, raw)
+        self._jobs[job.id] = job
+        if cached:
+            job.status = "done"
+            job.cached = True
+            job.started = job.finished = job.created
+            job.raw = None
+            return job
+
+        if len(self._pending) >= self.max_queue:
+            del self._jobs[job.id]
+            raise HTTPException(
+                status_code=503,
+                detail=f"diffusion job queue is full ({len(self._pending)} waiting), retry shortly",
+                headers={"Retry-After": "5"},
+            )
+        self._pending.append(job)
+        self._active[key] = job
+        self._start_workers()
+        self._wakeup.set()
+        return job
+
+    def get(self, job_id: str) -> Job:
+        job = self._jobs.get(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail=f"Unknown job {job_id}")
+        return job
+
+    def position(self, job: Job) -> Optional[int]:
+        """0-based place in line for a queued job, else None"""
+        if job.status != "queued":
+            return None
+        for i, pending in enumerate(self._pending):
+            if pending is job:
+                return i
+        return None
+
+    async def result(self, job_id: str) -> Tuple[bytes, dict]:
+        """The finished image and the params it was made with"""
+        job = self.get(job_id)
+        if job.status == "failed":
+            raise HTTPException(status_code=500, detail=f"Job failed: {job.error}")
+        if job.status != "done":
+            raise HTTPException(status_code=409, detail=f"Job is {job.status}")
+        data = await asyncio.to_thread(self.store.read, job.key)
+        if data is None:
+            raise HTTPException(status_code=410, detail="Result was evicted from the result store; resubmit")
+        return data, job.params
+
+    def cancel(self, job_id: str) -> Job:
+        job = self.get(job_id)
+        if job.status == "queued":
+            self._pending.remove(job)
+            self._active.pop(job.key, None)
+            job.status = "cancelled"
+            job.raw = None
+            job.finished = time.time()
+        elif job.status == "running":
+            raise HTTPException(status_code=409, detail="Job is already running and can't be cancelled")
+        return job
+
+    def describe(self, job: Job) -> dict:
+        return {
+            "job_id": job.id,
+            "status": job.status,
+            "position": self.position(job),
+            "cached": job.cached,
+            "error": job.error,
+            "created": job.created,
+            "started": job.started,
+            "finished": job.finished,
+            "timings_ms": {phase: round(1000 * s, 1) for phase, s in job.timings.items()},
+        }
+
+    def stats(self) -> dict:
+        counts = {}
+        for job in self._jobs.values():
+            counts[job.status] = counts.get(job.status, 0) + 1
+        return {
+            "queued": len(self._pending),
+            "max_queue": self.max_queue,
+            "workers": self.workers,
+            "capacity_retries": self.retries,
+            "jobs": counts,
+        }
+
+    def _start_workers(self):
+        if self._tasks:
+            return
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+
+    async def _worker(self):
+        delay = self.retry_initial_s
+        while True:
+            if not self._pending:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            job = self._pending.popleft()
+            job.status = "running"
+            job.started = time.time()
+            try:
+                data, job.timings = await self.runner(dict(raw=job.raw, **job.params))
+                await asyncio.to_thread(self.store.put, job.key, data)
+                job.status = "done"
+            except HTTPException as e:
+                if e.status_code == 503:
+                    # no capacity right now: back in line (still cancellable), try again later
+                    job.status = "queued"
+                    job.started = None
+                    self._pending.appendleft(job)
+                    self.retries += 1
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, self.retry_max_s)
+                    continue
+                job.status, job.error = "failed", e.detail
+            except Exception as e:
+                job.status, job.error = "failed", f"{type(e).__name__}: {e}"
+            delay = self.retry_initial_s
+            job.finished = time.time()
+            job.raw = None
+            self._active.pop(job.key, None)
+
+    def _prune(self):
+        """Forget finished jobs older than ttl_s (their images stay in the store)"""
+        cutoff = time.time() - self.ttl_s
+        for job_id in [j.id for j in self._jobs.values() if j.finished is not None and j.finished < cutoff]:
+            del self._jobs[job_id]
@@ -0,0 +1,181 @@
+# doc_store.py
+import json
+import mmap
+import os
+import struct
+from pathlib import Path
+from typing import Iterable
+
+import numpy as np
+
+DOCUMENTS_FILE = "documents.jsonl"
+SNAPSHOT_FILE = "documents.snapshot"
+# side files of indexes built before the snapshot existed; converted on first load
+OFFSETS_FILE = "documents.offsets.npy"
+CATEGORY_CODES_FILE = "doc_categories.npy"
+CATEGORIES_FILE = "categories.json"
+
+# magic, document count, categories JSON length, size of the documents.jsonl it describes
+_SNAPSHOT_HEADER = struct.Struct("<8sQQQ")
+_SNAPSHOT_MAGIC = b"TDOCSNP1"
+
+
+class DocumentStoreWriter:
+    """Append documents one at a time; close() writes the documents.snapshot"""
+
+    def __init__(self, output_dir: str):
+        self.path = Path(output_dir)
+        self.path.mkdir(parents=True, exist_ok=True)
+        # written under a temp name and renamed on close, so a server that has the
+        # old file memory-mapped keeps reading a consistent copy
+        self._tmp_path = self.path / (DOCUMENTS_FILE + ".tmp")
+        self._file = self._tmp_path.open("wb")
+        self._offsets = [0]
+        self._codes = []
+        self._names = {}  # category -> code, in first-seen order
+
+    def add(self, doc: dict):
+        line = (json.dumps(doc, ensure_ascii=False) + "\n").encode("utf-8")
+        self._file.write(line)
+        self._offsets.append(self._offsets[-1] + len(line))
+        self._codes.append(self._names.setdefault(doc['category'], len(self._names)))
+
+    def __len__(self) -> int:
+        return len(self._codes)
+
+    def close(self):
+        self._file.close()
+        os.replace(self._tmp_path, self.path / DOCUMENTS_FILE)
+        _write_snapshot(self.path, self._offsets, self._codes, self._names)
+
+
+def write_document_store(output_dir: str, documents: Iterable[dict]) -> int:
+    """Stream `documents` to documents.jsonl plus its snapshot; returns the count"""
+    writer = DocumentStoreWriter(output_dir)
+    for doc in documents:
+        writer.add(doc)
+    writer.close()
+    return len(writer)
+
+
+def index_document_file(input_dir: str):
+    """Build the snapshot for a documents.jsonl written before it existed (one full pass)"""
+    inp = Path(input_dir)
+    offsets = [0]
+    codes = []
+    names = {}
+    with (inp / DOCUMENTS_FILE).open("rb") as f:
+        for line in f:
+            offsets.append(offsets[-1] + len(line))
+            codes.append(names.setdefault(json.loads(line)['category'], len(names)))
+
+    _write_snapshot(inp, offsets, codes, names)
+
+
+def _write_snapshot(out: Path, offsets, codes, names):
+    """documents.snapshot: header, categories JSON, uint64 offsets, uint16 category codes.
+
+    Everything DocumentStore keeps in memory, laid out so it comes back with
+    one read and zero-copy array views (no per-document parsing).
+    """
+    offsets = np.asarray(offsets, dtype=np.uint64)
+    codes = np.asarray(codes, dtype=np.uint16)
+    names = {name: i for i, name in enumerate(names)} if not isinstance(names, dict) else names
+    counts = np.bincount(codes, minlength=len(names)) if len(codes) else np.zeros(len(names), dtype=np.int64)
+    categories = json.dumps({
+        "names": list(names),
+        "counts": {name: int(counts[code]) for name, code in names.items()},
+    }).encode("utf-8")
+    categories += b" " * (-len(categories) % 8)  # keeps the offsets 8-byte aligned
+
+    tmp_path = out / (SNAPSHOT_FILE + ".tmp")
+    with tmp_path.open("wb") as f:
+        f.write(_SNAPSHOT_HEADER.pack(_SNAPSHOT_MAGIC, len(codes), len(categories), int(offsets[-1])))
+        f.write(categories)
+        f.write(offsets.tobytes())
+        f.write(codes.tobytes())
+    os.replace(tmp_path, out / SNAPSHOT_FILE)
+
+
+def _read_snapshot(path: Path):
+    """(offsets, category codes, categories dict, documents.jsonl size) from one read of the snapshot"""
+    data = path.read_bytes()
+    magic, n_docs, categories_len, documents_size = _SNAPSHOT_HEADER.unpack_from(data)
+    if magic != _SNAPSHOT_MAGIC:
+        raise ValueError(f"{path} is not a document snapshot")
+    pos = _SNAPSHOT_HEADER.size
+    categories = json.loads(data[pos:pos + categories_len])
+    pos += categories_len
+    offsets = np.frombuffer(data, dtype=np.uint64, count=n_docs + 1, offset=pos)
+    codes = np.frombuffer(data, dtype=np.uint16, count=n_docs, offset=pos + offsets.nbytes)
+    return offsets, codes, categories, documents_size
+
+
+def _convert_side_files(inp: Path):
+    """Write the snapshot from the older offsets/codes/categories side files"""
+    with (inp / CATEGORIES_FILE).open("r", encoding="utf-8") as f:
+        names = json.load(f)["names"]
+    _write_snapshot(inp, np.load(inp / OFFSETS_FILE), np.load(inp / CATEGORY_CODES_FILE), names)
+
+
+class DocumentStore:
+    """Read-only, memory-mapped view of documents.jsonl.
+
+    Only byte offsets and a uint16 category code per document are held in
+    memory; a document's JSON is decoded when it is indexed, i.e. only for
+    rows that make it into a result set.
+    """
+
+    def __init__(self, input_dir: str):
+        self.path = Path(input_dir)
+        size = self.path.joinpath(DOCUMENTS_FILE).stat().st_size
+        snapshot = self.path / SNAPSHOT_FILE
+        if not snapshot.exists():
+            if (self.path / OFFSETS_FILE).exists() and (self.path / CATEGORIES_FILE).exists():
+                _convert_side_files(self.path)
+            else:
+                print(f"Indexing {self.path / DOCUMENTS_FILE} (one-time, for vector_db built before doc_store)...")
+                index_document_file(str(self.path))
+
+        self.offsets, self.category_codes, categories, indexed_size = _read_snapshot(snapshot)
+        if indexed_size != size:
+            # documents.jsonl was rewritten without its snapshot (e.g. copied in by hand)
+            print(f"{snapshot} is stale, re-indexing {self.path / DOCUMENTS_FILE}...")
+            index_document_file(str(self.path))
+            self.offsets, self.category_codes, categories, _ = _read_snapshot(snapshot)
+        self.category_names = categories["names"]
+        self.category_counts = categories["counts"]
+
+        self._file = (self.path / DOCUMENTS_FILE).open("rb")
+        self._blob = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> dict:
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return json.loads(self._blob[int(self.offsets[i]):int(self.offsets[i + 1])])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def category_of(self, i: int) -> str:
+        return self.category_names[self.category_codes[i]]
+
+    def category_ids(self) -> dict:
+        """category -> sorted doc ids, straight from the code array (no JSON decoding)"""
+        order = np.argsort(self.category_codes, kind="stable")
+        bounds = np.searchsorted(self.category_codes[order], np.arange(len(self.category_names) + 1))
+        return {
+            name: order[bounds[code]:bounds[code + 1]].astype(np.int64)
+            for code, name in enumerate(self.category_names)
+        }
+
+    def close(self):
+        if isinstance(self._blob, mmap.mmap):
+            self._blob.close()
+        self._file.close()
@@ -1,56 +1,196 @@
 # embedding_service.py
-import torch
-from transformers import AutoModel, AutoConfig
-from typing import List
+import os
+from typing import Callable, List, Tuple
 import numpy as np
 
+# user-facing name -> transformers attn_implementation
+ATTENTION_BACKENDS = {"flash": "flash_attention_2", "sdpa": "sdpa", "eager": "eager"}
+PRECISIONS = ("auto", "bf16", "fp16", "fp32", "int8")
+# torch dtype names; int8 loads in fp32 and is quantized afterwards
+_DTYPES = {"bf16": "bfloat16", "fp16": "float16", "fp32": "float32", "int8": "float32"}
+
+
+def _set_attention(cfg, implementation: str):
+    """Set the attention implementation on a config and its nested llm/vision/text configs"""
+    cfg._attn_implementation = implementation
+    cfg._attn_implementation_autoset = False
+    if hasattr(cfg, '_attn_implementation_internal'):
+        cfg._attn_implementation_internal = implementation
+    for attr in ['llm_config', 'vision_config', 'text_config']:
+        if hasattr(cfg, attr) and getattr(cfg, attr) is not None:
+            _set_attention(getattr(cfg, attr), implementation)
+
+
+def _attention_candidates(attention: str, device: str) -> List[str]:
+    """Backends to try in order; `auto` is the fastest one this box can run, down to eager"""
+    if attention != "auto":
+        if attention not in ATTENTION_BACKENDS:
+            raise ValueError(f"Unknown attention {attention!r}; expected auto or one of {', '.join(ATTENTION_BACKENDS)}")
+        # an explicit choice still falls back to eager if the remote code rejects it
+        return list(dict.fromkeys([attention, "eager"]))
+    candidates = ["sdpa", "eager"]
+    if device == "cuda":
+        try:
+            import flash_attn  # noqa: F401
+            candidates.insert(0, "flash")
+        except ImportError:
+            pass
+    return candidates
+
+
+def resolve_device_precision(device: str, precision: str) -> Tuple[str, str]:
+    """(device, precision) with `auto` resolved: CUDA if present, bf16 there and fp32 on CPU"""
+    import torch
+
+    if device == "auto":
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+    if device not in ("cuda", "cpu"):
+        raise ValueError(f"Unknown device {device!r}; expected auto, cuda or cpu")
+    if precision == "auto":
+        precision = "bf16" if device == "cuda" else "fp32"
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision {precision!r}; expected one of {', '.join(PRECISIONS)}")
+    if precision == "int8" and device != "cpu":
+        raise ValueError("int8 precision is CPU only; use device='cpu' or bf16/fp16 on CUDA")
+    return device, precision
+
+
+def document_settings(
+    device: str = os.getenv("EMBED_DEVICE", "auto"),
+    precision: str = os.getenv("EMBED_PRECISION", "auto"),
+    doc_max_length: int = int(os.getenv("EMBED_DOC_MAX_LENGTH", "8192")),
+) -> dict:
+    """What document embeddings depend on besides the model, without loading it (see EmbeddingSidecar)"""
+    _, precision = resolve_device_precision(device, precision)
+    return {"precision": precision, "doc_max_length": doc_max_length}
+
+
 class NemotronEmbeddingService:
-    """Embedding service using NVIDIA llama-nemotron-embed-vl-1b-v2"""
-    
-    def __init__(self, device: str = "cuda"):
+    """Embedding service using NVIDIA llama-nemotron-embed-vl-1b-v2
+
+    `device` is cuda, cpu or auto; `attention` is auto, flash, sdpa or eager;
+    `precision` is auto (bf16 on CUDA, fp32 on CPU), bf16, fp16, fp32 or int8
+    (dynamic int8 Linear layers, CPU only).
+    """
+
+    model_name = "nvidia/llama-nemotron-embed-vl-1b-v2"
+
+    def __init__(
+        self,
+        device: str = os.getenv("EMBED_DEVICE", "auto"),
+        attention: str = os.getenv("EMBED_ATTENTION", "auto"),
+        precision: str = os.getenv("EMBED_PRECISION", "auto"),
+        doc_max_length: int = int(os.getenv("EMBED_DOC_MAX_LENGTH", "8192")),
+        query_max_length: int = int(os.getenv("EMBED_QUERY_MAX_LENGTH", "512")),
+        token_budget: int = int(os.getenv("EMBED_TOKEN_BUDGET", "16384")),
+        max_batch_size: int = int(os.getenv("EMBED_MAX_BATCH_SIZE", "128")),
+    ):
+        # torch/transformers are imported here, not at module load, so rag_api (and the
+        # benchmark stubs) can import this module on a box without them
+        import torch
+
+        device, precision = resolve_device_precision(device, precision)
+
         self.device = device
-        self.model_name = "nvidia/llama-nemotron-embed-vl-1b-v2"
-        
-        # Load config and force eager attention everywhere
-        config = AutoConfig.from_pretrained(
-            self.model_name,
-            trust_remote_code=True
-        )
-        
-        # Force eager attention at all levels
-        def set_eager_attention(cfg):
-            cfg._attn_implementation = "eager"
-            cfg._attn_implementation_autoset = False
-            if hasattr(cfg, '_attn_implementation_internal'):
-                cfg._attn_implementation_internal = "eager"
-            # Recursively set on nested configs
-            for attr in ['llm_config', 'vision_config', 'text_config']:
-                if hasattr(cfg, attr) and getattr(cfg, attr) is not None:
-                    set_eager_attention(getattr(cfg, attr))
-        
-        set_eager_attention(config)
-        
-        # Load model
-        self.model = AutoModel.from_pretrained(
+        self.precision = precision
+        self.doc_max_length = doc_max_length
+        self.query_max_length = query_max_length
+        # a forward pass holds at most ~token_budget padded tokens (longest text x batch size)
+        self.token_budget = token_budget
+        self.max_batch_size = max_batch_size
+
+        self.attention = None
+        errors = []
+        for candidate in _attention_candidates(attention, device):
+            model = None
+            try:
+                model = self._load(ATTENTION_BACKENDS[candidate])
+                # some remote-code paths only fail on the first forward pass
+                with torch.inference_mode():
+                    model.encode_queries(["warm-up"])
+            except (ImportError, ValueError, NotImplementedError, RuntimeError) as e:
+                # the remote code or this transformers/torch build doesn't support it
+                errors.append(f"{candidate}: {type(e).__name__}: {e}")
+                model = None
+                if device == "cuda":
+                    torch.cuda.empty_cache()
+                print(f"Embedding model rejected {candidate} attention ({type(e).__name__}: {e}), trying the next backend")
+                continue
+            self.model = model
+            self.attention = candidate
+            break
+        if self.attention is None:
+            raise RuntimeError("Could not load the embedding model with any attention backend: " + "; ".join(errors))
+
+        if precision == "int8":
+            self.model = torch.ao.quantization.quantize_dynamic(
+                self.model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True
+            )
+        print(f"Embedding model on {device} ({precision}, {self.attention} attention)")
+
+        self.model.processor.p_max_length = doc_max_length
+        if hasattr(self.model.processor, "q_max_length"):
+            self.model.processor.q_max_length = query_max_length
+        self._tokenizer = getattr(self.model.processor, "tokenizer", None)
+
+    def _load(self, implementation: str):
+        import torch
+        from transformers import AutoConfig, AutoModel
+
+        config = AutoConfig.from_pretrained(self.model_name, trust_remote_code=True)
+        _set_attention(config, implementation)
+        model = AutoModel.from_pretrained(
             self.model_name,
             config=config,
-            dtype=torch.bfloat16,
+            dtype=getattr(torch, _DTYPES[self.precision]),
             trust_remote_code=True,
-            attn_implementation="eager",
-            device_map="auto"
-        ).eval()
-        
-        self.model.processor.p_max_length = 8192
-        
-    def embed_documents(self, texts: List[str]) -> np.ndarray:
+            attn_implementation=implementation,
+            device_map="auto" if self.device == "cuda" else None,
+        )
+        if self.device == "cpu":
+            model = model.to("cpu")
+        return model.eval()
+
+    def _token_lengths(self, texts: List[str]) -> np.ndarray:
+        """Token count per text (a chars/4 estimate if the processor has no tokenizer)"""
+        if self._tokenizer is not None:
+            ids = self._tokenizer(texts, add_special_tokens=True)["input_ids"]
+            return np.fromiter((len(i) for i in ids), dtype=np.int64, count=len(texts))
+        return np.fromiter((len(t) // 4 + 1 for t in texts), dtype=np.int64, count=len(texts))
+
+    def _length_batches(self, lengths: np.ndarray, max_length: int) -> List[np.ndarray]:
+        """Row indices grouped longest-first so each batch pads to a similar length within the token budget"""
+        order = np.argsort(-lengths, kind="stable")
+        capped = np.clip(lengths[order], 1, max_length)
+        batches = []
+        start = 0
+        while start < len(order):
+            size = max(1, min(self.max_batch_size, self.token_budget // int(capped[start])))
+            batches.append(order[start:start + size])
+            start += size
+        return batches
+
+    def _embed_bucketed(self, texts: List[str], encode: Callable, max_length: int) -> np.ndarray:
+        """Embed `texts` in length-bucketed batches; rows come back in input order"""
+        out = np.empty((len(texts), self.embedding_dim), dtype=np.float32)
+        if not texts:
+            return out
+        import torch
+
         with torch.inference_mode():
-            embeddings = self.model.encode_documents(texts=texts)
-        return embeddings.float().cpu().numpy()
-    
+            for rows in self._length_batches(self._token_lengths(texts), max_length):
+                out[rows] = encode([texts[i] for i in rows]).float().cpu().numpy()
+        return out
+
+    def embed_documents(self, texts: List[str]) -> np.ndarray:
+        return self._embed_bucketed(texts, lambda batch: self.model.encode_documents(texts=batch), self.doc_max_length)
+
     def embed_query(self, query: str) -> np.ndarray:
-        with torch.inference_mode():
-            embedding = self.model.encode_queries([query])
-        return embedding.float().cpu().numpy()
+        return self.embed_queries([query])
+
+    def embed_queries(self, queries: List[str]) -> np.ndarray:
+        """Embed many queries (one forward pass unless they exceed the token budget); one row per query"""
+        return self._embed_bucketed(queries, self.model.encode_queries, self.query_max_length)
     
     @property
     def embedding_dim(self) -> int:
@@ -0,0 +1,80 @@
+# embedding_store.py
+import json
+import os
+from pathlib import Path
+from typing import List
+
+import numpy as np
+
+
+class EmbeddingSidecar:
+    """Document embeddings keyed by content hash, persisted next to the index.
+
+    Lets build_index.py re-embed only rows whose text is new or changed. The
+    store is tied to how the vectors were made: a different model name,
+    dimension, precision or document truncation length makes every entry a miss.
+    """
+
+    def __init__(self, path: str, model_name: str, embedding_dim: int, precision: str, doc_max_length: int):
+        self.path = Path(path)
+        self.model_name = model_name
+        self.embedding_dim = embedding_dim
+        self.precision = precision
+        self.doc_max_length = doc_max_length
+        self._rows = {}  # content hash -> row in self._vectors
+        self._vectors = np.empty((0, embedding_dim), dtype=np.float32)
+
+    def load(self) -> "EmbeddingSidecar":
+        meta_path = self.path / "meta.json"
+        if not meta_path.exists():
+            return self
+
+        with meta_path.open("r", encoding="utf-8") as f:
+            meta = json.load(f)
+        # an older cache without precision/doc_max_length can't be trusted either
+        changed = [f"{field} {meta.get(field)} -> {value}" for field, value in self._header().items()
+                   if meta.get(field) != value]
+        if changed:
+            print(f"Embedding cache in {self.path} was built with other settings ({', '.join(changed)}); ignoring it")
+            return self
+
+        hashes = np.load(self.path / "hashes.npy")
+        self._vectors = np.load(self.path / "vectors.npy", mmap_mode="r")
+        self._rows = {h.decode("ascii"): i for i, h in enumerate(hashes)}
+        return self
+
+    def _header(self) -> dict:
+        return {
+            "model_name": self.model_name,
+            "embedding_dim": self.embedding_dim,
+            "precision": self.precision,
+            "doc_max_length": self.doc_max_length,
+        }
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def __contains__(self, content_hash: str) -> bool:
+        return content_hash in self._rows
+
+    def get(self, hashes: List[str]) -> np.ndarray:
+        """Vectors for `hashes`, all of which must be present"""
+        rows = [self._rows[h] for h in hashes]
+        return np.asarray(self._vectors[rows], dtype=np.float32)
+
+    def save(self, hashes: List[str], vectors: np.ndarray):
+        """Replace the store with exactly these entries (so removed rows are dropped)"""
+        self.path.mkdir(parents=True, exist_ok=True)
+        tmp_hashes = self.path / "hashes.tmp.npy"
+        tmp_vectors = self.path / "vectors.tmp.npy"
+        np.save(tmp_hashes, np.asarray(hashes, dtype="S"))
+        np.save(tmp_vectors, np.asarray(vectors, dtype=np.float32))
+
+        # swap in atomically; the old vectors may still be memory-mapped by self
+        os.replace(tmp_hashes, self.path / "hashes.npy")
+        os.replace(tmp_vectors, self.path / "vectors.npy")
+        with (self.path / "meta.json").open("w", encoding="utf-8") as f:
+            json.dump({**self._header(), "count": len(hashes)}, f)
+
+        self._rows = {h: i for i, h in enumerate(hashes)}
+        self._vectors = np.load(self.path / "vectors.npy", mmap_mode="r")
@@ -0,0 +1,91 @@
+# executors.py
+import asyncio
+import contextvars
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+from fastapi import HTTPException
+
+import metrics
+
+
+class BoundedExecutor:
+    """Thread pool for one kind of blocking work (embedding, ANN search, diffusion).
+
+    Keeps model/GPU calls off the asyncio event loop. At most `max_workers`
+    jobs run and `max_queue` more wait; anything beyond that is rejected with
+    503 instead of piling up behind a slow workload.
+    """
+
+    def __init__(self, name: str, max_workers: int = 1, max_queue: int = 64):
+        self.name = name
+        self.max_workers = max(1, max_workers)
+        self.max_queue = max(0, max_queue)
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self._inflight = 0
+        self._background = set()  # run_in_background tasks, referenced until they finish
+
+    @property
+    def depth(self) -> int:
+        """Jobs currently running or waiting"""
+        return self._inflight
+
+    def stats(self) -> dict:
+        return {
+            "inflight": self._inflight,
+            "max_workers": self.max_workers,
+            "max_queue": self.max_queue,
+        }
+
+    async def run(self, fn: Callable, *args, **kwargs):
+        with self._lock:
+            if self._inflight >= self.max_workers + self.max_queue:
+                metrics.REJECTED.inc(executor=self.name)
+                raise HTTPException(
+                    status_code=503,
+                    detail=f"{self.name} queue is full ({self._inflight} jobs in flight), retry shortly",
+                    headers={"Retry-After": "1"},
+                )
+            self._inflight += 1
+            metrics.INFLIGHT.set(self._inflight, executor=self.name)
+
+        # the caller's context goes along, so stages timed on the worker thread land in its request
+        context = contextvars.copy_context()
+        job = self._pool.submit(context.run, self._timed, functools.partial(fn, *args, **kwargs), time.perf_counter())
+        # release the slot when the job actually finishes, not when the caller stops waiting
+        job.add_done_callback(self._release)
+        return await asyncio.wrap_future(job)
+
+    def run_in_background(self, fn: Callable, *args, **kwargs) -> asyncio.Task:
+        """run() as a task nobody awaits (e.g. a warm-up); its failure is logged instead of lost"""
+        task = asyncio.ensure_future(self.run(fn, *args, **kwargs))
+        self._background.add(task)
+        task.add_done_callback(self._background_done)
+        return task
+
+    def _background_done(self, task: asyncio.Task):
+        self._background.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            e = task.exception()
+            print(f"{self.name}: background job failed: {type(e).__name__}: {getattr(e, 'detail', e)}")
+
+    def _timed(self, fn: Callable, submitted: float):
+        started = time.perf_counter()
+        metrics.QUEUE_WAIT_SECONDS.observe(started - submitted, executor=self.name)
+        metrics.record(f"{self.name}_queue", started - submitted)
+        try:
+            return fn()
+        finally:
+            metrics.RUN_SECONDS.observe(time.perf_counter() - started, executor=self.name)
+
+    def _release(self, _job):
+        with self._lock:
+            self._inflight -= 1
+            metrics.INFLIGHT.set(self._inflight, executor=self.name)
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,113 @@
+# geo_index.py
+import math
+from typing import Optional, Tuple
+
+import numpy as np
+
+EARTH_RADIUS_M = 6371008.8
+METERS_PER_DEG_LAT = 111320.0
+
+_CELL_OFFSET = 1 << 20  # keeps row/col non-negative for any lat/lon at sane cell sizes
+_CELL_STRIDE = 1 << 21
+
+BBox = Tuple[float, float, float, float]  # (min_lat, min_lon, max_lat, max_lon)
+
+
+def haversine_m(lat: float, lon: float, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+    """Great-circle distance in meters from (lat, lon) to each (lats[i], lons[i])"""
+    lat1, lon1 = math.radians(lat), math.radians(lon)
+    lat2, lon2 = np.radians(lats), np.radians(lons)
+    a = np.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+class GeoIndex:
+    """Uniform lat/lon grid over document coordinates.
+
+    Document ids are kept sorted by grid cell, so a query only reads the
+    cells overlapping its bounding box and then filters those candidates
+    exactly. Documents without coordinates (NaN) are never returned.
+    `bounds` keeps each document's geometry extent (a point for plain
+    lat/lon rows) so callers never re-parse geometry at query time.
+    """
+
+    def __init__(self, locations: np.ndarray, bounds: Optional[np.ndarray] = None, cell_deg: float = 0.005):
+        # locations: (n_docs, 2) float32 [lat, lon], NaN where unknown
+        # bounds: (n_docs, 4) float32 [min_lat, min_lon, max_lat, max_lon]
+        self.locations = np.asarray(locations, dtype=np.float32).reshape(-1, 2)
+        self.bounds = _point_bounds(self.locations) if bounds is None else np.asarray(bounds, dtype=np.float32).reshape(-1, 4)
+        self.cell_deg = cell_deg
+
+        valid = np.flatnonzero(~np.isnan(self.locations).any(axis=1))
+        keys = self._cell_keys(self.locations[valid, 0], self.locations[valid, 1])
+        order = np.argsort(keys, kind="stable")
+        self._keys = keys[order]
+        self._ids = valid[order].astype(np.int64)
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def _cells(self, lats, lons):
+        return (np.floor(np.asarray(lats, dtype=np.float64) / self.cell_deg).astype(np.int64),
+                np.floor(np.asarray(lons, dtype=np.float64) / self.cell_deg).astype(np.int64))
+
+    def _cell_keys(self, lats, lons) -> np.ndarray:
+        rows, cols = self._cells(lats, lons)
+        return (rows + _CELL_OFFSET) * _CELL_STRIDE + (cols + _CELL_OFFSET)
+
+    def _candidates(self, min_lat: float, min_lon: float, max_lat: float, max_lon: float) -> np.ndarray:
+        """Ids in every grid cell the box touches (a superset of the answer)"""
+        (r0, r1), (c0, c1) = self._cells([min_lat, max_lat], [min_lon, max_lon])
+        rows = np.arange(r0, r1 + 1)
+        if not len(rows):
+            return np.empty(0, dtype=np.int64)
+        starts = np.searchsorted(self._keys, (rows + _CELL_OFFSET) * _CELL_STRIDE + (c0 + _CELL_OFFSET), "left")
+        stops = np.searchsorted(self._keys, (rows + _CELL_OFFSET) * _CELL_STRIDE + (c1 + _CELL_OFFSET), "right")
+        return np.concatenate([self._ids[a:b] for a, b in zip(starts, stops)])
+
+    def within_bbox(self, min_lat: float, min_lon: float, max_lat: float, max_lon: float) -> np.ndarray:
+        """Sorted ids of documents inside the box"""
+        ids = self._candidates(min_lat, min_lon, max_lat, max_lon)
+        lats, lons = self.locations[ids, 0], self.locations[ids, 1]
+        inside = (lats >= min_lat) & (lats <= max_lat) & (lons >= min_lon) & (lons <= max_lon)
+        return np.sort(ids[inside])
+
+    def within_radius(self, lat: float, lon: float, radius_m: float) -> np.ndarray:
+        """Sorted ids of documents within `radius_m` meters of (lat, lon)"""
+        dlat = radius_m / METERS_PER_DEG_LAT
+        dlon = radius_m / (METERS_PER_DEG_LAT * max(math.cos(math.radians(lat)), 1e-6))
+        ids = self._candidates(lat - dlat, lon - dlon, lat + dlat, lon + dlon)
+        distances = haversine_m(lat, lon, self.locations[ids, 0], self.locations[ids, 1])
+        return np.sort(ids[distances <= radius_m])
+
+    def save(self, path: str):
+        np.savez(path, locations=self.locations, bounds=self.bounds, keys=self._keys, ids=self._ids,
+                 cell_deg=self.cell_deg)
+
+    @classmethod
+    def load(cls, path: str) -> "GeoIndex":
+        data = np.load(path)
+        index = cls.__new__(cls)
+        index.locations = data["locations"]
+        index.bounds = data["bounds"] if "bounds" in data else _point_bounds(index.locations)
+        index.cell_deg = float(data["cell_deg"])
+        index._keys = data["keys"]
+        index._ids = data["ids"]
+        return index
+
+
+def _point_bounds(locations: np.ndarray) -> np.ndarray:
+    return np.concatenate([locations, locations], axis=1)
+
+
+def document_geometry(documents) -> Tuple[np.ndarray, np.ndarray]:
+    """(n_docs, 2) [lat, lon] and (n_docs, 4) bounds float32 arrays from each document, NaN where missing"""
+    locations = np.full((len(documents), 2), np.nan, dtype=np.float32)
+    bounds = np.full((len(documents), 4), np.nan, dtype=np.float32)
+    for i, doc in enumerate(documents):
+        location = doc.get('location') or {}
+        lat, lon = location.get('lat'), location.get('lon')
+        if lat is not None and lon is not None:
+            locations[i] = (lat, lon)
+            bounds[i] = doc.get('bounds') or (lat, lon, lat, lon)
+    return locations, bounds
@@ -0,0 +1,91 @@
+# image_io.py
+import io
+import os
+from typing import Tuple
+
+from fastapi import HTTPException
+
+# output format -> (Pillow format name, media type)
+OUTPUT_FORMATS = {
+    "png": ("PNG", "image/png"),
+    "webp": ("WEBP", "image/webp"),
+    "jpeg": ("JPEG", "image/jpeg"),
+}
+
+MAX_UPLOAD_BYTES = int(float(os.getenv("DIFFUSION_MAX_UPLOAD_MB", "20")) * 1024 * 1024)
+# decoded size limit before any downscaling (guards against decompression bombs)
+MAX_INPUT_PIXELS = int(os.getenv("DIFFUSION_MAX_INPUT_PIXELS", str(64 * 1024 * 1024)))
+
+
+def check_output_format(output_format: str) -> str:
+    output_format = output_format.lower()
+    if output_format == "jpg":
+        output_format = "jpeg"
+    if output_format not in OUTPUT_FORMATS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown output_format {output_format!r}; expected one of {', '.join(OUTPUT_FORMATS)}",
+        )
+    return output_format
+
+
+def media_type(output_format: str) -> str:
+    return OUTPUT_FORMATS[output_format][1]
+
+
+def decode_image(raw: bytes, target_size: Tuple[int, int]):
+    """Decode an upload to RGB at no more than ~2x `target_size` (width, height).
+
+    JPEGs are decoded straight at a reduced DCT scale (draft mode), other
+    formats are box-reduced by an integer factor right after decoding. Both
+    keep the image at least `target_size` in each dimension, so the
+    pipeline's own resize sees the same content as a full-size decode.
+    """
+    from PIL import Image
+
+    if len(raw) > MAX_UPLOAD_BYTES:
+        raise HTTPException(
+            status_code=413, detail=f"Upload is {len(raw)} bytes; the limit is {MAX_UPLOAD_BYTES}"
+        )
+    try:
+        image = Image.open(io.BytesIO(raw))
+        width, height = image.size
+        if width * height > MAX_INPUT_PIXELS:
+            raise HTTPException(
+                status_code=413,
+                detail=f"Image is {width}x{height}; the limit is {MAX_INPUT_PIXELS} pixels",
+            )
+        if image.format == "JPEG":
+            # picks the largest 1/2, 1/4, 1/8 scale that still covers target_size
+            image.draft("RGB", target_size)
+        image = image.convert("RGB")
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Invalid image upload: {type(e).__name__}: {e}")
+
+    factor = min(image.width // max(target_size[0], 1), image.height // max(target_size[1], 1))
+    if factor >= 2:
+        image = image.reduce(factor)
+    return image
+
+
+def encode_image(image, output_format: str = "png", quality: int = 85) -> bytes:
+    """Encode a PIL image as png, webp or jpeg (`quality` applies to the lossy ones)"""
+    pil_format, _ = OUTPUT_FORMATS[output_format]
+    buf = io.BytesIO()
+    if pil_format == "PNG":
+        # zlib level 1: a fraction of the default's CPU for slightly larger files
+        image.save(buf, format="PNG", compress_level=1)
+    elif pil_format == "WEBP":
+        image.save(buf, format="WEBP", quality=quality, method=4)
+    else:
+        image.save(buf, format="JPEG", quality=quality, optimize=False)
+    return buf.getvalue()
+
+
+def iter_chunks(data: bytes, chunk_size: int = 64 * 1024):
+    """Yield `data` in chunks for a StreamingResponse"""
+    view = memoryview(data)
+    for start in range(0, len(view), chunk_size):
+        yield bytes(view[start:start + chunk_size])
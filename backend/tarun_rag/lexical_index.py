@@ -0,0 +1,132 @@
+# lexical_index.py
+import json
+import re
+from array import array
+from collections import Counter
+from pathlib import Path
+from typing import List, Optional
+
+import numpy as np
+
+INDEX_FILE = "lexical_index.npz"
+VOCAB_FILE = "lexical_vocab.json"
+
+_TOKEN = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> List[str]:
+    """Case-folded word tokens; the same rule is used for documents and queries"""
+    return _TOKEN.findall(text.casefold())
+
+
+class LexicalIndexBuilder:
+    """Collects per-document term counts in document-id order; build() turns them into a LexicalIndex"""
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.vocab = {}  # term -> id, in first-seen order
+        # one entry per (document, distinct term); array() keeps millions of postings compact
+        self._terms = array("i")
+        self._docs = array("i")
+        self._tfs = array("i")
+        self._lengths = array("i")
+
+    def add(self, text: str):
+        doc_id = len(self._lengths)
+        counts = Counter(tokenize(text))
+        self._lengths.append(sum(counts.values()))
+        for term, tf in counts.items():
+            self._terms.append(self.vocab.setdefault(term, len(self.vocab)))
+            self._docs.append(doc_id)
+            self._tfs.append(tf)
+
+    def __len__(self) -> int:
+        return len(self._lengths)
+
+    def build(self) -> "LexicalIndex":
+        terms = np.frombuffer(self._terms, dtype=np.int32)
+        # stable: each term's postings stay in ascending doc-id order
+        order = np.argsort(terms, kind="stable")
+        docs = np.frombuffer(self._docs, dtype=np.int32)[order]
+        tfs = np.frombuffer(self._tfs, dtype=np.int32)[order].astype(np.float32)
+        lengths = np.frombuffer(self._lengths, dtype=np.int32).astype(np.float32)
+
+        indptr = np.zeros(len(self.vocab) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(terms, minlength=len(self.vocab)), out=indptr[1:])
+
+        # BM25's term-frequency part is query independent, so it is stored per posting
+        avg_length = float(lengths.mean()) if len(lengths) and lengths.mean() > 0 else 1.0
+        norm = self.k1 * (1.0 - self.b + self.b * lengths[docs] / avg_length)
+        weights = tfs * (self.k1 + 1.0) / (tfs + norm)
+
+        n_docs = len(lengths)
+        df = np.diff(indptr).astype(np.float64)
+        idf = np.log1p((n_docs - df + 0.5) / (df + 0.5)).astype(np.float32)
+        return LexicalIndex(list(self.vocab), indptr, docs, weights.astype(np.float32), idf, n_docs)
+
+
+class LexicalIndex:
+    """BM25 inverted index over document texts, as CSR postings (term -> doc ids + weights).
+
+    A query only touches the postings of its own terms, so rare terms such as
+    a film title or a stop name score in well under a millisecond.
+    """
+
+    def __init__(self, terms: List[str], indptr: np.ndarray, doc_ids: np.ndarray, weights: np.ndarray,
+                 idf: np.ndarray, n_docs: int):
+        self.vocab = {term: i for i, term in enumerate(terms)}
+        self.indptr = indptr
+        self.doc_ids = doc_ids
+        self.weights = weights
+        self.idf = idf
+        self.n_docs = n_docs
+
+    def __len__(self) -> int:
+        return self.n_docs
+
+    def search(self, query: str, top_k: int = 10, ids: Optional[np.ndarray] = None):
+        """(doc ids, BM25 scores) of the best `top_k` matches, highest first; `ids` (sorted) restricts them"""
+        term_ids = [self.vocab[t] for t in dict.fromkeys(tokenize(query)) if t in self.vocab]
+        if not term_ids or top_k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        if len(term_ids) == 1:
+            t = term_ids[0]
+            docs = self.doc_ids[self.indptr[t]:self.indptr[t + 1]]
+            scores = self.weights[self.indptr[t]:self.indptr[t + 1]] * self.idf[t]
+        else:
+            parts = [(self.doc_ids[self.indptr[t]:self.indptr[t + 1]],
+                      self.weights[self.indptr[t]:self.indptr[t + 1]] * self.idf[t]) for t in term_ids]
+            docs, inverse = np.unique(np.concatenate([d for d, _ in parts]), return_inverse=True)
+            scores = np.bincount(inverse, weights=np.concatenate([s for _, s in parts])).astype(np.float32)
+
+        if ids is not None:
+            positions = np.minimum(np.searchsorted(ids, docs), max(len(ids) - 1, 0))
+            keep = (ids[positions] == docs) if len(ids) else np.zeros(len(docs), dtype=bool)
+            docs, scores = docs[keep], scores[keep]
+
+        if top_k < len(scores):
+            top = np.argpartition(-scores, top_k - 1)[:top_k]
+        else:
+            top = np.arange(len(scores))
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return docs[top].astype(np.int64), scores[top]
+
+    def save(self, output_dir: str):
+        out = Path(output_dir)
+        np.savez(out / INDEX_FILE, indptr=self.indptr, doc_ids=self.doc_ids, weights=self.weights,
+                 idf=self.idf, n_docs=np.int64(self.n_docs))
+        with (out / VOCAB_FILE).open("w", encoding="utf-8") as f:
+            json.dump(list(self.vocab), f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, input_dir: str) -> Optional["LexicalIndex"]:
+        """The index saved in `input_dir`, or None if it was built before lexical search existed"""
+        inp = Path(input_dir)
+        if not (inp / INDEX_FILE).exists() or not (inp / VOCAB_FILE).exists():
+            return None
+        with (inp / VOCAB_FILE).open("r", encoding="utf-8") as f:
+            terms = json.load(f)
+        with np.load(inp / INDEX_FILE) as data:
+            return cls(terms, data["indptr"], data["doc_ids"], data["weights"], data["idf"], int(data["n_docs"]))
@@ -0,0 +1,380 @@
+# metrics.py
+import asyncio
+import bisect
+import contextlib
+import contextvars
+import functools
+import os
+import sys
+import threading
+import time
+from collections import Counter as _Tally
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+from fastapi import HTTPException
+from fastapi.responses import PlainTextResponse
+
+# METRICS_SERVER_TIMING=1 adds a Server-Timing header (stage durations) to every response
+SERVER_TIMING = os.getenv("METRICS_SERVER_TIMING", "0") == "1"
+# requests slower than this are printed with their stage breakdown (0: off)
+SLOW_REQUEST_MS = float(os.getenv("METRICS_SLOW_REQUEST_MS", "0"))
+# METRICS_PROFILING=1 enables GET /debug/profile (sampling profiler)
+PROFILING = os.getenv("METRICS_PROFILING", "0") == "1"
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+_metrics = []
+_collectors = []  # () -> iterable of (name, type, help, [(labels, value), ...])
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for v in labels.values())
+    return "{" + ",".join(f'{k}="{v}"' for k, v in zip(labels, escaped)) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}  # label values tuple -> value (or histogram state)
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.type}"
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield f"{self.name}{_format_labels(dict(zip(self.labelnames, key)))} {_format_value(value)}"
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    """Cumulative-bucket histogram in the Prometheus text format (`_bucket`, `_sum`, `_count`)"""
+
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = (), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # per-bucket (non-cumulative) counts, the +Inf overflow last, then sum
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.type}"
+        with self._lock:
+            items = [(key, (list(counts), total)) for key, (counts, total) in self._values.items()]
+        for key, (counts, total) in items:
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                yield f"{self.name}_bucket{_format_labels({**labels, 'le': _format_value(bound)})} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(labels)} {_format_value(total)}"
+            yield f"{self.name}_count{_format_labels(labels)} {cumulative}"
+
+
+def register_collector(collector: Callable):
+    """`collector()` is called on every scrape and returns (name, type, help, [(labels, value), ...]) tuples"""
+    _collectors.append(collector)
+
+
+def register_cache(name: str, cache):
+    """Expose a cache's stats() (TTLCache, ResultStore, ...): hits, misses, evictions, entries, bytes"""
+    fields = (
+        ("hits", "tarun_cache_hits_total", "counter", "Cache lookups that found an entry"),
+        ("misses", "tarun_cache_misses_total", "counter", "Cache lookups that found nothing"),
+        ("evictions", "tarun_cache_evictions_total", "counter", "Entries dropped to stay within the size bound"),
+        ("size", "tarun_cache_entries", "gauge", "Entries currently held"),
+        ("files", "tarun_cache_entries", "gauge", "Entries currently held"),
+        ("bytes", "tarun_cache_bytes", "gauge", "Bytes currently held"),
+    )
+
+    def collect():
+        stats = cache.stats()
+        return [(metric, kind, help, [({"cache": name}, stats[field])])
+                for field, metric, kind, help in fields if field in stats]
+
+    register_collector(collect)
+
+
+def register_gauge(name: str, help: str, fn: Callable[[], float], **labels):
+    """A gauge whose value is read from `fn()` at scrape time"""
+    register_collector(lambda: [(name, "gauge", help, [(labels, fn())])])
+
+
+def _process_collector():
+    samples = []
+    try:
+        with open("/proc/self/statm", encoding="utf-8") as f:
+            rss = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        samples.append(("process_resident_memory_bytes", "gauge", "Resident set size", [({}, rss)]))
+    except (OSError, ValueError, IndexError):
+        pass
+    return samples
+
+
+def _gpu_collector():
+    """CUDA memory from whichever of torch/cupy is already loaded (a scrape never imports them)"""
+    samples = []
+    torch = sys.modules.get("torch")
+    if torch is not None and torch.cuda.is_available():
+        allocated, reserved, peak = [], [], []
+        for device in range(torch.cuda.device_count()):
+            labels = {"device": f"cuda:{device}"}
+            allocated.append((labels, torch.cuda.memory_allocated(device)))
+            reserved.append((labels, torch.cuda.memory_reserved(device)))
+            peak.append((labels, torch.cuda.max_memory_allocated(device)))
+        samples += [
+            ("tarun_gpu_memory_allocated_bytes", "gauge", "CUDA memory held by torch tensors", allocated),
+            ("tarun_gpu_memory_reserved_bytes", "gauge", "CUDA memory reserved by torch's caching allocator", reserved),
+            ("tarun_gpu_memory_peak_bytes", "gauge", "Peak CUDA memory held by torch tensors", peak),
+        ]
+    cupy = sys.modules.get("cupy")
+    if cupy is not None:
+        try:
+            pool = cupy.get_default_memory_pool()
+            samples.append(("tarun_gpu_cupy_pool_bytes", "gauge", "CUDA memory in cupy's default pool",
+                            [({"state": "used"}, pool.used_bytes()), ({"state": "total"}, pool.total_bytes())]))
+        except Exception:
+            pass
+    return samples
+
+
+register_collector(_process_collector)
+register_collector(_gpu_collector)
+
+
+def render() -> str:
+    """Every metric in the Prometheus text exposition format (version 0.0.4)"""
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    # a family's samples must be contiguous, and several collectors can feed one family
+    families = {}
+    for collector in _collectors:
+        for name, kind, help, samples in collector():
+            families.setdefault(name, (kind, help, []))[2].extend(samples)
+    for name, (kind, help, samples) in families.items():
+        lines += [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+        lines += [f"{name}{_format_labels(labels)} {_format_value(value)}" for labels, value in samples]
+    return "\n".join(lines) + "\n"
+
+
+REQUEST_SECONDS = Histogram("tarun_http_request_seconds", "HTTP request latency", ("method", "path", "status"))
+STAGE_SECONDS = Histogram("tarun_stage_seconds", "Time spent in one hot-path stage", ("stage",))
+BATCH_SIZE = Histogram("tarun_batch_size", "Items per micro-batch", ("batcher",), buckets=BATCH_SIZE_BUCKETS)
+BATCH_WAIT_SECONDS = Histogram("tarun_batch_wait_seconds", "Time an item waited for its micro-batch to start",
+                               ("batcher",))
+QUEUE_WAIT_SECONDS = Histogram("tarun_executor_queue_wait_seconds", "Time a job waited for an executor thread",
+                               ("executor",))
+RUN_SECONDS = Histogram("tarun_executor_run_seconds", "Time a job ran on an executor thread", ("executor",))
+INFLIGHT = Gauge("tarun_executor_inflight", "Jobs running or waiting in an executor", ("executor",))
+REJECTED = Counter("tarun_executor_rejected_total", "Jobs rejected with 503 because the queue was full",
+                   ("executor",))
+
+
+# --- per-request stage timings -------------------------------------------
+
+# stage -> seconds for the request being handled (set by MetricsMiddleware)
+_timings = contextvars.ContextVar("request_timings", default=None)
+
+
+def record(stage_name: str, seconds: float):
+    """Add `seconds` to the current request's `stage_name` (no-op outside a request)"""
+    timings = _timings.get()
+    if timings is not None:
+        timings[stage_name] = timings.get(stage_name, 0.0) + seconds
+
+
+@contextlib.contextmanager
+def stage(name: str):
+    """Time the block into tarun_stage_seconds{stage=name} and the current request's Server-Timing"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=name)
+        record(name, elapsed)
+
+
+def timed(name: str, fn: Callable) -> Callable:
+    """`fn` wrapped in stage(name), e.g. to time the work itself inside an executor"""
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with stage(name):
+            return fn(*args, **kwargs)
+    return wrapper
+
+
+def current_timings() -> Optional[dict]:
+    return _timings.get()
+
+
+@contextlib.contextmanager
+def collect_timings():
+    """Collect stages into a fresh dict (e.g. one per micro-batch, later merged into each caller's)"""
+    timings = {}
+    token = _timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _timings.reset(token)
+
+
+def merge_timings(into: Optional[dict], timings: dict):
+    if into is not None:
+        for name, seconds in timings.items():
+            into[name] = into.get(name, 0.0) + seconds
+
+
+def format_server_timing(timings: dict) -> str:
+    return ", ".join(f"{name};dur={1000 * seconds:.1f}" for name, seconds in timings.items())
+
+
+class MetricsMiddleware:
+    """ASGI middleware: request latency histogram, per-request stage timings, optional Server-Timing"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        start = time.perf_counter()
+        timings = {}
+        token = _timings.set(timings)
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if SERVER_TIMING:
+                    value = format_server_timing({**timings, "app": time.perf_counter() - start})
+                    headers = list(message.get("headers", []))
+                    for i, (name, existing) in enumerate(headers):
+                        # e.g. diffusion's own phase timings: keep them, add ours
+                        if name.lower() == b"server-timing":
+                            headers[i] = (name, existing + b", " + value.encode("latin-1"))
+                            break
+                    else:
+                        headers.append((b"server-timing", value.encode("latin-1")))
+                    message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _timings.reset(token)
+            elapsed = time.perf_counter() - start
+            # the route template (/jobs/{job_id}), so label values stay bounded
+            path = getattr(scope.get("route"), "path", "unmatched")
+            REQUEST_SECONDS.observe(elapsed, method=scope["method"], path=path, status=f"{status // 100}xx")
+            if SLOW_REQUEST_MS and elapsed * 1000 >= SLOW_REQUEST_MS:
+                print(f"Slow request {scope['method']} {path} -> {status} in {1000 * elapsed:.0f} ms: "
+                      f"{format_server_timing(timings) or 'no stages recorded'}")
+
+
+# --- sampling profiler -----------------------------------------------------
+
+class StackSampler:
+    """Statistical profiler: samples every thread's Python stack at a fixed interval.
+
+    The result is in folded-stack format (`frame;frame;frame count` per line),
+    which flamegraph.pl and speedscope read directly. Sampling costs a few
+    microseconds per thread per sample, so it is safe to run against live traffic.
+    """
+
+    def __init__(self, interval_s: float = 0.005):
+        self.interval_s = interval_s
+        self._lock = threading.Lock()
+
+    def sample(self, seconds: float) -> str:
+        if not self._lock.acquire(blocking=False):
+            raise HTTPException(status_code=409, detail="A profile is already being taken")
+        try:
+            stacks = _Tally()
+            me = threading.get_ident()
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            deadline = time.monotonic() + seconds
+            while time.monotonic() < deadline:
+                for ident, frame in sys._current_frames().items():
+                    if ident == me:
+                        continue
+                    frames = []
+                    while frame is not None:
+                        code = frame.f_code
+                        frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                        frame = frame.f_back
+                    stacks[";".join([names.get(ident, str(ident))] + frames[::-1])] += 1
+                time.sleep(self.interval_s)
+        finally:
+            self._lock.release()
+        return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+sampler = StackSampler(float(os.getenv("METRICS_PROFILE_INTERVAL_MS", "5")) / 1000)
+
+
+def instrument(app):
+    """Add MetricsMiddleware, GET /metrics and (with METRICS_PROFILING=1) GET /debug/profile to `app`"""
+    app.add_middleware(MetricsMiddleware)
+
+    @app.get("/metrics", include_in_schema=False)
+    async def metrics():
+        return PlainTextResponse(render(), media_type="text/plain; version=0.0.4")
+
+    @app.get("/debug/profile", include_in_schema=False)
+    async def profile(seconds: float = 10.0):
+        """Sample every thread for `seconds`; folded stacks for a flame graph"""
+        if not PROFILING:
+            raise HTTPException(status_code=404, detail="Profiling is disabled; set METRICS_PROFILING=1")
+        if not 0 < seconds <= 120:
+            raise HTTPException(status_code=400, detail="seconds must be in (0, 120]")
+        folded = await asyncio.get_running_loop().run_in_executor(None, sampler.sample, seconds)
+        return PlainTextResponse(folded)
@@ -0,0 +1,174 @@
+# quantization.py
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+COMPRESSIONS = ("none", "fp16", "int8", "pq")
+
+
+class Fp16Codec:
+    """Half-precision copy of the vectors (2 bytes per dimension)"""
+
+    kind = "fp16"
+
+    def fit(self, vectors: np.ndarray):
+        return self
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        return np.asarray(vectors, dtype=np.float32).astype(np.float16)
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        return np.asarray(codes, dtype=np.float32)
+
+    def state(self) -> dict:
+        return {}
+
+    def load_state(self, state):
+        return self
+
+
+class Int8Codec:
+    """Symmetric int8 with one scale for every dimension (1 byte per dimension).
+
+    A single scale keeps L2 distances proportional between the codes, so
+    backends that search raw int8 data (CAGRA) rank the same way as decode().
+    """
+
+    kind = "int8"
+
+    def __init__(self):
+        self.scale = 1.0
+
+    def fit(self, vectors: np.ndarray):
+        # the 99.99th percentile, not the max, so one outlier doesn't flatten everything else
+        sample = _sample_rows(vectors, 20000)
+        self.scale = float(max(np.quantile(np.abs(sample), 0.9999), 1e-12)) / 127.0
+        return self
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        scaled = np.asarray(vectors, dtype=np.float32) / self.scale
+        return np.clip(np.rint(scaled), -127, 127).astype(np.int8)
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        return np.asarray(codes, dtype=np.float32) * np.float32(self.scale)
+
+    def state(self) -> dict:
+        return {"scale": np.float64(self.scale)}
+
+    def load_state(self, state):
+        self.scale = float(state["scale"])
+        return self
+
+
+class PQCodec:
+    """Product quantization: `pq_dim` subvectors, each replaced by the id of its nearest of 256 centroids.
+
+    2048-d float32 vectors at pq_dim=64 take 64 bytes instead of 8 KB.
+    Centroids are trained with k-means on a sample of the vectors.
+    """
+
+    kind = "pq"
+
+    def __init__(self, pq_dim: int = 64, train_rows: int = 20000, iterations: int = 15, seed: int = 0):
+        self.pq_dim = pq_dim
+        self.train_rows = train_rows
+        self.iterations = iterations
+        self.seed = seed
+        self.centroids = None  # (pq_dim, 256, sub_dim) float32
+
+    def fit(self, vectors: np.ndarray):
+        dim = vectors.shape[1]
+        if dim % self.pq_dim:
+            raise ValueError(f"pq_dim={self.pq_dim} must divide the embedding dimension {dim}")
+        sub_dim = dim // self.pq_dim
+        sample = _sample_rows(vectors, self.train_rows, self.seed).reshape(-1, self.pq_dim, sub_dim)
+        rng = np.random.default_rng(self.seed)
+        n_centroids = min(256, len(sample))
+
+        self.centroids = np.empty((self.pq_dim, n_centroids, sub_dim), dtype=np.float32)
+        for m in range(self.pq_dim):
+            points = sample[:, m]
+            centroids = points[rng.choice(len(points), n_centroids, replace=False)].copy()
+            for _ in range(self.iterations):
+                assign = _nearest(points, centroids)
+                counts = np.bincount(assign, minlength=n_centroids)
+                sums = np.stack(
+                    [np.bincount(assign, weights=points[:, d], minlength=n_centroids) for d in range(sub_dim)], axis=1
+                )
+                filled = counts > 0
+                # empty clusters keep their old centroid
+                centroids[filled] = sums[filled] / counts[filled, None]
+            self.centroids[m] = centroids
+        return self
+
+    def encode(self, vectors: np.ndarray, block_rows: int = 16384) -> np.ndarray:
+        sub_dim = self.centroids.shape[2]
+        codes = np.empty((len(vectors), self.pq_dim), dtype=np.uint8)
+        for start in range(0, len(vectors), block_rows):
+            block = np.asarray(vectors[start:start + block_rows], dtype=np.float32).reshape(-1, self.pq_dim, sub_dim)
+            for m in range(self.pq_dim):
+                codes[start:start + len(block), m] = _nearest(block[:, m], self.centroids[m])
+        return codes
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        codes = np.asarray(codes)
+        parts = self.centroids[np.arange(self.pq_dim), codes]  # (n, pq_dim, sub_dim)
+        return parts.reshape(len(codes), -1)
+
+    def state(self) -> dict:
+        return {"pq_dim": np.int64(self.pq_dim), "centroids": self.centroids}
+
+    def load_state(self, state):
+        self.pq_dim = int(state["pq_dim"])
+        self.centroids = np.asarray(state["centroids"], dtype=np.float32)
+        return self
+
+
+CODECS = {"fp16": Fp16Codec, "int8": Int8Codec, "pq": PQCodec}
+
+
+def create_codec(kind: str, pq_dim: int = 64):
+    """Codec for `kind`, or None for "none" (search the float32 vectors directly)"""
+    if kind not in COMPRESSIONS:
+        raise ValueError(f"Unknown vector compression {kind!r}; choose from {', '.join(COMPRESSIONS)}")
+    if kind == "none":
+        return None
+    return PQCodec(pq_dim=pq_dim) if kind == "pq" else CODECS[kind]()
+
+
+def save_codes(out_dir: str, codec, codes: np.ndarray):
+    """codes_<kind>.npy (memory-mappable) plus the codec parameters in codec_<kind>.npz"""
+    out = Path(out_dir)
+    tmp_path = out / f"codes_{codec.kind}.tmp.npy"
+    np.save(tmp_path, codes)
+    tmp_path.replace(out / f"codes_{codec.kind}.npy")
+    np.savez(out / f"codec_{codec.kind}.npz", **codec.state())
+
+
+def load_codes(in_dir: str, codec, rows: Optional[int] = None) -> Optional[np.ndarray]:
+    """Memory-mapped codes for `codec` (its parameters are restored), or None if not built yet
+    or, with `rows`, not one code per embedding row"""
+    inp = Path(in_dir)
+    codes_path, state_path = inp / f"codes_{codec.kind}.npy", inp / f"codec_{codec.kind}.npz"
+    if not (codes_path.exists() and state_path.exists()):
+        return None
+    codes = np.load(codes_path, mmap_mode="r")
+    if rows is not None and len(codes) != rows:
+        print(f"{codes_path} has {len(codes)} rows, expected {rows}")
+        return None
+    with np.load(state_path) as state:
+        codec.load_state(state)
+    return codes
+
+
+def _sample_rows(vectors: np.ndarray, n: int, seed: int = 0) -> np.ndarray:
+    if len(vectors) <= n:
+        return np.asarray(vectors, dtype=np.float32)
+    rows = np.sort(np.random.default_rng(seed).choice(len(vectors), n, replace=False))
+    return np.asarray(vectors[rows], dtype=np.float32)
+
+
+def _nearest(points: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    distances = (centroids * centroids).sum(axis=1)[None, :] - 2.0 * (points @ centroids.T)
+    return distances.argmin(axis=1)
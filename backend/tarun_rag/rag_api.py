@@ -1,25 +1,126 @@
+import time
+
+# time-to-ready is measured from here, so it includes importing fastapi, numpy etc.
+_STARTED = time.perf_counter()
+
 from fastapi import FastAPI, HTTPException, UploadFile, File
-from fastapi.responses import Response
-from pydantic import BaseModel
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel, Field
 from typing import List, Optional
-import io
+from contextlib import asynccontextmanager
+import asyncio
+import functools
+import json
 import os
-import uvicorn
+import traceback
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+import numpy as np
 
+from batching import MicroBatcher
+from diffusion_engine import default_model_id, engine, format_timings
 from embedding_service import NemotronEmbeddingService
-from vector_store import CuVSVectorStore
+from executors import BoundedExecutor
+from image_io import check_output_format, iter_chunks, media_type
+from lexical_index import LexicalIndex
+import metrics
+from ttl_cache import TTLCache
+from vector_store import create_vector_store
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # The server accepts connections while the model and index load; /ready reports when they're in
+    loader = asyncio.create_task(load_models())
+    yield
+    loader.cancel()
 
-app = FastAPI(title="SF Cultural Impact RAG API")
+app = FastAPI(title="SF Cultural Impact RAG API", lifespan=lifespan)
+# GET /metrics (Prometheus text format), per-stage timings, optional Server-Timing / profiling
+metrics.instrument(app)
 
-# Global instances (loaded on startup)
+# Global instances (loaded in the background at startup; each is set once fully loaded)
 embedder: NemotronEmbeddingService = None
-_diffusion_pipe = None
-_diffusion_model_id: Optional[str] = None
+vector_store = None
+lexical_index: Optional[LexicalIndex] = None
+# seconds per startup step, for /ready; startup_error is set if loading failed
+startup_timings = {}
+startup_error: Optional[str] = None
+
+# lexical: BM25 only (no embedding); vector: dense only; hybrid: both, fused by reciprocal rank
+SEARCH_MODES = ("lexical", "vector", "hybrid")
+DEFAULT_SEARCH_MODE = os.getenv("RAG_SEARCH_MODE", "vector")
+RRF_K = int(os.getenv("RAG_RRF_K", "60"))
+# how deep each list goes before fusion
+HYBRID_CANDIDATES = int(os.getenv("RAG_HYBRID_CANDIDATES", "50"))
+# largest top_k a request may ask for (each result is materialized from documents.jsonl)
+MAX_TOP_K = int(os.getenv("RAG_MAX_TOP_K", "100"))
+# most queries one /search/batch call may carry (default: one micro-batch, RAG_BATCH_MAX_SIZE)
+MAX_BATCH_QUERIES = int(os.getenv("RAG_BATCH_MAX_QUERIES", os.getenv("RAG_BATCH_MAX_SIZE", "32")))
+
+# When set (start.sh points it at diffusion_api), img2img is forwarded there so the
+# container holds one copy of the diffusion weights; otherwise it runs in-process
+DIFFUSION_API_URL = os.getenv("DIFFUSION_API_URL", "").rstrip("/")
+# a forwarded call that gets no answer within this many seconds fails with 504
+DIFFUSION_FORWARD_TIMEOUT_S = float(os.getenv("DIFFUSION_FORWARD_TIMEOUT_S", "300"))
+
+# One pool per workload so a multi-second diffusion run never queues ahead of a search
+embed_executor = BoundedExecutor(
+    "embed",
+    max_workers=int(os.getenv("RAG_EMBED_WORKERS", "1")),
+    max_queue=int(os.getenv("RAG_EMBED_MAX_QUEUE", "64")),
+)
+search_executor = BoundedExecutor(
+    "ann-search",
+    max_workers=int(os.getenv("RAG_SEARCH_WORKERS", "1")),
+    max_queue=int(os.getenv("RAG_SEARCH_MAX_QUEUE", "64")),
+)
+diffusion_executor = BoundedExecutor(
+    "diffusion",
+    max_workers=int(os.getenv("DIFFUSION_WORKERS", "1")),
+    max_queue=int(os.getenv("DIFFUSION_MAX_QUEUE", "4")),
+)
+# Forwarded img2img calls only wait on diffusion_api, so they get their own wider pool:
+# concurrent requests then queue there together instead of one at a time here
+forward_executor = BoundedExecutor(
+    "diffusion-forward",
+    max_workers=int(os.getenv("DIFFUSION_FORWARD_WORKERS", "8")),
+    max_queue=int(os.getenv("DIFFUSION_FORWARD_MAX_QUEUE", "16")),
+)
+
+# Query embeddings are keyed on normalized text; result lists on (text, top_k, filters).
+# Results are dropped whenever the vector store swaps its index.
+embedding_cache = TTLCache(
+    max_size=int(os.getenv("RAG_EMBED_CACHE_SIZE", "4096")),
+    ttl_s=float(os.getenv("RAG_CACHE_TTL_S", "3600")),
+)
+result_cache = TTLCache(
+    max_size=int(os.getenv("RAG_RESULT_CACHE_SIZE", "2048")),
+    ttl_s=float(os.getenv("RAG_CACHE_TTL_S", "3600")),
+)
+metrics.register_cache("embeddings", embedding_cache)
+metrics.register_cache("results", result_cache)
+
+class GeoPoint(BaseModel):
+    lat: float
+    lon: float
+
+class BoundingBox(BaseModel):
+    min_lat: float
+    min_lon: float
+    max_lat: float
+    max_lon: float
 
 class SearchRequest(BaseModel):
     query: str
-    top_k: int = 10
+    top_k: int = Field(10, ge=1, le=MAX_TOP_K)
     category_filter: Optional[str] = None  # e.g., "landmarks", "film_locations"
+    near: Optional[GeoPoint] = None  # with radius_m: only documents within radius_m meters
+    radius_m: Optional[float] = None
+    bbox: Optional[BoundingBox] = None
+    fast: Optional[bool] = None  # reduced-dimension first pass + exact re-score (default: VECTOR_FAST_SEARCH)
+    mode: Optional[str] = None  # lexical | vector | hybrid (default: RAG_SEARCH_MODE)
 
 class SearchResult(BaseModel):
     id: str
@@ -33,38 +134,206 @@ class SearchResponse(BaseModel):
     query: str
     results: List[SearchResult]
 
-@app.on_event("startup")
-async def load_models():
-    """Load embedding model and vector store on startup"""
-    global embedder, vector_store
-    
+async def _timed_load(step: str, fn, *args):
+    """Run one blocking load step on a worker thread, recording how long it took"""
+    t0 = time.perf_counter()
+    result = await asyncio.to_thread(fn, *args)
+    startup_timings[step] = round(time.perf_counter() - t0, 3)
+    return result
+
+def _load_vector_store(path: str):
+    store = create_vector_store(embedding_dim=2048)
+    print(f"Loading vector store ({store.backend} backend)...")
+    store.add_swap_listener(result_cache.clear)
+    store.load(path)
+    return store
+
+async def _load_embedder():
+    global embedder
     print("Loading embedding model...")
-    embedder = NemotronEmbeddingService()
-    
-    print("Loading vector store...")
-    vector_store = CuVSVectorStore(embedding_dim=2048)
-    vector_store.load("vector_db")
-    
-    print("RAG API ready!")
+    embedder = await _timed_load("embedding_model", NemotronEmbeddingService)
 
-@app.post("/search", response_model=SearchResponse)
-async def search(request: SearchRequest):
-    """Search for relevant locations based on query"""
-    
-    # Generate query embedding
-    query_embedding = embedder.embed_query(request.query)
-    
-    # Search vector store
-    results = vector_store.search(query_embedding, top_k=request.top_k * 2)
-    
-    # Apply category filter if specified
-    if request.category_filter:
-        results = [
-            (doc, score) for doc, score in results 
-            if doc['category'] == request.category_filter
-        ]
-    
-    # Format response
+async def _load_indexes():
+    global vector_store, lexical_index
+    store, lexical = await asyncio.gather(
+        _timed_load("vector_store", _load_vector_store, "vector_db"),
+        _timed_load("lexical_index", LexicalIndex.load, "vector_db"),
+    )
+    if lexical is None:
+        print("No lexical index in vector_db (rebuild with build_index.py); lexical/hybrid search disabled")
+    # set together: once vector_store is in, a missing lexical index really is missing
+    lexical_index = lexical
+    vector_store = store
+
+async def load_models():
+    """Load the embedding model, vector store and lexical index side by side.
+
+    The model load is mostly GPU transfer and the index load mostly file I/O, so
+    overlapping them makes startup roughly as long as the slower of the two.
+    """
+    global startup_error
+    if os.getenv("DIFFUSION_PRELOAD", "0") == "1" and not DIFFUSION_API_URL:
+        diffusion_executor.run_in_background(engine.warm_up, default_model_id())
+
+    try:
+        await asyncio.gather(_load_embedder(), _load_indexes())
+    except Exception as e:
+        startup_error = f"{type(e).__name__}: {e}"
+        traceback.print_exc()
+        print(f"RAG API failed to load: {startup_error}")
+        return
+    startup_timings["time_to_ready"] = round(time.perf_counter() - _STARTED, 3)
+    print(
+        f"RAG API ready in {startup_timings['time_to_ready']:.2f}s "
+        f"(embedding model {startup_timings['embedding_model']:.2f}s, "
+        f"vector store {startup_timings['vector_store']:.2f}s, "
+        f"lexical index {startup_timings['lexical_index']:.2f}s, loaded concurrently)"
+    )
+
+def _ready() -> bool:
+    return embedder is not None and vector_store is not None
+
+def _not_ready(what: str):
+    if startup_error is not None:
+        raise HTTPException(status_code=503, detail=f"RAG API failed to load: {startup_error}")
+    raise HTTPException(status_code=503, detail=f"{what} still loading", headers={"Retry-After": "5"})
+
+def _require_index():
+    if vector_store is None:
+        _not_ready("Vector store")
+
+def _require_embedder():
+    if embedder is None:
+        _not_ready("Embedding model")
+
+class BatchSearchRequest(BaseModel):
+    queries: List[SearchRequest] = Field(..., max_length=MAX_BATCH_QUERIES)
+
+class BatchSearchResponse(BaseModel):
+    responses: List[SearchResponse]
+
+def _normalize_query(query: str) -> str:
+    # whitespace only: the embedder is case-sensitive, and the normalized text is what gets
+    # embedded, so a cached vector is exactly what this query would embed to
+    return " ".join(query.split())
+
+def _validate(request: SearchRequest):
+    _require_index()
+    if (request.near is None) != (request.radius_m is None):
+        raise HTTPException(status_code=400, detail="near and radius_m must be given together")
+    if request.radius_m is not None and request.radius_m <= 0:
+        raise HTTPException(status_code=400, detail="radius_m must be positive")
+    if request.bbox is not None and (
+        request.bbox.min_lat > request.bbox.max_lat or request.bbox.min_lon > request.bbox.max_lon
+    ):
+        raise HTTPException(status_code=400, detail="bbox min_lat/min_lon must not exceed max_lat/max_lon")
+    mode = _mode(request)
+    if mode not in SEARCH_MODES:
+        raise HTTPException(status_code=400, detail=f"Unknown mode {mode!r}; expected one of {', '.join(SEARCH_MODES)}")
+    if mode != "vector" and lexical_index is None:
+        raise HTTPException(status_code=400, detail=f"{mode} search needs the lexical index; rebuild with build_index.py")
+    if request.fast and not vector_store.has_fast_path:
+        raise HTTPException(status_code=400, detail="fast search needs a reduced-dimension index (VECTOR_REDUCED_DIM)")
+    if mode != "lexical":
+        _require_embedder()
+
+def _mode(request: SearchRequest) -> str:
+    return (request.mode or DEFAULT_SEARCH_MODE).lower()
+
+def _filter_key(request: SearchRequest):
+    """Everything besides the query text and top_k that changes the results: filters and search mode"""
+    near = (request.near.lat, request.near.lon) if request.near is not None else None
+    bbox = (
+        (request.bbox.min_lat, request.bbox.min_lon, request.bbox.max_lat, request.bbox.max_lon)
+        if request.bbox is not None else None
+    )
+    return (request.category_filter, near, request.radius_m, bbox, request.fast, _mode(request))
+
+def _result_key(request: SearchRequest):
+    return (_normalize_query(request.query), request.top_k, _filter_key(request))
+
+async def _search_many(requests: List[SearchRequest], check_cache: bool = True) -> List[SearchResponse]:
+    """Embed all queries as one matrix and search them together, grouped by category/area filter"""
+    responses = [None] * len(requests)
+    generation = result_cache.generation
+
+    pending = []
+    for i, request in enumerate(requests):
+        cached = result_cache.get(_result_key(request)) if check_cache else None
+        if cached is not None:
+            responses[i] = SearchResponse(query=request.query, results=cached)
+        elif _mode(request) == "lexical":
+            # no embedding needed; answered inline
+            responses[i] = _lexical_response(request, generation)
+        else:
+            pending.append(i)
+    if not pending:
+        return responses
+
+    # Reuse cached query vectors; embed each distinct uncached query once
+    vectors = {}
+    to_embed = []
+    for i in pending:
+        normalized = _normalize_query(requests[i].query)
+        if normalized in vectors or normalized in to_embed:
+            continue
+        vector = embedding_cache.get(normalized)
+        if vector is None:
+            to_embed.append(normalized)
+        else:
+            vectors[normalized] = vector
+    if to_embed:
+        fresh = await embed_executor.run(metrics.timed("embed_query", embedder.embed_queries), to_embed)
+        for normalized, vector in zip(to_embed, fresh):
+            embedding_cache.put(normalized, vector)
+            vectors[normalized] = vector
+
+    by_filter = {}
+    for i in pending:
+        by_filter.setdefault(_filter_key(requests[i]), []).append(i)
+
+    for (category, near, radius_m, bbox, fast, mode), rows in by_filter.items():
+        top_k = max(requests[i].top_k for i in rows)
+        if mode == "hybrid":
+            top_k = max(top_k, HYBRID_CANDIDATES)
+        query_embeddings = np.stack([vectors[_normalize_query(requests[i].query)] for i in rows])
+        batch_results = await search_executor.run(
+            vector_store.search_batch, query_embeddings, top_k=top_k,
+            category=category, near=near, radius_m=radius_m, bbox=bbox, fast=fast,
+        )
+        for i, results in zip(rows, batch_results):
+            if mode == "hybrid":
+                lexical_results = _lexical_results(requests[i], max(requests[i].top_k, HYBRID_CANDIDATES))
+                results = _fuse([results, lexical_results], requests[i].top_k)
+            responses[i] = _format_response(requests[i], results)
+            result_cache.put(_result_key(requests[i]), responses[i].results, generation=generation)
+    return responses
+
+def _lexical_results(request: SearchRequest, top_k: int):
+    """BM25 matches as (doc, score) pairs, highest score first"""
+    category, near, radius_m, bbox = _filter_key(request)[:4]
+    ids = vector_store.filter_ids(category, near, radius_m, bbox)
+    with metrics.stage("lexical_search"):
+        doc_ids, scores = lexical_index.search(request.query, top_k, ids=ids)
+    return [(vector_store.documents[int(i)], float(score)) for i, score in zip(doc_ids, scores)]
+
+def _lexical_response(request: SearchRequest, generation: int) -> SearchResponse:
+    response = _format_response(request, _lexical_results(request, request.top_k))
+    result_cache.put(_result_key(request), response.results, generation=generation)
+    return response
+
+def _fuse(result_lists, top_k: int):
+    """Reciprocal-rank fusion: a document scores sum(1 / (RRF_K + rank)) over the lists it appears in"""
+    scores = {}
+    docs = {}
+    for results in result_lists:
+        for rank, (doc, _) in enumerate(results, start=1):
+            docs.setdefault(doc['id'], doc)
+            scores[doc['id']] = scores.get(doc['id'], 0.0) + 1.0 / (RRF_K + rank)
+    best = sorted(scores, key=scores.get, reverse=True)[:top_k]
+    return [(docs[doc_id], scores[doc_id]) for doc_id in best]
+
+def _format_response(request: SearchRequest, results) -> SearchResponse:
     search_results = []
     for doc, score in results[:request.top_k]:
         search_results.append(SearchResult(
@@ -75,56 +344,91 @@ async def search(request: SearchRequest):
             metadata=doc['metadata'],
             location=doc['location']
         ))
-    
     return SearchResponse(query=request.query, results=search_results)
 
-@app.get("/categories")
-async def list_categories():
-    """List available categories"""
-    categories = set(doc['category'] for doc in vector_store.documents)
-    return {"categories": list(categories)}
+# Concurrent /search calls are held for up to RAG_BATCH_WAIT_MS and run as one batch
+# (/search already checked the result cache before queueing)
+search_batcher = MicroBatcher(
+    functools.partial(_search_many, check_cache=False),
+    max_batch_size=int(os.getenv("RAG_BATCH_MAX_SIZE", "32")),
+    max_wait_ms=float(os.getenv("RAG_BATCH_WAIT_MS", "5")),
+    name="search",
+)
 
-@app.get("/health")
-async def health_check():
-    return {"status": "healthy", "documents_indexed": len(vector_store.documents)}
+@app.post("/search", response_model=SearchResponse)
+async def search(request: SearchRequest):
+    """Search for relevant locations based on query"""
+    _validate(request)
+    cached = result_cache.get(_result_key(request))
+    if cached is not None:
+        # repeat queries skip the batch window entirely
+        return SearchResponse(query=request.query, results=cached)
+    if _mode(request) == "lexical":
+        # BM25 alone: no embedder, no batch window
+        return _lexical_response(request, result_cache.generation)
+    return await search_batcher.submit(request)
 
+@app.post("/search/batch", response_model=BatchSearchResponse)
+async def search_batch(request: BatchSearchRequest):
+    """Search many queries in one call (chunked to RAG_BATCH_MAX_SIZE per forward pass)"""
+    for query in request.queries:
+        _validate(query)
+    chunk = search_batcher.max_batch_size
+    responses = []
+    for i in range(0, len(request.queries), chunk):
+        responses.extend(await _search_many(request.queries[i:i + chunk]))
+    return BatchSearchResponse(responses=responses)
 
-def _get_diffusion_pipe(model_id: str):
-    """
-    Lazy-load diffusion pipeline to avoid paying startup cost unless used.
-    Uses env `DIFFUSION_MODEL_ID` if present, otherwise caller passes it.
-    """
-    global _diffusion_pipe, _diffusion_model_id
-
-    if _diffusion_pipe is not None and _diffusion_model_id == model_id:
-        return _diffusion_pipe
+@app.get("/categories")
+async def list_categories():
+    """List available categories"""
+    _require_index()
+    return {"categories": list(vector_store.categories), "counts": vector_store.category_counts}
 
-    try:
-        import torch
-        from diffusers import Flux2KleinPipeline
-    except Exception as e:
-        raise HTTPException(
-            status_code=500,
-            detail=(
-                "Diffusion dependencies not available. Install `diffusers` and `torch` "
-                f"inside the container. Import error: {type(e).__name__}: {e}"
-            ),
-        )
+@app.get("/cache/stats")
+async def cache_stats():
+    return {"embeddings": embedding_cache.stats(), "results": result_cache.stats()}
 
-    device = "cuda" if torch.cuda.is_available() else "cpu"
-    dtype = torch.float16 if device == "cuda" else torch.float32
+@app.get("/live")
+async def live():
+    """Liveness: the process is up and serving, whether or not loading has finished"""
+    return {"status": "alive"}
 
-    pipe = Flux2KleinPipeline.from_pretrained(model_id, torch_dtype=dtype)
-    if device == "cuda":
-        # matches your `diffusion_sample/run.py` behavior (offload + slicing)
-        pipe.enable_sequential_cpu_offload()
-        pipe.enable_attention_slicing()
-    else:
-        pipe.to(device)
+@app.get("/ready")
+async def ready():
+    """Readiness: 200 once the embedding model and vector store are loaded, 503 until then"""
+    if _ready():
+        return {"status": "ready", "startup_s": startup_timings}
+    status = "failed" if startup_error is not None else "loading"
+    return JSONResponse(
+        status_code=503,
+        content={"status": status, "error": startup_error, "startup_s": startup_timings},
+        headers={} if startup_error is not None else {"Retry-After": "5"},
+    )
 
-    _diffusion_pipe = pipe
-    _diffusion_model_id = model_id
-    return _diffusion_pipe
+@app.get("/health")
+async def health_check():
+    if not _ready():
+        _not_ready("Embedding model and vector store")
+    return {
+        "status": "healthy",
+        "documents_indexed": len(vector_store.documents),
+        "vector_backend": vector_store.backend,
+        "vector_compression": vector_store.compression,
+        "lexical_index": {"terms": len(lexical_index.vocab)} if lexical_index is not None else None,
+        "default_search_mode": DEFAULT_SEARCH_MODE,
+        "fast_search": {
+            "reduced": vector_store.reducer.name if vector_store.has_fast_path else None,
+            "default": vector_store.fast_search and vector_store.has_fast_path,
+        },
+        "embedder": {"device": embedder.device, "precision": embedder.precision, "attention": embedder.attention},
+        "queues": {
+            executor.name: executor.stats()
+            for executor in (embed_executor, search_executor, diffusion_executor, forward_executor)
+        },
+        "cache": {"embeddings": embedding_cache.stats(), "results": result_cache.stats()},
+        "diffusion": {"forward_to": DIFFUSION_API_URL} if DIFFUSION_API_URL else engine.stats(),
+    }
 
 
 @app.post("/diffusion/flux2klein/img2img")
@@ -137,48 +441,90 @@ async def diffusion_flux2klein_img2img(
     num_inference_steps: int = 4,
     seed: int = 0,
     model_id: Optional[str] = None,
+    output_format: Optional[str] = None,
+    quality: int = 85,
 ):
     """
     Image-to-image endpoint based on `diffusion_sample/run.py`.
-    Returns a PNG image.
+    Returns a PNG image, or WebP/JPEG with `output_format`.
     """
-    effective_model_id = model_id or os.getenv("DIFFUSION_MODEL_ID") or "black-forest-labs/FLUX.2-klein-4B"
-
-    try:
-        import torch
-        from PIL import Image
-    except Exception as e:
-        raise HTTPException(
-            status_code=500,
-            detail=f"Missing runtime deps for diffusion endpoint: {type(e).__name__}: {e}",
-        )
+    if not 1 <= quality <= 100:
+        raise HTTPException(status_code=400, detail="quality must be between 1 and 100")
+    effective_model_id = model_id or default_model_id()
+    params = dict(
+        prompt=prompt,
+        height=height,
+        width=width,
+        guidance_scale=guidance_scale,
+        num_inference_steps=num_inference_steps,
+        seed=seed,
+        model_id=effective_model_id,
+        output_format=check_output_format(output_format or os.getenv("DIFFUSION_OUTPUT_FORMAT", "png")),
+        quality=quality,
+    )
 
     raw = await init_image.read()
-    try:
-        pil = Image.open(io.BytesIO(raw)).convert("RGB")
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Invalid image upload: {type(e).__name__}: {e}")
+    if DIFFUSION_API_URL:
+        data, content_type, server_timing = await forward_executor.run(
+            _forward_img2img,
+            raw,
+            init_image.filename or "image.png",
+            init_image.content_type or "application/octet-stream",
+            params,
+        )
+    else:
+        data, timings = await diffusion_executor.run(engine.img2img, raw, **params)
+        content_type = media_type(params["output_format"])
+        server_timing = format_timings(timings)
+    return StreamingResponse(
+        iter_chunks(data),
+        media_type=content_type,
+        headers={"Content-Length": str(len(data)), "Server-Timing": server_timing},
+    )
 
-    pipe = _get_diffusion_pipe(effective_model_id)
-    device = "cuda" if torch.cuda.is_available() else "cpu"
-    gen = torch.Generator(device=device).manual_seed(seed)
 
+def _forward_img2img(raw: bytes, filename: str, content_type: str, params: dict):
+    """POST the upload to diffusion_api's /flux2klein/img2img; returns its image, media type and Server-Timing"""
+    boundary = uuid.uuid4().hex
+    body = b"".join([
+        f"--{boundary}\r\n".encode(),
+        f'Content-Disposition: form-data; name="init_image"; filename="{filename}"\r\n'.encode(),
+        f"Content-Type: {content_type}\r\n\r\n".encode(),
+        raw,
+        f"\r\n--{boundary}--\r\n".encode(),
+    ])
+    query = urllib.parse.urlencode({k: v for k, v in params.items() if v is not None})
+    req = urllib.request.Request(
+        f"{DIFFUSION_API_URL}/flux2klein/img2img?{query}",
+        data=body,
+        headers={"Content-Type": f"multipart/form-data; boundary={boundary}"},
+        method="POST",
+    )
     try:
-        out = pipe(
-            prompt=prompt,
-            image=pil,
-            height=height,
-            width=width,
-            guidance_scale=guidance_scale,
-            num_inference_steps=num_inference_steps,
-            generator=gen,
-        )
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Diffusion generation failed: {type(e).__name__}: {e}")
+        with urllib.request.urlopen(req, timeout=DIFFUSION_FORWARD_TIMEOUT_S) as resp:
+            return resp.read(), resp.headers.get("Content-Type", "image/png"), resp.headers.get("Server-Timing", "")
+    except TimeoutError:
+        raise _forward_timeout()
+    except urllib.error.HTTPError as e:
+        # pass diffusion_api's own error through unchanged
+        body = e.read().decode(errors="replace")
+        try:
+            detail = json.loads(body)["detail"]
+        except (ValueError, KeyError, TypeError):
+            detail = f"Diffusion API error: {body}"
+        raise HTTPException(status_code=e.code, detail=detail)
+    except urllib.error.URLError as e:
+        if isinstance(e.reason, TimeoutError):
+            raise _forward_timeout()
+        raise HTTPException(status_code=502, detail=f"Diffusion API unreachable at {DIFFUSION_API_URL}: {e.reason}")
 
-    buf = io.BytesIO()
-    out.images[0].save(buf, format="PNG")
-    return Response(content=buf.getvalue(), media_type="image/png")
+def _forward_timeout() -> HTTPException:
+    return HTTPException(
+        status_code=504,
+        detail=f"Diffusion API at {DIFFUSION_API_URL} did not answer within {DIFFUSION_FORWARD_TIMEOUT_S:g}s",
+    )
 
 if __name__ == "__main__":
+    import uvicorn
+
     uvicorn.run(app, host="0.0.0.0", port=9005)
\ No newline at end of file
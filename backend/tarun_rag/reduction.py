@@ -0,0 +1,95 @@
+# reduction.py
+from pathlib import Path
+from typing import Optional, Tuple
+
+import numpy as np
+
+REDUCTIONS = ("pca", "prefix")
+
+
+class DimReducer:
+    """Projects embeddings to `dim` dimensions for a coarse first-pass search.
+
+    `prefix` keeps the leading dimensions as they are (Matryoshka-style
+    truncation). `pca` centers the vectors and projects them onto their top
+    `dim` principal components, learned from a sample of the indexed vectors.
+    Both are linear, so squared-L2 distances in the reduced space approximate
+    (and never exceed) the full-dimension ones.
+    """
+
+    def __init__(self, kind: str = "pca", dim: int = 256, train_rows: int = 50000, seed: int = 0):
+        if kind not in REDUCTIONS:
+            raise ValueError(f"Unknown reduction {kind!r}; choose from {', '.join(REDUCTIONS)}")
+        self.kind = kind
+        self.dim = dim
+        self.train_rows = train_rows
+        self.seed = seed
+        self.mean = None  # (full_dim,) float32, pca only
+        self.components = None  # (full_dim, dim) float32, pca only
+        self.explained_variance = None  # share of the sample's variance kept, pca only (set by fit)
+
+    @property
+    def name(self) -> str:
+        return f"{self.kind}{self.dim}"
+
+    def fit(self, vectors: np.ndarray):
+        if self.dim >= vectors.shape[1]:
+            raise ValueError(f"reduced dim {self.dim} must be below the embedding dimension {vectors.shape[1]}")
+        if self.kind == "prefix":
+            return self
+        if len(vectors) > self.train_rows:
+            rows = np.sort(np.random.default_rng(self.seed).choice(len(vectors), self.train_rows, replace=False))
+            sample = np.asarray(vectors[rows], dtype=np.float64)
+        else:
+            sample = np.asarray(vectors, dtype=np.float64)
+        self.mean = sample.mean(axis=0)
+        centered = sample - self.mean
+        # eigenvectors of the (full_dim x full_dim) covariance, largest variance first
+        eigenvalues, eigenvectors = np.linalg.eigh(centered.T @ centered)
+        order = np.argsort(eigenvalues)[::-1][:self.dim]
+        self.explained_variance = float(eigenvalues[order].sum() / max(eigenvalues.sum(), 1e-12))
+        self.components = eigenvectors[:, order].astype(np.float32)
+        self.mean = self.mean.astype(np.float32)
+        return self
+
+    def transform(self, vectors: np.ndarray, block_rows: int = 16384) -> np.ndarray:
+        vectors = np.atleast_2d(vectors)
+        if self.kind == "prefix":
+            return np.ascontiguousarray(vectors[:, :self.dim], dtype=np.float32)
+        out = np.empty((len(vectors), self.dim), dtype=np.float32)
+        for start in range(0, len(vectors), block_rows):
+            block = np.asarray(vectors[start:start + block_rows], dtype=np.float32)
+            out[start:start + len(block)] = (block - self.mean) @ self.components
+        return out
+
+    def save(self, out_dir: str, reduced: np.ndarray):
+        """reduced_<name>.npy (memory-mappable) plus the projection in reducer_<name>.npz"""
+        out = Path(out_dir)
+        reduced_name, state_name = self.files()
+        tmp_path = out / f"reduced_{self.name}.tmp.npy"
+        np.save(tmp_path, reduced)
+        tmp_path.replace(out / reduced_name)
+        state = {"kind": np.array(self.kind), "dim": np.int64(self.dim)}
+        if self.kind == "pca":
+            state.update(mean=self.mean, components=self.components)
+        np.savez(out / state_name, **state)
+
+    def files(self) -> Tuple[str, str]:
+        return f"reduced_{self.name}.npy", f"reducer_{self.name}.npz"
+
+    def load(self, in_dir: str, rows: Optional[int] = None) -> Optional[np.ndarray]:
+        """Memory-mapped reduced vectors (the projection is restored), or None if not built yet
+        or, with `rows`, not one vector per embedding row"""
+        inp = Path(in_dir)
+        reduced_path, state_path = (inp / name for name in self.files())
+        if not (reduced_path.exists() and state_path.exists()):
+            return None
+        reduced = np.load(reduced_path, mmap_mode="r")
+        if rows is not None and len(reduced) != rows:
+            print(f"{reduced_path} has {len(reduced)} rows, expected {rows}")
+            return None
+        with np.load(state_path) as state:
+            if self.kind == "pca":
+                self.mean = np.asarray(state["mean"], dtype=np.float32)
+                self.components = np.asarray(state["components"], dtype=np.float32)
+        return reduced
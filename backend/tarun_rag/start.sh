@@ -19,7 +19,9 @@ else
   echo "         Continuing with RAG + Diffusion only."
 fi
 
-uvicorn rag_api:app --host 0.0.0.0 --port 9005 &
+# rag_api forwards /diffusion/* to diffusion_api, so only one process loads the model
+DIFFUSION_API_URL="${DIFFUSION_API_URL:-http://127.0.0.1:9006}" \
+  uvicorn rag_api:app --host 0.0.0.0 --port 9005 &
 RAG_PID=$!
 
 uvicorn diffusion_api:app --host 0.0.0.0 --port 9006 &
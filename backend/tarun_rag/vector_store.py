@@ -1,81 +1,759 @@
-# vector_store_cuvs.py
-import cuvs
-from cuvs.neighbors import cagra
-import cupy as cp
+# vector_store.py
 import numpy as np
 import json
+import os
+import uuid
 from pathlib import Path
+from typing import Optional, Tuple
 
-class CuVSVectorStore:
-    """Direct cuVS vector store using CAGRA algorithm"""
-    
-    def __init__(self, embedding_dim: int = 2048):
+import metrics
+from doc_store import DocumentStore, write_document_store
+from geo_index import BBox, GeoIndex, document_geometry
+from quantization import create_codec, load_codes, save_codes
+from reduction import DimReducer
+
+
+def _top_k_smallest(distances: np.ndarray, top_k: int):
+    """Row-wise positions and values of the `top_k` smallest distances, ascending"""
+    # argpartition(top_k - 1)[:, :top_k] with a negative top_k would return almost every row
+    assert top_k >= 1, f"top_k must be at least 1, got {top_k}"
+    if top_k < distances.shape[1]:
+        top = np.argpartition(distances, top_k - 1, axis=1)[:, :top_k]
+    else:
+        top = np.broadcast_to(np.arange(distances.shape[1]), distances.shape)
+    top_distances = np.take_along_axis(distances, top, axis=1)
+    order = np.argsort(top_distances, axis=1, kind="stable")
+    return np.take_along_axis(top, order, axis=1), np.take_along_axis(top_distances, order, axis=1)
+
+
+def _blocked_top_k(queries: np.ndarray, n_total: int, ids: Optional[np.ndarray], rows, norms: np.ndarray,
+                   top_k: int, block_rows: int):
+    """Squared-L2 top-k of `queries` over `ids` (all n_total rows if None); `rows(start, stop, ids)` reads a block"""
+    n_rows = n_total if ids is None else len(ids)
+    query_norms = np.einsum("ij,ij->i", queries, queries)[:, None]
+
+    best_ids = np.empty((len(queries), 0), dtype=np.int64)
+    best_distances = np.empty((len(queries), 0), dtype=np.float32)
+    for start in range(0, n_rows, block_rows):
+        stop = min(start + block_rows, n_rows)
+        block_ids = np.arange(start, stop) if ids is None else ids[start:stop]
+        block = rows(start, stop, None if ids is None else block_ids)
+        distances = norms[block_ids][None, :] - 2.0 * (queries @ block.T) + query_norms
+
+        candidate_ids = np.concatenate([best_ids, np.broadcast_to(block_ids, distances.shape)], axis=1)
+        candidate_distances = np.concatenate([best_distances, distances], axis=1)
+        top, best_distances = _top_k_smallest(candidate_distances, top_k)
+        best_ids = np.take_along_axis(candidate_ids, top, axis=1)
+
+    return best_ids, np.maximum(best_distances, 0.0)
+
+
+# files derived from embeddings.npy; meta.json records the build each one was made from
+DERIVED_FILES = ("hnsw_index.bin", "cagra_index*.bin", "codes_*.npy", "codec_*.npz",
+                 "reduced_*.npy", "reducer_*.npz")
+
+
+def _read_meta(directory: Path) -> dict:
+    meta_path = directory / "meta.json"
+    if not meta_path.exists():
+        return {}
+    with meta_path.open("r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _write_meta(directory: Path, meta: dict):
+    # temp file + rename so a concurrent load never reads a half-written meta.json
+    tmp_path = directory / "meta.tmp.json"
+    with tmp_path.open("w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, directory / "meta.json")
+
+
+class VectorStore:
+    """Common vector store interface.
+
+    Every backend reads and writes the same `vector_db/` layout:
+    `embeddings.npy` (float32 vectors), `documents.jsonl` with its doc_store
+    side files, and `meta.json`, plus an optional backend-specific ANN index
+    file that is rebuilt from `embeddings.npy` when missing, and
+    `geo_index.npz` (document coordinates and bounds on a lat/lon grid). Scores are
+    squared L2 distances (lower is closer) for every backend.
+
+    Every build_index gets a new build id. meta.json stores it with the row
+    count and the build each derived file (ANN index, codes, reduced vectors)
+    was made from; on load, derived files from another build are rebuilt
+    instead of being searched against the wrong rows, and save() deletes them.
+
+    With `compression` (fp16, int8 or pq; env VECTOR_COMPRESSION) the first
+    pass searches compressed vectors (`codes_<kind>.npy`) for
+    `rerank_factor` x top_k candidates, which are then re-scored exactly
+    against the memory-mapped float32 rows.
+
+    With `reduced_dim` (env VECTOR_REDUCED_DIM) a PCA or prefix projection of
+    the vectors (`reduced_<kind><dim>.npy`) is kept as well. A "fast" search
+    scans it for `fast_rerank_factor` x top_k candidates and re-scores them
+    against the full float32 vectors; it is the default with VECTOR_FAST_SEARCH=1
+    and can be picked per call with search_batch(fast=...).
+    """
+
+    backend = None
+
+    def __init__(self, embedding_dim: int = 2048, brute_force_max_rows: int = 4096,
+                 compression: Optional[str] = None,
+                 rerank_factor: int = int(os.getenv("VECTOR_RERANK_FACTOR", "4")),
+                 pq_dim: int = int(os.getenv("VECTOR_PQ_DIM", "64")),
+                 reduced_dim: int = int(os.getenv("VECTOR_REDUCED_DIM", "0")),
+                 reduction: str = os.getenv("VECTOR_REDUCTION", "pca"),
+                 fast_search: bool = os.getenv("VECTOR_FAST_SEARCH", "0") == "1",
+                 fast_rerank_factor: int = int(os.getenv("VECTOR_FAST_RERANK_FACTOR", "10"))):
         self.embedding_dim = embedding_dim
-        self.index = None
+        # categories at or below this size are searched exactly instead of via the ANN index
+        self.brute_force_max_rows = brute_force_max_rows
+        self.compression = (compression or os.getenv("VECTOR_COMPRESSION") or "none").lower()
+        self.codec = create_codec(self.compression, pq_dim=pq_dim)
+        self.rerank_factor = max(1, rerank_factor)
+        self.codes = None  # compressed vectors, searched instead of embeddings when a codec is set
+        self.reducer = DimReducer(reduction, reduced_dim) if reduced_dim > 0 else None
+        self.reduced = None  # (n_docs, reduced_dim) float32 projection for the fast path
+        self._reduced_norms = None
+        self.fast_search = fast_search
+        self.fast_rerank_factor = max(1, fast_rerank_factor)
         self.documents = []
-        
-    def build_index(self, embeddings: np.ndarray, documents: list):
-        """Build CAGRA index"""
+        self.embeddings = None  # host copy (memory-mapped after load)
+        self.build_id = None  # new for every build_index; derived files are only trusted if made from it
+        self._derived = {}  # derived file name -> build id it was made from, as in meta.json
+        self.categories = {}  # category -> sorted doc ids, built at build/load time
+        self.category_counts = {}
+        self.geo_index = None
+        self._norms = None
+        self._swap_listeners = []
+
+    def add_swap_listener(self, callback):
+        """Call `callback()` whenever build_index/load replaces the searchable index"""
+        self._swap_listeners.append(callback)
+
+    def _notify_swap(self):
+        for callback in self._swap_listeners:
+            callback()
+
+    def build_index(self, embeddings: np.ndarray, documents: list, locations: Optional[np.ndarray] = None,
+                    bounds: Optional[np.ndarray] = None):
+        """Build the ANN and spatial indexes (one embedding / [lat, lon] / bounds row per document)"""
         self.documents = documents
-        
-        # Convert to cupy array on GPU
-        embeddings_gpu = cp.asarray(embeddings, dtype=cp.float32)
-        
+        self.embeddings = np.asarray(embeddings, dtype=np.float32)
+        self.build_id = uuid.uuid4().hex
+        self._derived = {}
+        self._norms = None
+        self._build_codes()
+        self._build_reduced()
+        self._build_ann()
+        self._build_category_table()
+        if locations is None:
+            locations, bounds = document_geometry(documents)
+        self.geo_index = GeoIndex(locations, bounds)
+        self._notify_swap()
+
+    def _build_category_table(self):
+        """Group document ids by category so filtered searches only touch their own rows"""
+        if isinstance(self.documents, DocumentStore):
+            self.categories = self.documents.category_ids()
+        else:
+            by_category = {}
+            for i, doc in enumerate(self.documents):
+                by_category.setdefault(doc['category'], []).append(i)
+            self.categories = {
+                category: np.asarray(ids, dtype=np.int64)
+                for category, ids in by_category.items()
+            }
+        self.category_counts = {category: len(ids) for category, ids in self.categories.items()}
+        self._on_category_table()
+
+    def search(self, query_embedding: np.ndarray, top_k: int = 10, category: Optional[str] = None,
+               near: Optional[Tuple[float, float]] = None, radius_m: Optional[float] = None,
+               bbox: Optional[BBox] = None, fast: Optional[bool] = None):
+        """Search the index, optionally restricted to a category and/or an area"""
+        return self.search_batch(
+            query_embedding, top_k=top_k, category=category, near=near, radius_m=radius_m, bbox=bbox, fast=fast
+        )[0]
+
+    def search_batch(self, query_embeddings: np.ndarray, top_k: int = 10, category: Optional[str] = None,
+                     near: Optional[Tuple[float, float]] = None, radius_m: Optional[float] = None,
+                     bbox: Optional[BBox] = None, fast: Optional[bool] = None):
+        """Search every row of `query_embeddings` in one call; returns one result list per row.
+
+        `near` (lat, lon) + `radius_m`, or `bbox` (min_lat, min_lon, max_lat, max_lon),
+        restrict results to documents inside that area. `fast` picks the
+        reduced-dimension first pass (None: the store's fast_search default).
+        """
+        if top_k < 1:
+            raise ValueError(f"top_k must be at least 1, got {top_k}")
+        queries = np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32))
+        ids, cache_key = self._candidate_ids(category, near, radius_m, bbox)
+        if ids is not None and len(ids) == 0:
+            return [[] for _ in range(len(queries))]
+
+        top_k = min(top_k, len(self.documents) if ids is None else len(ids))
+        if fast is None:
+            fast = self.fast_search and self.has_fast_path
+        elif fast and not self.has_fast_path:
+            raise ValueError("No reduced-dimension index loaded; set VECTOR_REDUCED_DIM and rebuild or reload")
+        if fast:
+            shortlist = min(top_k * self.fast_rerank_factor, len(self.documents) if ids is None else len(ids))
+            with metrics.stage("fast_search"):
+                neighbors, _ = self._reduced_search(queries, ids, shortlist)
+            with metrics.stage("rerank"):
+                neighbors, distances = self._rerank(queries, neighbors, top_k)
+            return self._materialize(neighbors, distances)
+
+        rerank = self.codec is not None and self.embeddings is not None
+        # compressed scores are approximate, so fetch a longer shortlist to re-score exactly
+        shortlist = min(top_k * self.rerank_factor, len(self.documents) if ids is None else len(ids)) if rerank else top_k
+
+        with metrics.stage("ann_search"):
+            if ids is None:
+                neighbors, distances = self._ann_search(queries, shortlist)
+            elif self.embeddings is not None and len(ids) <= self.brute_force_max_rows:
+                neighbors, distances = self._exact_search(queries, ids, shortlist, cache_key=cache_key)
+            else:
+                neighbors, distances = self._ann_search(queries, shortlist, ids=ids, cache_key=cache_key)
+                if self.embeddings is not None and ((neighbors < 0) | (neighbors >= len(self.documents))).any():
+                    # very selective filters can starve a graph walk; an exact scan never comes up short
+                    neighbors, distances = self._exact_search(queries, ids, shortlist, cache_key=cache_key)
+
+        if rerank:
+            with metrics.stage("rerank"):
+                neighbors, distances = self._rerank(queries, neighbors, top_k)
+        return self._materialize(neighbors, distances)
+
+    @property
+    def has_fast_path(self) -> bool:
+        """Whether search_batch(fast=True) can run (reduced vectors + float32 rows to re-score)"""
+        return self.reduced is not None and self.embeddings is not None
+
+    def _rerank(self, queries: np.ndarray, neighbors: np.ndarray, top_k: int):
+        """Exact squared-L2 top-k of each row's shortlist; only the shortlisted float32 rows are read"""
+        valid = (neighbors >= 0) & (neighbors < len(self.embeddings))
+        if not valid.any():
+            return np.full((len(queries), top_k), -1, dtype=np.int64), np.zeros((len(queries), top_k), np.float32)
+
+        rows = np.unique(neighbors[valid])
+        vectors = np.asarray(self.embeddings[rows], dtype=np.float32)
+        positions = np.searchsorted(rows, np.where(valid, neighbors, rows[0]))
+        dots = np.take_along_axis(queries @ vectors.T, positions, axis=1)
+        norms = np.einsum("ij,ij->i", vectors, vectors)[positions]
+        distances = norms - 2.0 * dots + np.einsum("ij,ij->i", queries, queries)[:, None]
+        distances = np.where(valid, np.maximum(distances, 0.0), np.inf)
+
+        top, top_distances = _top_k_smallest(distances, min(top_k, distances.shape[1]))
+        missing = np.isinf(top_distances)
+        top_ids = np.where(missing, -1, np.take_along_axis(neighbors, top, axis=1))
+        return top_ids, np.where(missing, 0.0, top_distances).astype(np.float32)
+
+    def filter_ids(self, category: Optional[str] = None, near: Optional[Tuple[float, float]] = None,
+                   radius_m: Optional[float] = None, bbox: Optional[BBox] = None) -> Optional[np.ndarray]:
+        """Sorted doc ids allowed by a category and/or area filter, or None when nothing is restricted"""
+        return self._candidate_ids(category, near, radius_m, bbox)[0]
+
+    def _candidate_ids(self, category, near, radius_m, bbox):
+        """Sorted doc ids allowed by the filters (None = no restriction) and a cache key for them"""
+        ids, cache_key = None, None
+        if category is not None:
+            ids = self.categories.get(category, np.empty(0, dtype=np.int64))
+            cache_key = category
+
+        areas = []
+        if near is not None and radius_m is not None:
+            areas.append(self.geo_index.within_radius(near[0], near[1], radius_m))
+        if bbox is not None:
+            areas.append(self.geo_index.within_bbox(*bbox))
+        for area in areas:
+            # areas differ per query, so their slices / filters are not worth caching
+            ids = area if ids is None else np.intersect1d(ids, area, assume_unique=True)
+            cache_key = None
+        return ids, cache_key
+
+    def _materialize(self, neighbors: np.ndarray, distances: np.ndarray):
+        batch_results = []
+        with metrics.stage("materialize"):
+            for row_neighbors, row_distances in zip(neighbors, distances):
+                results = []
+                for idx, dist in zip(row_neighbors, row_distances):
+                    # short result rows are padded with -1 / out-of-range sentinel ids
+                    if idx < 0 or idx >= len(self.documents):
+                        continue
+                    results.append((self.documents[int(idx)], float(dist)))
+                batch_results.append(results)
+        return batch_results
+
+    def _row_norms(self) -> np.ndarray:
+        if self._norms is None:
+            if self.codes is None:
+                self._norms = np.einsum("ij,ij->i", self.embeddings, self.embeddings)
+            else:
+                # norms of what the scan actually compares against: the decoded codes
+                self._norms = np.concatenate([
+                    np.einsum("ij,ij->i", block, block)
+                    for block in (self.codec.decode(self.codes[start:start + 16384])
+                                  for start in range(0, len(self.codes), 16384))
+                ]) if len(self.codes) else np.empty(0, dtype=np.float32)
+        return self._norms
+
+    def _rows(self, start: int, stop: int, ids: Optional[np.ndarray] = None) -> np.ndarray:
+        """float32 rows `ids` (or start:stop) of the scanned matrix: decoded codes when compressed"""
+        source = self.embeddings if self.codes is None else self.codes
+        block = source[start:stop] if ids is None else source[ids]
+        return np.asarray(block, dtype=np.float32) if self.codes is None else self.codec.decode(block)
+
+    def _build_reduced(self):
+        self.reduced = None
+        self._reduced_norms = None
+        if self.reducer is not None:
+            self.reduced = self.reducer.fit(self.embeddings).transform(self.embeddings)
+
+    def _build_codes(self):
+        self.codes = None
+        if self._keeps_codes():
+            self.codec.fit(self.embeddings)
+            self.codes = self.codec.encode(self.embeddings)
+
+    def _exact_search(self, queries: np.ndarray, ids: Optional[np.ndarray], top_k: int,
+                      cache_key: Optional[str] = None, block_rows: int = 16384):
+        """Exact squared-L2 top-k over `ids` (all rows if None), scanning the matrix in row blocks"""
+        return _blocked_top_k(queries, len(self.embeddings), ids, self._rows, self._row_norms(), top_k, block_rows)
+
+    def _reduced_search(self, queries: np.ndarray, ids: Optional[np.ndarray], top_k: int,
+                        block_rows: int = 65536):
+        """Squared-L2 top-k over the reduced-dimension vectors (a shortlist for _rerank)"""
+        if self._reduced_norms is None:
+            self._reduced_norms = np.einsum("ij,ij->i", self.reduced, self.reduced)
+
+        def rows(start, stop, block_ids=None):
+            return np.asarray(self.reduced[start:stop] if block_ids is None else self.reduced[block_ids])
+
+        return _blocked_top_k(self.reducer.transform(queries), len(self.reduced), ids, rows,
+                              self._reduced_norms, top_k, block_rows)
+
+    # --- backend hooks -------------------------------------------------
+
+    def _build_ann(self):
+        """Build the backend's ANN structure from self.embeddings"""
+
+    def _keeps_codes(self) -> bool:
+        """Whether the codec's codes are built and searched (a backend may compress on its own)"""
+        return self.codec is not None
+
+    def _ann_search(self, queries: np.ndarray, top_k: int, ids: Optional[np.ndarray] = None,
+                    cache_key: Optional[str] = None):
+        """Return (neighbors, distances), each shaped (n_queries, top_k), over `ids` only if given;
+        pad misses with -1. Filters built for `ids` may be cached under `cache_key`."""
+        raise NotImplementedError
+
+    def _on_category_table(self):
+        """Drop any per-category state derived from the previous table"""
+
+    def _index_name(self) -> Optional[str]:
+        """File name of the saved ANN index, None if the backend keeps none"""
+        return None
+
+    def _save_ann(self, out: Path):
+        pass
+
+    def _load_ann(self, inp: Path):
+        self._build_ann()
+
+    def _codes_files(self) -> Tuple[str, str]:
+        return f"codes_{self.compression}.npy", f"codec_{self.compression}.npz"
+
+    def _is_current(self, name: str) -> bool:
+        """Whether derived file `name` in the loaded directory was made from the loaded embeddings"""
+        return self.build_id is not None and self._derived.get(name) == self.build_id
+
+    def _cache_derived(self, inp: Path, names: Tuple[str, ...], write, what: str):
+        """Cache derived files rebuilt on load with `write()` and record them in meta.json"""
+        try:
+            write()
+            meta = _read_meta(inp)
+            if meta.get("build_id") == self.build_id:
+                meta.setdefault("derived", {}).update(dict.fromkeys(names, self.build_id))
+                _write_meta(inp, meta)
+            self._derived.update(dict.fromkeys(names, self.build_id))
+        except OSError as e:
+            print(f"Could not cache {what} in {inp}: {e}")
+
+    # --- persistence ---------------------------------------------------
+
+    def save(self, output_dir: str):
+        out = Path(output_dir)
+        out.mkdir(parents=True, exist_ok=True)
+        if self.build_id is None:
+            self.build_id = uuid.uuid4().hex
+        # files another backend made from these same embeddings stay valid
+        derived = {name: build_id for name, build_id in _read_meta(out).get("derived", {}).items()
+                   if build_id == self.build_id}
+
+        # full-precision vectors, shared by every backend (skip if we are mapped from that file)
+        embeddings_path = out / "embeddings.npy"
+        if not (isinstance(self.embeddings, np.memmap)
+                and Path(self.embeddings.filename).resolve() == embeddings_path.resolve()):
+            # temp file + rename: a running server may have the old file memory-mapped
+            tmp_path = out / "embeddings.tmp.npy"
+            np.save(tmp_path, self.embeddings)
+            os.replace(tmp_path, embeddings_path)
+
+        # save metadata docs so search indices map back to docs
+        # (a store loaded from this same directory is already on disk)
+        if not (isinstance(self.documents, DocumentStore) and self.documents.path.resolve() == out.resolve()):
+            write_document_store(str(out), self.documents)
+
+        if self.codes is not None:
+            save_codes(str(out), self.codec, self.codes)
+            derived.update(dict.fromkeys(self._codes_files(), self.build_id))
+        if self.reduced is not None:
+            self.reducer.save(str(out), self.reduced)
+            derived.update(dict.fromkeys(self.reducer.files(), self.build_id))
+
+        self.geo_index.save(str(out / "geo_index.npz"))
+        index_name = self._index_name()
+        if index_name is not None:
+            self._save_ann(out)
+            derived[index_name] = self.build_id
+
+        _write_meta(out, {"embedding_dim": self.embedding_dim, "built_with": self.backend,
+                          "compression": self.compression,
+                          "reduced": self.reducer.name if self.reducer is not None else None,
+                          "build_id": self.build_id, "rows": len(self.embeddings), "derived": derived})
+        self._derived = derived
+
+        # files made from other embeddings (or by another backend from them) would be
+        # picked up by a later load, so only those recorded for this build are kept
+        for pattern in DERIVED_FILES:
+            for path in out.glob(pattern):
+                if derived.get(path.name) != self.build_id:
+                    path.unlink(missing_ok=True)
+
+    def load(self, input_dir: str):
+        inp = Path(input_dir)
+
+        meta = _read_meta(inp)
+        self.embedding_dim = meta.get("embedding_dim", self.embedding_dim)
+
+        embeddings_path = inp / "embeddings.npy"
+        self.embeddings = np.load(embeddings_path, mmap_mode="r") if embeddings_path.exists() else None
+        self._norms = None
+        self.build_id = meta.get("build_id")
+        if self.embeddings is not None and (self.build_id is None or meta.get("rows") != len(self.embeddings)):
+            # an index from before build ids, or embeddings.npy replaced under meta.json:
+            # nothing derived from the old rows can be trusted, so it all gets rebuilt
+            print(f"{embeddings_path} does not match {inp / 'meta.json'}, rebuilding derived index files...")
+            self.build_id = uuid.uuid4().hex
+            meta.update(build_id=self.build_id, rows=len(self.embeddings), derived={})
+            try:
+                _write_meta(inp, meta)
+            except OSError as e:
+                print(f"Could not update {inp / 'meta.json'}: {e}")
+        self._derived = dict(meta.get("derived", {}))
+        self.codes = None
+        if self._keeps_codes():
+            codes_name = self._codes_files()[0]
+            if self._is_current(codes_name):
+                rows = None if self.embeddings is None else len(self.embeddings)
+                self.codes = load_codes(str(inp), self.codec, rows=rows)
+            elif (inp / codes_name).exists():
+                print(f"{inp / codes_name} was built from other embeddings, ignoring it")
+            if self.codes is None and self.embeddings is not None:
+                print(f"No current {self.compression} codes in {inp}, building them from embeddings.npy...")
+                self._build_codes()
+                self._cache_derived(inp, self._codes_files(),
+                                    lambda: save_codes(str(inp), self.codec, self.codes), f"{self.compression} codes")
+        self.reduced = None
+        self._reduced_norms = None
+        if self.reducer is not None:
+            reduced_name = self.reducer.files()[0]
+            if self._is_current(reduced_name):
+                rows = None if self.embeddings is None else len(self.embeddings)
+                self.reduced = self.reducer.load(str(inp), rows=rows)
+            elif (inp / reduced_name).exists():
+                print(f"{inp / reduced_name} was built from other embeddings, ignoring it")
+            if self.reduced is None and self.embeddings is not None:
+                print(f"No current {self.reducer.name} reduced vectors in {inp}, building them from embeddings.npy...")
+                self._build_reduced()
+                self._cache_derived(inp, self.reducer.files(), lambda: self.reducer.save(str(inp), self.reduced),
+                                    f"{self.reducer.name} reduced vectors")
+
+        # memory-mapped; documents are decoded only when they appear in a result
+        if isinstance(self.documents, DocumentStore):
+            self.documents.close()
+        self.documents = DocumentStore(str(inp))
+
+        self._load_ann(inp)
+        self._build_category_table()
+
+        geo_path = inp / "geo_index.npz"
+        if geo_path.exists():
+            self.geo_index = GeoIndex.load(str(geo_path))
+        else:
+            print(f"No spatial index in {inp}, building one from document locations...")
+            self.geo_index = GeoIndex(*document_geometry(self.documents))
+        self._notify_swap()
+
+
+class CuVSVectorStore(VectorStore):
+    """Direct cuVS vector store using CAGRA algorithm"""
+
+    backend = "cuvs"
+
+    def __init__(self, embedding_dim: int = 2048, brute_force_max_rows: int = 4096, **kwargs):
+        # imported here so CPU-only boxes can still import this module
+        import cupy
+        from cuvs.neighbors import cagra, filters
+
+        super().__init__(embedding_dim, brute_force_max_rows, **kwargs)
+        self._cp = cupy
+        self._cagra = cagra
+        self._filters = filters
+        self.index = None
+        self._category_bitsets = {}
+        self._category_vectors = {}
+
+    def _build_ann(self):
+        cp, cagra = self._cp, self._cagra
+
+        # Convert to cupy array on GPU; fp16/int8 codes are indexed as-is (CAGRA takes both)
+        compression = None
+        if self.compression in ("fp16", "int8"):
+            dataset_gpu = cp.asarray(self.codes)
+        else:
+            dataset_gpu = cp.asarray(self.embeddings, dtype=cp.float32)
+            if self.compression == "pq":
+                # CAGRA's own VPQ: the index keeps only the compressed dataset
+                compression = cagra.CompressionParams(pq_dim=self.codec.pq_dim, pq_bits=8)
+
         # Build CAGRA index (graph-based, very fast)
         index_params = cagra.IndexParams(
             intermediate_graph_degree=64,
-            graph_degree=32
+            graph_degree=32,
+            compression=compression,
         )
-        self.index = cagra.build(index_params, embeddings_gpu)
-        
-    def search(self, query_embedding: np.ndarray, top_k: int = 10):
-        """Search using CAGRA"""
-        query_gpu = cp.asarray(query_embedding, dtype=cp.float32)
+        self.index = cagra.build(index_params, dataset_gpu)
+
+    def _keeps_codes(self) -> bool:
+        # with pq, CAGRA trains its own VPQ on the float32 rows (CompressionParams),
+        # so numpy PQ codes would be trained and stored only to go unused
+        return self.codec is not None and self.compression != "pq"
+
+    def _on_category_table(self):
+        self._category_bitsets = {}
+        self._category_vectors = {}
+
+    def _ann_search(self, queries: np.ndarray, top_k: int, ids: Optional[np.ndarray] = None,
+                    cache_key: Optional[str] = None):
+        cp, cagra = self._cp, self._cagra
+        if self.compression in ("fp16", "int8"):
+            # the query must match the dataset dtype
+            queries_gpu = cp.asarray(self.codec.encode(queries))
+        else:
+            queries_gpu = cp.asarray(queries, dtype=cp.float32)
+        sample_filter = self._id_filter(ids, cache_key) if ids is not None else None
 
         search_params = cagra.SearchParams()
         distances_dev, neighbors_dev = cagra.search(
-            search_params, self.index, query_gpu, top_k
+            search_params, self.index, queries_gpu, top_k, filter=sample_filter
         )
 
-        # cuVS returns device_ndarray; convert to CuPy for indexing/get()
-        distances = cp.asarray(distances_dev)
-        neighbors = cp.asarray(neighbors_dev)
+        # cuVS returns device_ndarray; convert to CuPy, then host numpy shaped (n_queries, k)
+        neighbors = cp.asnumpy(cp.asarray(neighbors_dev)).reshape(len(queries), -1).astype(np.int64)
+        distances = cp.asnumpy(cp.asarray(distances_dev)).reshape(len(queries), -1)
+        return neighbors, distances
 
-        # move to host numpy for iteration
-        neighbors_h = cp.asnumpy(neighbors)
-        distances_h = cp.asnumpy(distances)
+    def _id_filter(self, ids: np.ndarray, cache_key: Optional[str] = None):
+        """Bitset prefilter (bit set = keep) over all document ids"""
+        if cache_key is not None and cache_key in self._category_bitsets:
+            return self._category_bitsets[cache_key]
 
-        # handle shape (k,) vs (1,k)
-        if neighbors_h.ndim == 2:
-            neighbors_h = neighbors_h[0]
-            distances_h = distances_h[0]
+        bitset = np.zeros((len(self.documents) + 31) // 32, dtype=np.uint32)
+        np.bitwise_or.at(bitset, ids >> 5, np.left_shift(1, ids & 31).astype(np.uint32))
+        sample_filter = self._filters.from_bitset(self._cp.asarray(bitset))
+        if cache_key is not None:
+            self._category_bitsets[cache_key] = sample_filter
+        return sample_filter
 
-        results = []
-        for idx, dist in zip(neighbors_h, distances_h):
-            results.append((self.documents[int(idx)], float(dist)))
-        return results
+    def _exact_search(self, queries: np.ndarray, ids: Optional[np.ndarray], top_k: int,
+                      cache_key: Optional[str] = None, block_rows: int = 16384):
+        """Exact squared-L2 top-k on the GPU over a (cached) slice of the vectors"""
+        cp = self._cp
+        if ids is None:
+            return super()._exact_search(queries, ids, top_k, block_rows=block_rows)
 
-    def save(self, output_dir: str):
-        out = Path(output_dir)
-        out.mkdir(parents=True, exist_ok=True)
+        if cache_key is not None and cache_key in self._category_vectors:
+            vectors, norms = self._category_vectors[cache_key]
+        else:
+            vectors = cp.asarray(self.embeddings[ids], dtype=cp.float32)
+            norms = (vectors * vectors).sum(axis=1)
+            if cache_key is not None:
+                self._category_vectors[cache_key] = (vectors, norms)
 
-        # saves ANN index (+ dataset if include_dataset=True)
-        cagra.save(str(out / "cagra_index.bin"), self.index, include_dataset=True)
+        queries_gpu = cp.asarray(queries, dtype=cp.float32)
+        query_norms = (queries_gpu * queries_gpu).sum(axis=1, keepdims=True)
+        distances = norms[None, :] - 2.0 * (queries_gpu @ vectors.T) + query_norms
 
-        # save metadata docs so search indices map back to docs
-        with (out / "documents.jsonl").open("w", encoding="utf-8") as f:
-            for doc in self.documents:
-                f.write(json.dumps(doc, ensure_ascii=False) + "\n")
+        if top_k < distances.shape[1]:
+            top = cp.argpartition(distances, top_k - 1, axis=1)[:, :top_k]
+        else:
+            top = cp.broadcast_to(cp.arange(distances.shape[1]), distances.shape)
+        top_distances = cp.take_along_axis(distances, top, axis=1)
+        order = cp.argsort(top_distances, axis=1)
+        top = cp.asnumpy(cp.take_along_axis(top, order, axis=1))
+        top_distances = cp.asnumpy(cp.take_along_axis(top_distances, order, axis=1))
+        return ids[top], np.maximum(top_distances, 0.0)
 
-        with (out / "meta.json").open("w", encoding="utf-8") as f:
-            json.dump({"embedding_dim": self.embedding_dim}, f)
+    def _index_name(self) -> str:
+        # the graph and stored dataset depend on the compression, so each gets its own file
+        return "cagra_index.bin" if self.codec is None else f"cagra_index_{self.compression}.bin"
 
-    def load(self, input_dir: str):
-        inp = Path(input_dir)
+    def _save_ann(self, out: Path):
+        # saves ANN index (+ dataset if include_dataset=True; compressed when compression is set)
+        self._cagra.save(str(out / self._index_name()), self.index, include_dataset=True)
 
-        self.index = cagra.load(str(inp / "cagra_index.bin"))
+    def _load_ann(self, inp: Path):
+        index_path = inp / self._index_name()
+        if index_path.exists() and self._is_current(index_path.name):
+            self.index = self._cagra.load(str(index_path))
+            return
 
-        self.documents = []
-        with (inp / "documents.jsonl").open("r", encoding="utf-8") as f:
-            for line in f:
-                self.documents.append(json.loads(line))
\ No newline at end of file
+        if index_path.exists():
+            print(f"{index_path} was built from other embeddings, rebuilding it from embeddings.npy...")
+        else:
+            print(f"No CAGRA index in {inp}, building one from embeddings.npy...")
+        self._build_ann()
+
+
+class NumpyVectorStore(VectorStore):
+    """Exact CPU search: blocked matrix-multiply top-k over the memory-mapped vectors"""
+
+    backend = "numpy"
+
+    def _ann_search(self, queries: np.ndarray, top_k: int, ids: Optional[np.ndarray] = None,
+                    cache_key: Optional[str] = None):
+        return self._exact_search(queries, ids, top_k)
+
+    def _load_ann(self, inp: Path):
+        if self.embeddings is None:
+            raise FileNotFoundError(f"{inp}/embeddings.npy is missing; rebuild the index with build_index.py")
+
+
+class HNSWVectorStore(VectorStore):
+    """Approximate CPU search with an HNSW graph (hnswlib)"""
+
+    backend = "hnsw"
+
+    def __init__(self, embedding_dim: int = 2048, brute_force_max_rows: int = 4096,
+                 m: int = 32, ef_construction: int = 200, ef_search: int = 128, **kwargs):
+        try:
+            import hnswlib
+        except ImportError as e:
+            raise ImportError("HNSW backend needs `hnswlib` (pip install hnswlib)") from e
+
+        super().__init__(embedding_dim, brute_force_max_rows, **kwargs)
+        if self.codec is not None:
+            # hnswlib only stores float32 vectors in its graph
+            print(f"HNSW backend keeps float32 vectors; ignoring {self.compression} compression")
+            self.compression, self.codec = "none", None
+        self._hnswlib = hnswlib
+        self.m = m
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self.index = None
+        self._category_masks = {}
+
+    def _build_ann(self):
+        index = self._hnswlib.Index(space="l2", dim=self.embedding_dim)
+        index.init_index(max_elements=len(self.embeddings), ef_construction=self.ef_construction, M=self.m)
+        index.add_items(np.asarray(self.embeddings, dtype=np.float32), np.arange(len(self.embeddings)))
+        self.index = index
+
+    def _on_category_table(self):
+        self._category_masks = {}
+
+    def _ann_search(self, queries: np.ndarray, top_k: int, ids: Optional[np.ndarray] = None,
+                    cache_key: Optional[str] = None):
+        self.index.set_ef(max(self.ef_search, top_k))
+        if ids is None:
+            neighbors, distances = self.index.knn_query(queries, k=top_k)
+            return neighbors.astype(np.int64), distances
+
+        mask = self._category_masks.get(cache_key) if cache_key is not None else None
+        if mask is None:
+            mask = np.zeros(len(self.documents), dtype=bool)
+            mask[ids] = True
+            if cache_key is not None:
+                self._category_masks[cache_key] = mask
+
+        try:
+            # the filter is a Python callback, so keep it single-threaded
+            neighbors, distances = self.index.knn_query(
+                queries, k=top_k, num_threads=1, filter=lambda label: bool(mask[label])
+            )
+        except RuntimeError:
+            # hnswlib raises when it finds fewer than k matches; signal a short result
+            return np.full((len(queries), top_k), -1, dtype=np.int64), np.zeros((len(queries), top_k), np.float32)
+        return neighbors.astype(np.int64), distances
+
+    def _index_name(self) -> str:
+        return "hnsw_index.bin"
+
+    def _save_ann(self, out: Path):
+        self.index.save_index(str(out / self._index_name()))
+
+    def _load_ann(self, inp: Path):
+        if self.embeddings is None:
+            raise FileNotFoundError(f"{inp}/embeddings.npy is missing; rebuild the index with build_index.py")
+
+        index_path = inp / self._index_name()
+        if index_path.exists() and self._is_current(index_path.name):
+            index = self._hnswlib.Index(space="l2", dim=self.embedding_dim)
+            index.load_index(str(index_path))
+            if index.get_current_count() == len(self.embeddings):
+                self.index = index
+                return
+            print(f"{index_path} holds {index.get_current_count()} vectors but embeddings.npy has "
+                  f"{len(self.embeddings)}, rebuilding it...")
+        elif index_path.exists():
+            print(f"{index_path} was built from other embeddings, rebuilding it from embeddings.npy...")
+        else:
+            print(f"No HNSW index in {inp}, building one from embeddings.npy...")
+        self._build_ann()
+        self._cache_derived(inp, (index_path.name,), lambda: self._save_ann(inp), "HNSW index")
+
+
+BACKENDS = {
+    "cuvs": CuVSVectorStore,
+    "numpy": NumpyVectorStore,
+    "hnsw": HNSWVectorStore,
+}
+
+
+def detect_backend() -> str:
+    """cuVS when a CUDA device and cuvs/cupy are available, else HNSW if installed, else NumPy"""
+    try:
+        import cupy
+        import cuvs  # noqa: F401
+        if cupy.cuda.runtime.getDeviceCount() > 0:
+            return "cuvs"
+    except Exception:
+        pass
+
+    try:
+        import hnswlib  # noqa: F401
+        return "hnsw"
+    except ImportError:
+        return "numpy"
+
+
+def create_vector_store(backend: Optional[str] = None, embedding_dim: int = 2048, **kwargs) -> VectorStore:
+    """Create the store named by `backend` (or env VECTOR_BACKEND); "auto" picks via detect_backend()"""
+    backend = (backend or os.getenv("VECTOR_BACKEND") or "auto").lower()
+    if backend == "auto":
+        backend = detect_backend()
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown vector backend {backend!r}; choose from {sorted(BACKENDS)} or 'auto'")
+    return BACKENDS[backend](embedding_dim=embedding_dim, **kwargs)
@@ -0,0 +1,77 @@
+# wkt.py
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+
+# innermost "( ... )" groups are coordinate lists: the point of a POINT, or one ring of a
+# (MULTI)POLYGON; a ring opened with "((" is the first (outer) ring of its polygon
+_RING_RE = r'(?P<outer>\(?)\((?P<coords>[^()]*)\)'
+_PAIR_RE = r'(?P<x>[-+]?[\d.]+(?:[eE][-+]?\d+)?)\s+(?P<y>[-+]?[\d.]+(?:[eE][-+]?\d+)?)'
+
+
+def parse_wkt(geometries: pd.Series) -> Tuple[np.ndarray, np.ndarray]:
+    """Centroid and bounding box of each WKT geometry in `geometries`.
+
+    Returns (centroids, bounds): (n, 2) float64 [lat, lon] and (n, 4) float64
+    [min_lat, min_lon, max_lat, max_lon], NaN where the cell is missing or not
+    WKT. Polygon centroids are area-weighted (holes subtracted); points and
+    lines fall back to the mean of their vertices.
+    """
+    n = len(geometries)
+    centroids = np.full((n, 2), np.nan, dtype=np.float64)
+    bounds = np.full((n, 4), np.nan, dtype=np.float64)
+
+    rings = geometries.reset_index(drop=True).astype("string").str.extractall(_RING_RE)
+    if rings.empty:
+        return centroids, bounds
+    row_of_ring = rings.index.get_level_values(0).to_numpy()
+    is_outer = (rings["outer"].fillna("") == "(").to_numpy(dtype=bool)
+
+    pairs = rings["coords"].reset_index(drop=True).str.extractall(_PAIR_RE)
+    if pairs.empty:
+        return centroids, bounds
+    ring = pairs.index.get_level_values(0).to_numpy()
+    x = pd.to_numeric(pairs["x"], errors="coerce").to_numpy(dtype=np.float64)  # lon
+    y = pd.to_numeric(pairs["y"], errors="coerce").to_numpy(dtype=np.float64)  # lat
+    row = row_of_ring[ring]
+
+    # bounding box over every vertex of the row
+    ok = ~(np.isnan(x) | np.isnan(y))
+    rows_present = np.unique(row[ok])
+    for out, values, reduce in (
+        (0, y, np.fmin), (1, x, np.fmin), (2, y, np.fmax), (3, x, np.fmax),
+    ):
+        acc = np.full(n, np.nan)
+        reduce.at(acc, row[ok], values[ok])
+        bounds[rows_present, out] = acc[rows_present]
+
+    # vertex mean, used for points/lines and degenerate polygons
+    count = np.bincount(row[ok], minlength=n)
+    mean_x = np.bincount(row[ok], x[ok], minlength=n) / np.maximum(count, 1)
+    mean_y = np.bincount(row[ok], y[ok], minlength=n) / np.maximum(count, 1)
+
+    # shoelace terms between each vertex and the next one in the same ring
+    same_ring = np.zeros(len(ring), dtype=bool)
+    same_ring[:-1] = ring[1:] == ring[:-1]
+    nxt = np.minimum(np.arange(len(ring)) + 1, len(ring) - 1)
+    cross = np.where(same_ring, x * y[nxt] - x[nxt] * y, 0.0)
+    cross = np.nan_to_num(cross)
+    n_rings = len(rings)
+    ring_area = np.bincount(ring, cross, minlength=n_rings) / 2
+    ring_cx = np.bincount(ring, np.nan_to_num((x + x[nxt]) * cross), minlength=n_rings)
+    ring_cy = np.bincount(ring, np.nan_to_num((y + y[nxt]) * cross), minlength=n_rings)
+
+    # outer rings add area, holes subtract it, whatever their winding order
+    sign = np.where(ring_area < 0, -1.0, 1.0) * np.where(is_outer, 1.0, -1.0)
+    weight = np.bincount(row_of_ring, sign * ring_area, minlength=n)
+    sum_cx = np.bincount(row_of_ring, sign * ring_cx / 6, minlength=n)
+    sum_cy = np.bincount(row_of_ring, sign * ring_cy / 6, minlength=n)
+
+    has_area = np.abs(weight) > 1e-18
+    safe = np.where(has_area, weight, 1.0)
+    lon = np.where(has_area, sum_cx / safe, mean_x)
+    lat = np.where(has_area, sum_cy / safe, mean_y)
+    centroids[rows_present, 0] = lat[rows_present]
+    centroids[rows_present, 1] = lon[rows_present]
+    return centroids, bounds
@@ -0,0 +1,120 @@
+"""Time to first audio: one whole-text /tts POST vs StreamingTTSClient, against a local stub server.
+
+    python bench_tts.py --sentences 12 --ms-per-char 4 --workers 1 2 4
+
+The stub answers POST /tts with silent 24 kHz 16-bit mono WAV after a delay
+of `--base-ms` + `--ms-per-char` x len(text), which is roughly how
+synthesis time scales on the real server. Each setting reports time to
+first byte (the first audio for the client), total time and the number of
+requests. The cold run uses an empty segment cache and the warm run repeats
+the same narration against it.
+"""
+import argparse
+import json
+import struct
+import tempfile
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from client_tts import StreamingTTSClient, wav_header
+
+SAMPLE_RATE = 24000
+# PCM, mono, 24 kHz, 16-bit
+FMT = struct.pack("<HHIIHH", 1, 1, SAMPLE_RATE, SAMPLE_RATE * 2, 2, 16)
+
+NARRATION = (
+    "Welcome to Balmy Alley in the Mission District. "
+    "Since the nineteen seventies, artists have covered its garage doors and fences with murals. "
+    "Many of them honor Central American history and the people who shaped this neighborhood. "
+    "Walk slowly and look up, because some of the best work is high on the walls. "
+)
+
+
+def stub_server(base_ms: float, ms_per_char: float, audio_ms_per_char: float) -> ThreadingHTTPServer:
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            text = urllib.parse.parse_qs(body.decode("utf-8")).get("text", [""])[0]
+            time.sleep((base_ms + ms_per_char * len(text)) / 1000)
+            pcm = bytes(2 * int(SAMPLE_RATE * audio_ms_per_char * len(text) / 1000))
+            wav = wav_header(FMT, len(pcm)) + pcm
+            self.send_response(200)
+            self.send_header("Content-Type", "audio/wav")
+            self.send_header("Content-Length", str(len(wav)))
+            self.end_headers()
+            self.wfile.write(wav)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def whole_text(base_url: str, text: str) -> dict:
+    """The old client_tts.tts path: the full narration in one POST"""
+    start = time.perf_counter()
+    first = None
+    with requests.post(base_url + "/tts", data={"text": text, "voice_url": "alba"}, stream=True, timeout=300) as r:
+        r.raise_for_status()
+        for chunk in r.iter_content(chunk_size=64 * 1024):
+            if chunk and first is None:
+                first = time.perf_counter() - start
+    return {"ttfb_ms": round(1000 * first, 1), "total_ms": round(1000 * (time.perf_counter() - start), 1), "requests": 1}
+
+
+def streaming(client: StreamingTTSClient, text: str) -> dict:
+    sent, hits = client.requests_sent, client.cache_hits
+    start = time.perf_counter()
+    first = None
+    for chunk in client.stream(text):
+        if first is None:
+            first = time.perf_counter() - start
+    return {
+        "ttfb_ms": round(1000 * first, 1),
+        "total_ms": round(1000 * (time.perf_counter() - start), 1),
+        "requests": client.requests_sent - sent,
+        "cache_hits": client.cache_hits - hits,
+    }
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--sentences", type=int, default=12, help="narration length, in sentences")
+    p.add_argument("--base-ms", type=float, default=80.0, help="stub per-request overhead")
+    p.add_argument("--ms-per-char", type=float, default=4.0, help="stub synthesis time per character")
+    p.add_argument("--audio-ms-per-char", type=float, default=60.0, help="stub audio length per character")
+    p.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    p.add_argument("--json", help="also write the report to this path")
+    args = p.parse_args()
+
+    sentences = [s + "." for s in NARRATION.split(". ") if s]
+    text = " ".join((sentences * (args.sentences // len(sentences) + 1))[:args.sentences])
+    server = stub_server(args.base_ms, args.ms_per_char, args.audio_ms_per_char)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    report = {"chars": len(text), "whole_text": whole_text(base_url, text), "streaming": {}}
+    for workers in args.workers:
+        with tempfile.TemporaryDirectory() as cache_dir, \
+                StreamingTTSClient(base_url, "alba", max_workers=workers, cache_dir=cache_dir) as client:
+            report["streaming"][f"workers={workers}"] = {
+                "cold": streaming(client, text),
+                "warm": streaming(client, text),
+            }
+    server.shutdown()
+
+    print(json.dumps(report, indent=2))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,231 @@
 import argparse
+import hashlib
+import os
 import pathlib
+import re
+import struct
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator
+
 import requests
+from requests.adapters import HTTPAdapter
+
+# sentence end (. ! ? …, optionally followed by closing quotes/brackets) and the whitespace after it
+_SENTENCE_END = re.compile(r"(?<=[.!?…])[\"')\]]*\s+")
+# size fields of a WAV whose length isn't known yet (what streaming servers send too)
+_UNKNOWN_SIZE = 0xFFFFFFFF
+
+
+def split_sentences(text: str, max_chars: int = 300, first_max_chars: int | None = None) -> list[str]:
+    """Split `text` at sentence boundaries into segments of at most ~max_chars.
+
+    Short sentences are merged so tiny requests don't dominate, and a
+    sentence longer than the limit is split at the last space before it.
+    `first_max_chars` caps the first segment separately: it alone decides
+    the time to first audio.
+    """
+    segments = []
+    current = ""
+    for sentence in _SENTENCE_END.split(" ".join(text.split())):
+        sentence = sentence.strip()
+        limit = first_max_chars if first_max_chars and not segments else max_chars
+        if len(sentence) > limit and current:
+            # what came before goes out first, so the pieces below stay in order
+            segments.append(current)
+            current = ""
+            limit = max_chars
+        while len(sentence) > limit:
+            cut = sentence.rfind(" ", 0, limit)
+            cut = cut if cut > 0 else limit
+            segments.append(sentence[:cut].strip())
+            sentence = sentence[cut:].strip()
+            limit = max_chars
+        if not sentence:
+            continue
+        if current and len(current) + 1 + len(sentence) > limit:
+            segments.append(current)
+            current = sentence
+        else:
+            current = f"{current} {sentence}" if current else sentence
+    if current:
+        segments.append(current)
+    return segments
+
+
+def parse_wav(data: bytes) -> tuple[bytes, bytes]:
+    """(fmt chunk body, PCM bytes) of a RIFF/WAVE file; tolerates streamed files with unknown sizes"""
+    if data[:4] != b"RIFF" or data[8:12] != b"WAVE":
+        raise ValueError("TTS server did not return a WAV file")
+    fmt = None
+    pos = 12
+    while pos + 8 <= len(data):
+        chunk_id, size = data[pos:pos + 4], struct.unpack("<I", data[pos + 4:pos + 8])[0]
+        body = pos + 8
+        if chunk_id == b"data":
+            if fmt is None:
+                raise ValueError("WAV data chunk before fmt chunk")
+            end = len(data) if size in (0, _UNKNOWN_SIZE) else min(body + size, len(data))
+            return fmt, data[body:end]
+        if chunk_id == b"fmt ":
+            fmt = data[body:body + size]
+        pos = body + size + (size & 1)
+    raise ValueError("WAV file has no data chunk")
+
+
+def wav_header(fmt: bytes, data_size: int = _UNKNOWN_SIZE) -> bytes:
+    riff_size = _UNKNOWN_SIZE if data_size == _UNKNOWN_SIZE else 4 + 8 + len(fmt) + 8 + data_size
+    return (b"RIFF" + struct.pack("<I", riff_size) + b"WAVE"
+            + b"fmt " + struct.pack("<I", len(fmt)) + fmt
+            + b"data" + struct.pack("<I", data_size))
+
+
+class SegmentCache:
+    """Synthesized segments on disk, keyed by a hash of (server URL, voice, text).
+
+    Files are written to a temp name and renamed, so a concurrent reader
+    never sees a partial WAV.
+    """
+
+    def __init__(self, root: str):
+        self.root = pathlib.Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
 
+    @staticmethod
+    def key(url: str, voice: str | None, text: str) -> str:
+        # the server decides the model, so the same voice and text from another server is another clip
+        return hashlib.sha256(f"{url}\0{voice or ''}\0{text}".encode("utf-8")).hexdigest()
 
-def tts(base_url: str, text: str, voice_url: str | None, out_path: str):
-    url = base_url.rstrip("/") + "/tts"
-    data = {"text": text}
-    if voice_url:
-        data["voice_url"] = voice_url
+    def _path(self, key: str) -> pathlib.Path:
+        return self.root / key[:2] / f"{key}.wav"
 
-    with requests.post(url, data=data, stream=True, timeout=300) as r:
+    def get(self, key: str) -> bytes | None:
+        try:
+            return self._path(key).read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def put(self, key: str, data: bytes):
+        path = self._path(key)
+        path.parent.mkdir(exist_ok=True)
+        tmp_path = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+
+
+class StreamingTTSClient:
+    """Client for the pocket-tts `/tts` endpoint that streams long texts sentence by sentence.
+
+    Text is split at sentence boundaries and up to `max_workers` segments
+    are synthesized at once over one pooled `requests.Session`. stream()
+    yields a WAV header and then each segment's PCM in order, as soon as the
+    first segment is ready. Finished segments are cached by (server, voice,
+    text) under `cache_dir`, or env TTS_CACHE_DIR when it is None; with
+    neither set, nothing is cached.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        voice_url: str | None = None,
+        max_workers: int = 4,
+        max_chars: int = 300,
+        first_max_chars: int = 120,
+        cache_dir: str | None = None,
+        timeout: float = 300,
+    ):
+        self.url = base_url.rstrip("/") + "/tts"
+        self.voice_url = voice_url
+        self.max_workers = max(1, max_workers)
+        self.max_chars = max_chars
+        self.first_max_chars = first_max_chars
+        self.timeout = timeout
+        cache_dir = cache_dir or os.getenv("TTS_CACHE_DIR")
+        self.cache = SegmentCache(cache_dir) if cache_dir else None
+        self.session = requests.Session()
+        # one keep-alive connection per worker instead of a new TLS handshake per segment
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="tts")
+        self.requests_sent = 0
+        self.cache_hits = 0
+
+    def synthesize(self, text: str, voice_url: str | None = None) -> bytes:
+        """One segment as a complete WAV (from the cache when this voice already said it)"""
+        voice_url = voice_url or self.voice_url
+        key = SegmentCache.key(self.url, voice_url, text)
+        if self.cache is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                self.cache_hits += 1
+                return cached
+
+        data = {"text": text}
+        if voice_url:
+            data["voice_url"] = voice_url
+        self.requests_sent += 1
+        r = self.session.post(self.url, data=data, timeout=self.timeout)
         r.raise_for_status()
+        if self.cache is not None:
+            self.cache.put(key, r.content)
+        return r.content
+
+    def stream(self, text: str, voice_url: str | None = None, chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+        """WAV bytes for `text`: a header with open-ended sizes, then every segment's PCM in order"""
+        segments = split_sentences(text, self.max_chars, self.first_max_chars)
+        if not segments:
+            return
+        # the pool runs them FIFO, so segment 0 is always among the first requests out
+        futures = [self._pool.submit(self.synthesize, segment, voice_url) for segment in segments]
+        try:
+            fmt = None
+            for future in futures:
+                segment_fmt, pcm = parse_wav(future.result())
+                if fmt is None:
+                    fmt = segment_fmt
+                    yield wav_header(fmt)
+                elif segment_fmt != fmt:
+                    raise ValueError("TTS segments came back in different audio formats")
+                for start in range(0, len(pcm), chunk_size):
+                    yield pcm[start:start + chunk_size]
+        finally:
+            # a consumer that stops early shouldn't keep paying for the rest
+            for future in futures:
+                future.cancel()
+
+    def save(self, text: str, out_path: str, voice_url: str | None = None) -> pathlib.Path:
+        """Write the whole narration to `out_path`, then patch in the real WAV sizes"""
         out_file = pathlib.Path(out_path)
+        data_size = 0
+        fmt = None
         with out_file.open("wb") as f:
-            for chunk in r.iter_content(chunk_size=1024 * 64):
-                if chunk:
-                    f.write(chunk)
+            for i, chunk in enumerate(self.stream(text, voice_url)):
+                if i == 0:
+                    # the header: RIFF/WAVE (12 bytes), "fmt " + size (8), fmt body, "data" + size (8)
+                    fmt = chunk[20:-8]
+                else:
+                    data_size += len(chunk)
+                f.write(chunk)
+            if fmt is not None:
+                f.seek(0)
+                f.write(wav_header(fmt, data_size))
+        return out_file
+
+    def close(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
 
+def tts(base_url: str, text: str, voice_url: str | None, out_path: str, max_workers: int = 4):
+    with StreamingTTSClient(base_url, voice_url, max_workers=max_workers) as client:
+        out_file = client.save(text, out_path)
     print(f"Saved WAV to: {out_file.resolve()}")
 
 
@@ -26,6 +235,7 @@ if __name__ == "__main__":
     p.add_argument("--text", default="hello this is fucking awesome", help="text to synthesize")
     p.add_argument("--voice-url", default="alba", help="e.g. alba or hf://... or https://...")
     p.add_argument("--out", default="out.wav", help="output wav path")
+    p.add_argument("--max-workers", type=int, default=4, help="segments synthesized at once")
     args = p.parse_args()
 
-    tts(args.base_url, args.text, args.voice_url, args.out)
\ No newline at end of file
+    tts(args.base_url, args.text, args.voice_url, args.out, args.max_workers)
@@ -0,0 +1,41 @@
+from client_tts import SegmentCache, StreamingTTSClient, split_sentences
+
+
+def _words(n: int) -> str:
+    return " ".join(f"w{i}" for i in range(n))
+
+
+def test_long_sentence_after_pending_text_keeps_order():
+    text = f"Hi there. {_words(40)}. The end."
+    segments = split_sentences(text, max_chars=60, first_max_chars=30)
+
+    assert segments[0] == "Hi there."
+    assert " ".join(segments) == " ".join(text.split())
+    assert all(len(segment) <= 60 for segment in segments)
+
+
+def test_first_segment_is_capped_separately():
+    segments = split_sentences(_words(40), max_chars=60, first_max_chars=30)
+
+    assert len(segments[0]) <= 30
+    assert all(len(segment) <= 60 for segment in segments[1:])
+    assert " ".join(segments) == _words(40)
+
+
+def test_short_sentences_are_merged():
+    assert split_sentences("One. Two. Three.", max_chars=60) == ["One. Two. Three."]
+
+
+def test_segment_cache_key_includes_server():
+    assert SegmentCache.key("http://a/tts", "alba", "Hi.") != SegmentCache.key("http://b/tts", "alba", "Hi.")
+    assert SegmentCache.key("http://a/tts", "alba", "Hi.") != SegmentCache.key("http://a/tts", "marius", "Hi.")
+
+
+def test_cache_dir_is_read_from_env_at_construction(tmp_path, monkeypatch):
+    monkeypatch.delenv("TTS_CACHE_DIR", raising=False)
+    with StreamingTTSClient("http://localhost:9000") as client:
+        assert client.cache is None
+
+    monkeypatch.setenv("TTS_CACHE_DIR", str(tmp_path))
+    with StreamingTTSClient("http://localhost:9000") as client:
+        assert client.cache.root == tmp_path